@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+Micro-benchmark of the de-sorting step of mk_temp_aggr().
+
+Usage: python benchmarks/bench_de_sort.py [n_points]
+"""
+
+# Import from other Python packages
+import sys
+import timeit
+import numpy as np
+
+# Import from current package
+from mannkendall import mk_tools as mkt
+
+def de_sort_loop(vals, inds):
+    """ The original, pure Python, implementation of de_sort(). """
+
+    out = np.zeros_like(vals)
+    for (sorted_ind, unsorted_ind) in enumerate(inds):
+        out[unsorted_ind] = vals[sorted_ind]
+
+    return out
+
+def main(n_points=10**6, n_keys=5, n_tas=12):
+    """ Time the de-sorting and re-splitting of n_keys prewhitened series of n_points.
+
+    Args:
+        n_points (int, optional): length of the series. Defaults to 10**6.
+        n_keys (int, optional): number of prewhitened series. Defaults to 5.
+        n_tas (int, optional): number of temporal aggregations. Defaults to 12.
+
+    """
+
+    rng = np.random.default_rng(42)
+    sort_ind = rng.permutation(n_points)
+    vals = {key: rng.random(n_points) for key in range(n_keys)}
+    len_tas = [len(item) for item in np.array_split(np.arange(n_points), n_tas)]
+
+    def run_loop():
+        for key in vals:
+            desorted = de_sort_loop(vals[key], sort_ind)
+            np.split(desorted, np.array([np.sum(len_tas[:ind+1]) for ind in range(n_tas-1)]))
+
+    def run_vectorized():
+        unsort_ind = mkt.de_sort(np.arange(n_points), sort_ind)
+        split_ind = np.cumsum(len_tas)[:-1]
+        for key in vals:
+            np.split(vals[key][unsort_ind], split_ind)
+
+    t_loop = min(timeit.repeat(run_loop, number=1, repeat=3))
+    t_vec = min(timeit.repeat(run_vectorized, number=1, repeat=3))
+
+    print('de_sort + split of %i x %i points' % (n_keys, n_points))
+    print('  python loop: %10.4f s' % (t_loop))
+    print('  vectorized:  %10.4f s  (x%.0f)' % (t_vec, t_loop / t_vec))
+
+if __name__ == '__main__':
+    main(*[int(item) for item in sys.argv[1:]])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+Benchmark of the time needed to import mannkendall in a fresh Python process, which matters when
+many short-lived worker processes are spawned.
+
+Usage: python benchmarks/bench_import.py [budget_s]
+
+Exits with an error if the import takes longer than the budget (in s), or if it pulls in one of
+the slow optional modules listed in LAZY_MODULES.
+"""
+
+# Import from other Python packages
+import subprocess
+import sys
+
+#: float: default import time budget, in s
+BUDGET = 0.5
+
+#: list of str: modules that must only be imported by the functions that need them
+LAZY_MODULES = ['scipy.stats', 'scipy.fft', 'numba']
+
+#: str: the code run in the fresh process
+CODE = """
+import sys, time
+start = time.perf_counter()
+import mannkendall
+print(time.perf_counter() - start)
+print(' '.join(sorted(set(sys.modules) & set(%r))))
+""" % (LAZY_MODULES)
+
+def measure(repeat=5):
+    """ Measure the import time of mannkendall.
+
+    Args:
+        repeat (int, optional): number of fresh processes. Defaults to 5.
+
+    Returns:
+        (float, list of str): the best import time in s, and the lazy modules that got imported.
+
+    """
+
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', CODE], capture_output=True, text=True,
+                             check=True).stdout.split('\n')
+        times += [float(out[0])]
+
+    return (min(times), out[1].split())
+
+def main(budget=BUDGET):
+    """ Measure the import time, and check it against a budget.
+
+    Args:
+        budget (float, optional): the import time budget, in s. Defaults to BUDGET.
+
+    """
+
+    (wall, loaded) = measure()
+    print('import mannkendall: %.3f s (budget: %.3f s)' % (wall, budget))
+    if loaded:
+        print('Eagerly imported: %s' % (', '.join(loaded)))
+    if wall > budget or loaded:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(*[float(item) for item in sys.argv[1:]])
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+Benchmark of the numpy and numba backends of the pairwise kernels (see
+mk_hardcoded.KERNEL_BACKEND), on the synthetic series of bench_suite.py.
+
+Usage: python benchmarks/bench_numba.py [n_points ...]
+"""
+
+# Import from other Python packages
+import sys
+import timeit
+import numpy as np
+from bench_suite import make_series
+
+# Import from current package
+from mannkendall import mk_hardcoded as mkh
+from mannkendall import mk_kernels as mkk
+from mannkendall import mk_stats as mks
+from mannkendall import mk_tools as mkt
+
+#: list of int: default series lengths
+SIZES = [10**4, 3 * 10**4, 10**5]
+
+def _routines(obs_dts, obs):
+    """ The benchmarked routines, for a given series.
+
+    Args:
+        obs_dts (ndarray of numpy.datetime64): the observation times.
+        obs (ndarray of float): the observations.
+
+    Returns:
+        dict: the routines, as functions without arguments.
+
+    """
+
+    valid = ~np.isnan(obs)
+    t_us = mkt.dts_to_us(obs_dts)[valid]
+    years = mkt.dts_to_years(obs_dts)[valid]
+    n_pairs = np.count_nonzero(valid) * (np.count_nonzero(valid) - 1) // 2
+    ranks = np.array([(n_pairs - 1) // 2, n_pairs // 2])
+    resamples = obs[valid][np.random.default_rng(42).permuted(
+        np.tile(np.arange(len(t_us)), (20, 1)), axis=1)]
+
+    return {
+        's_test': lambda: mks.s_test(obs, obs_dts),
+        's_stat_rows[20]': lambda: mkk.s_stat_rows(resamples, years),
+        'sen_slope[chunked]': lambda: mkk.pairwise_stats(t_us, obs[valid], ranks, years=years,
+                                                         max_memory=mkh.SEN_CHUNKED_MEMORY),
+        }
+
+def main(sizes=None):
+    """ Time the routines with both backends, and print the speedups.
+
+    Args:
+        sizes (list of int, optional): the series lengths. Defaults to None = SIZES.
+
+    """
+
+    sizes = SIZES if sizes is None else sizes
+
+    # Compile the numba kernels once and for all
+    mkh.KERNEL_BACKEND = 'numba'
+    for func in _routines(*make_series(100)).values():
+        func()
+
+    for n in sizes:
+        routines = _routines(*make_series(n))
+        for (name, func) in routines.items():
+            times = {}
+            for backend in ['numpy', 'numba']:
+                mkh.KERNEL_BACKEND = backend
+                times[backend] = min(timeit.repeat(func, number=1, repeat=3 if n < 10**5 else 1))
+            print('%-20s n=%-8i numpy: %9.3f s   numba: %9.3f s   speedup: x%.1f' %
+                  (name, n, times['numpy'], times['numba'], times['numpy'] / times['numba']),
+                  flush=True)
+
+if __name__ == '__main__':
+    main([int(item) for item in sys.argv[1:]] or None)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+Benchmark suite of the public routines of the mannkendall package.
+
+Each routine is run on synthetic AR(1) series with a linear trend, a fraction of NaNs and data
+quantized at the resolution. The wall time (best of several runs) and the peak memory allocated
+(measured with tracemalloc, in a separate run) are recorded for each series length.
+
+Usage:
+    python benchmarks/bench_suite.py --save base.json
+    python benchmarks/bench_suite.py --compare base.json
+
+Run with --help for all the options. The routines whose cost grows fast with the series length are
+only run up to the length set in MAX_N, unless --no-caps is set.
+"""
+
+# Import from other Python packages
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+from scipy.signal import lfilter
+
+# Import from current package
+from mannkendall import __version__
+from mannkendall import mk_hardcoded as mkh
+from mannkendall import mk_main as mkm
+from mannkendall import mk_stats as mks
+from mannkendall import mk_tools as mkt
+from mannkendall import mk_white as mkw
+
+#: list of int: default series lengths
+SIZES = [10**2, 10**3, 10**4, 10**5, 10**6]
+
+#: float: resolution of the synthetic data
+RESOLUTION = 0.01
+
+#: dict: largest series length benchmarked by default for each routine
+MAX_N = {'mk_temp_aggr': 10**5, 'prewhite': 10**5, 'sen_slope': 10**5}
+
+def make_series(n, freq='D', nan_frac=0.1, ar1=0.5, trend=0.1, seed=42):
+    """ Create a synthetic time series.
+
+    Args:
+        n (int): number of observations.
+        freq (str, optional): 'D' for daily, 'h' for hourly data. Defaults to 'D'.
+        nan_frac (float, optional): fraction of missing data. Defaults to 0.1.
+        ar1 (float, optional): first lag autocorrelation of the noise. Defaults to 0.5.
+        trend (float, optional): trend in units/y. Defaults to 0.1.
+        seed (int, optional): seed of the random number generator. Defaults to 42.
+
+    Returns:
+        (ndarray of numpy.datetime64, ndarray of float): the observation times and values.
+
+    """
+
+    rng = np.random.default_rng(seed)
+
+    obs_dts = np.datetime64('1990-01-01T00', freq) + np.arange(n)
+    years = mkt.dts_to_us(obs_dts) / 1e6 / (365.25 * 24 * 3600)
+
+    obs = trend * years + lfilter([1], [1, -ar1], rng.normal(size=n))
+    obs = np.round(obs / RESOLUTION) * RESOLUTION
+    obs[rng.random(n) < nan_frac] = np.nan
+
+    return (obs_dts, obs)
+
+def _mk_temp_aggr(pw_method):
+    """ Run mk_temp_aggr() with a given prewhitening method, on monthly temporal aggregations. """
+
+    def run(obs_dts, obs):
+        months = obs_dts.astype('datetime64[M]').astype(int) % 12
+        mkm.mk_temp_aggr([obs_dts[months == ind] for ind in range(12)],
+                         [obs[months == ind] for ind in range(12)],
+                         RESOLUTION, pw_method=pw_method)
+    return run
+
+def _sen_slope(obs_dts, obs):
+    """ Run sen_slope(), with the variance it needs. """
+
+    t = mkt.nb_tie(obs, RESOLUTION)
+    (_, n) = mks.s_test(obs, obs_dts)
+    mks.sen_slope(obs_dts, obs, mkt.kendall_var(obs, t, n))
+
+def _kendall_var(obs_dts, obs):
+    """ Run kendall_var(), with the ties it needs. """
+
+    t = mkt.nb_tie(obs, RESOLUTION)
+    (_, n) = mks.s_test(obs, obs_dts)
+    mkt.kendall_var(obs, t, n)
+
+#: dict: the benchmarked routines, as functions of (obs_dts, obs)
+ROUTINES = {**{'mk_temp_aggr[%s]' % (item): _mk_temp_aggr(item)
+               for item in mkh.VALID_PW_METHODS},
+            'prewhite': lambda obs_dts, obs: mkw.prewhite(obs.copy(), obs_dts, RESOLUTION),
+            'sen_slope': _sen_slope,
+            's_test': lambda obs_dts, obs: mks.s_test(obs, obs_dts),
+            'nb_tie': lambda obs_dts, obs: mkt.nb_tie(obs, RESOLUTION),
+            'nanautocorr': lambda obs_dts, obs: mkt.nanautocorr(obs, 10),
+            'kendall_var': _kendall_var,
+           }
+
+def run_one(func, obs_dts, obs, repeat=3):
+    """ Measure the wall time and peak memory of a routine.
+
+    Args:
+        func (callable): the routine, as a function of (obs_dts, obs).
+        obs_dts (ndarray of numpy.datetime64): the observation times.
+        obs (ndarray of float): the observations.
+        repeat (int, optional): number of timed runs. Defaults to 3.
+
+    Returns:
+        (float, float): the best wall time in s, and the peak memory in MB.
+
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(obs_dts, obs)
+        times += [time.perf_counter() - start]
+
+    # tracemalloc slows things down: measure the memory separately
+    tracemalloc.start()
+    func(obs_dts, obs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return (min(times), peak / 2**20)
+
+def run_suite(routines=None, sizes=None, freq='D', nan_frac=0.1, ar1=0.5, repeat=3, caps=True,
+              seed=42):
+    """ Run the benchmark suite.
+
+    Args:
+        routines (list of str, optional): the routines to benchmark. Defaults to None = all.
+        sizes (list of int, optional): the series lengths. Defaults to None = SIZES.
+        freq (str, optional): 'D' for daily, 'h' for hourly data. Defaults to 'D'.
+        nan_frac (float, optional): fraction of missing data. Defaults to 0.1.
+        ar1 (float, optional): first lag autocorrelation of the noise. Defaults to 0.5.
+        repeat (int, optional): number of timed runs. Defaults to 3.
+        caps (bool, optional): whether to respect MAX_N. Defaults to True.
+        seed (int, optional): seed of the random number generator. Defaults to 42.
+
+    Returns:
+        list of dict: the results.
+
+    """
+
+    routines = list(ROUTINES) if routines is None else routines
+    sizes = SIZES if sizes is None else sizes
+
+    out = []
+    for n in sizes:
+        (obs_dts, obs) = make_series(n, freq=freq, nan_frac=nan_frac, ar1=ar1, seed=seed)
+        for name in routines:
+            if caps and n > MAX_N.get(name.split('[')[0], np.inf):
+                continue
+            try:
+                (wall, peak) = run_one(ROUTINES[name], obs_dts, obs, repeat=repeat)
+            except Exception as err:
+                # Keep going: a failure is a result too
+                out += [{'routine': name, 'n': n, 'error': repr(err)}]
+                print('%-22s n=%-8i FAILED: %r' % (name, n, err), flush=True)
+                continue
+            out += [{'routine': name, 'n': n, 'time_s': wall, 'peak_mb': peak}]
+            print('%-22s n=%-8i %10.4f s %10.1f MB' % (name, n, wall, peak), flush=True)
+
+    return out
+
+def compare(results, baseline, tolerance=1.2):
+    """ Compare some results with a baseline.
+
+    Args:
+        results (list of dict): the new results.
+        baseline (list of dict): the baseline results.
+        tolerance (float, optional): the largest acceptable ratio new/baseline. Defaults to 1.2.
+
+    Returns:
+        list of str: the regressions, including the routines that now fail.
+
+    """
+
+    ref = {(item['routine'], item['n']): item for item in baseline if 'error' not in item}
+
+    regressions = []
+    for item in results:
+        if (item['routine'], item['n']) not in ref:
+            continue
+        if 'error' in item:
+            regressions += ['%s n=%i: %s' % (item['routine'], item['n'], item['error'])]
+            continue
+        for field in ['time_s', 'peak_mb']:
+            ratio = item[field] / max(ref[(item['routine'], item['n'])][field], 1e-9)
+            if ratio > tolerance:
+                regressions += ['%s n=%i %s: x%.2f' % (item['routine'], item['n'], field, ratio)]
+
+    return regressions
+
+def main():
+    """ Run the benchmark suite from the command line. """
+
+    parser = argparse.ArgumentParser(description='Benchmark suite of the mannkendall package.')
+    parser.add_argument('--routines', nargs='+', choices=list(ROUTINES), default=None,
+                        metavar='ROUTINE', help='routines to run (default: all): %(choices)s')
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help='series lengths')
+    parser.add_argument('--freq', choices=['D', 'h'], default='D',
+                        help='daily or hourly data (default: %(default)s)')
+    parser.add_argument('--nan-frac', type=float, default=0.1,
+                        help='fraction of NaNs (default: %(default)s)')
+    parser.add_argument('--ar1', type=float, default=0.5,
+                        help='lag-1 autocorrelation (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed runs (default: %(default)s)')
+    parser.add_argument('--no-caps', action='store_true', help='ignore MAX_N')
+    parser.add_argument('--save', default=None, help='save the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='compare with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=1.2,
+                        help='largest acceptable ratio with --compare (default: %(default)s)')
+    args = parser.parse_args()
+
+    results = run_suite(routines=args.routines, sizes=args.sizes, freq=args.freq,
+                        nan_frac=args.nan_frac, ar1=args.ar1, repeat=args.repeat,
+                        caps=not args.no_caps)
+
+    if args.save is not None:
+        with open(args.save, 'w') as fid:
+            json.dump({'version': __version__, 'freq': args.freq, 'nan_frac': args.nan_frac,
+                       'ar1': args.ar1, 'results': results}, fid, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as fid:
+            regressions = compare(results, json.load(fid)['results'], tolerance=args.tolerance)
+        for item in regressions:
+            print('REGRESSION: %s' % (item))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -41,10 +41,10 @@ setup(
     long_description_content_type="text/markdown",
     python_requires='>=3.8.0',
     install_requires=["numpy>=1.19.2",
-                      "scipy>=1.5.0",
-                      "statsmodels>=0.12.0"],
+                      "scipy>=1.5.0"],
     extras_require={
-        'dev': ['sphinx', 'sphinx-rtd-theme', 'pylint', 'pytest']
+        'dev': ['sphinx', 'sphinx-rtd-theme', 'pylint', 'pytest'],
+        'numba': ['numba>=0.53.0'],
     },
     classifiers=[
 
@@ -14,3 +14,4 @@ from .mk_version import VERSION as __version__
 
 # To simplify the call of the highest level functions
 from .mk_main import *
+from .mk_state import MKState
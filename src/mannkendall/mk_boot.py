@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors of the Python version of the code listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains the resampling (block permutation and block bootstrap) significance tests of the
+mannkendall package.
+"""
+
+# Import the required packages
+import numpy as np
+
+# Import from this package
+from . import mk_hardcoded as mkh
+from . import mk_kernels as mkk
+from . import mk_tools as mkt
+
+
+def _block_index(rng, n, n_rows, block_len, replace):
+    """ Draw resampling indices made of blocks of consecutive data points.
+
+    Args:
+        rng (numpy.random.Generator): the random number generator.
+        n (int): the number of data points.
+        n_rows (int): the number of resamples.
+        block_len (int): the length of the blocks.
+        replace (bool): if False, the (non-overlapping) blocks are permuted. If True, blocks starting
+            anywhere are drawn with replacement (moving block bootstrap).
+
+    Returns:
+        ndarray of int: the indices, of shape (n_rows, n).
+
+    """
+
+    block_len = min(block_len, n)
+    n_blocks = int(np.ceil(n / block_len))
+
+    if replace:
+        starts = rng.integers(0, n - block_len + 1, size=(n_rows, n_blocks))
+        return (starts[:, :, None] + np.arange(block_len)).reshape(n_rows, -1)[:, :n]
+
+    # Pad the last block with -1, and drop these after the permutation.
+    blocks = np.arange(n_blocks * block_len).reshape(n_blocks, block_len)
+    blocks[blocks >= n] = -1
+    order = rng.permuted(np.tile(np.arange(n_blocks), (n_rows, 1)), axis=1)
+    out = blocks[order].reshape(n_rows, -1)
+
+    return out[out >= 0].reshape(n_rows, n)
+
+def _check_boot_args(n_boot, block_len, batch):
+    """ Sanity checks of the resampling options.
+
+    Args:
+        n_boot (int): the maximum number of resamples.
+        block_len (int|None): the length of the blocks.
+        batch (int): the number of resamples evaluated at once.
+
+    """
+
+    for (name, item) in [('n_boot', n_boot), ('batch', batch)]:
+        if not isinstance(item, (int, np.integer)) or item < 1:
+            raise Exception('Ouch ! %s should be an int >= 1, not: %s' % (name, item))
+    if block_len is not None and (not isinstance(block_len, (int, np.integer)) or block_len < 1):
+        raise Exception('Ouch ! block_len should be None or an int >= 1, not: %s' % (block_len))
+
+def default_block_len(n):
+    """ Default block length of the resampling tests, n^(1/3) (Hall et al., 1995).
+
+    Args:
+        n (int): the number of valid data points.
+
+    Returns:
+        int: the block length.
+
+    """
+
+    return max(1, int(np.round(n ** (1/3))))
+
+def perm_p(s, multi_obs, multi_obs_dts, alpha_mk=95, n_boot=None, block_len=None, batch=None,
+           seed=0):
+    """ Probability of the MK test from a block permutation test.
+
+    The valid data of each series are cut in blocks of consecutive points, which are shuffled
+    while the observation times are kept. This preserves the short term autocorrelation of the
+    data, but destroys any trend. The S statistics of a batch of resamples are computed at once,
+    and the test stops as soon as the p-value is known to be on one side of 1-alpha_mk/100 with
+    a BOOT_STOP_CL confidence.
+
+    Args:
+        s (float): the S statistic, summed over all the series.
+        multi_obs (list of ndarray of float): the observations of each series.
+        multi_obs_dts (list of ndarray of numpy.datetime64): the observation times of each series.
+        alpha_mk (float, optional): confidence level of the MK test in %. Defaults to 95.
+        n_boot (int, optional): maximum number of resamples. Defaults to None =
+            mk_hardcoded.BOOT_N.
+        block_len (int, optional): length of the blocks. Defaults to None = default_block_len().
+        batch (int, optional): number of resamples evaluated at once. Defaults to None =
+            mk_hardcoded.BOOT_BATCH.
+        seed (int, optional): seed of the random number generator. Defaults to 0.
+
+    Returns:
+        (float, int): the (two-sided) probability, and the number of resamples used.
+
+    """
+
+    n_boot = mkh.BOOT_N if n_boot is None else n_boot
+    batch = mkh.BOOT_BATCH if batch is None else batch
+    _check_boot_args(n_boot, block_len, batch)
+
+    if np.isnan(s):
+        return (np.nan, 0)
+
+    # Keep only the valid data
+    valid = [~np.isnan(item) for item in multi_obs]
+    multi_obs = [item[valid[ind]] for (ind, item) in enumerate(multi_obs)]
+    multi_years = [mkt.dts_to_years(item[valid[ind]]) for (ind, item) in enumerate(multi_obs_dts)]
+
+    rng = np.random.default_rng(seed)
+    from scipy.stats import norm
+
+    z_stop = norm.ppf(1 - (1 - mkh.BOOT_STOP_CL/100) / 2)
+    p_alpha = 1 - alpha_mk/100
+
+    n_done = 0
+    n_extreme = 0
+    while n_done < n_boot:
+        n_rows = min(batch, n_boot - n_done)
+
+        # The S statistics of all the resamples of this batch, summed over the series
+        s_boot = np.zeros(n_rows, dtype=np.int64)
+        for (ind, obs) in enumerate(multi_obs):
+            if len(obs) < 2:
+                continue
+            blen = default_block_len(len(obs)) if block_len is None else block_len
+            idx = _block_index(rng, len(obs), n_rows, blen, replace=False)
+            s_boot += mkk.s_stat_rows(obs[idx], multi_years[ind])
+
+        n_extreme += int(np.sum(np.abs(s_boot) >= np.abs(s)))
+        n_done += n_rows
+
+        # Stop as soon as the decision is clear
+        p_val = (n_extreme + 1) / (n_done + 1)
+        if np.abs(p_val - p_alpha) > z_stop * np.sqrt(p_val * (1 - p_val) / n_done):
+            break
+
+    return ((n_extreme + 1) / (n_done + 1), n_done)
+
+def _sen_rows(t_us, obs):
+    """ Compute the Sen's slope of many series sharing the same observation times.
+
+    Args:
+        t_us (ndarray of int): the observation times, in microseconds. Must be 1-D.
+        obs (ndarray of float): the observations, one series per row. Must be 2-D, without NaNs.
+
+    Returns:
+        ndarray of float: the Sen's slope of each row, in 1/s.
+
+    """
+
+    (n_rows, n) = np.shape(obs)
+    n_pairs = n * (n-1) // 2
+    ranks = np.unique([(n_pairs-1)//2, n_pairs//2])
+
+    out = np.zeros(n_rows)
+    chunk = mkh.PAIRWISE_BLOCK // max(1, n_pairs)
+
+    if chunk >= 2:
+        # Several series at once
+        (p_i, p_j) = np.triu_indices(n, 1)
+        d_t = (t_us[p_j] - t_us[p_i]) / 1e6
+        for start in range(0, n_rows, chunk):
+            slopes = (obs[start:start+chunk, p_j] - obs[start:start+chunk, p_i]) / d_t
+            out[start:start+chunk] = np.mean(np.partition(slopes, ranks, axis=1)[:, ranks], axis=1)
+        return out
+
+    # Long series: one at a time, with the same kernels as mk_stats.sen_slope(), so that the
+    # memory footprint stays bounded
+    select = n > mkh.SEN_SELECT_MIN_N and len(np.unique(t_us)) == n
+    for (ind, item) in enumerate(obs):
+        if select:
+            out[ind] = np.mean(mkk.slope_order_stats(t_us, item, ranks))
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out[ind] = np.mean(mkk.pairwise_stats(t_us, item, ranks,
+                                                      max_memory=mkh.SEN_CHUNKED_MEMORY)[1])
+
+    return out
+
+def _quantile_spread(samp, levels, z_stop):
+    """ Width of the distribution-free confidence intervals of some quantiles of a sample.
+
+    The interval of the quantile q spans the order statistics n*q +/- z_stop*sqrt(n*q*(1-q)) of
+    the n sorted values (normal approximation of the binomial distribution).
+
+    Args:
+        samp (ndarray of float): the sorted sample, without NaNs.
+        levels (ndarray of float): the levels of the quantiles, between 0 and 1.
+        z_stop (float): the half-width of the intervals, in standard deviations.
+
+    Returns:
+        ndarray of float: the width of the interval of each quantile.
+
+    """
+
+    n = len(samp)
+    half = z_stop * np.sqrt(n * levels * (1 - levels))
+    low = np.clip(np.floor(n * levels - half).astype(int), 0, n - 1)
+    high = np.clip(np.ceil(n * levels + half).astype(int), 0, n - 1)
+
+    return samp[high] - samp[low]
+
+def boot_sen_cl(obs_dts, obs, slope, alpha_cl=90, n_boot=None, block_len=None, batch=None,
+                seed=0):
+    """ Confidence limits of the Sen's slope from a moving block bootstrap of the residuals.
+
+    The residuals of the data around the Sen's slope are resampled in blocks of consecutive points
+    (with replacement), added back to the trend, and the Sen's slope of each resample is computed.
+    The confidence limits are the percentiles of these slopes. The bootstrap stops as soon as the
+    BOOT_STOP_CL confidence interval of both limits is narrower than BOOT_CL_TOL times their
+    distance.
+
+    Each resample costs one Sen's slope. Up to mk_hardcoded.PAIRWISE_BLOCK pairs, several
+    resamples are processed at once. Longer series are processed one resample at a time, by slope
+    selection in O(n log(n)^2) operations (~0.2 s for 20000 points) if their observation times are
+    unique, and with the 'chunked' method (O(n^2), within SEN_CHUNKED_MEMORY) otherwise. Lower
+    n_boot or raise BOOT_CL_TOL to bound the run time for long series.
+
+    Args:
+        obs_dts (ndarray of numpy.datetime64): the observation times.
+        obs (ndarray of float): the observations.
+        slope (float): the Sen's slope of the data, in 1/s.
+        alpha_cl (float, optional): confidence level of the Sen's slope in %. Defaults to 90.
+        n_boot (int, optional): maximum number of resamples. Defaults to None =
+            mk_hardcoded.BOOT_N.
+        block_len (int, optional): length of the blocks. Defaults to None = default_block_len().
+        batch (int, optional): number of resamples drawn at once, between two checks of the early
+            stopping. Defaults to None = mk_hardcoded.BOOT_BATCH.
+        seed (int, optional): seed of the random number generator. Defaults to 0.
+
+    Returns:
+        (float, float): the lower and upper confidence limits, in 1/s.
+
+    """
+
+    n_boot = mkh.BOOT_N if n_boot is None else n_boot
+    batch = mkh.BOOT_BATCH if batch is None else batch
+    _check_boot_args(n_boot, block_len, batch)
+
+    valid = ~np.isnan(obs)
+    if np.isnan(slope) or np.count_nonzero(valid) < 2:
+        return (np.nan, np.nan)
+
+    t_us = mkt.dts_to_us(obs_dts)[valid]
+    trend = slope * (t_us - t_us[0]) / 1e6
+    resid = obs[valid] - trend
+    blen = default_block_len(len(resid)) if block_len is None else block_len
+
+    rng = np.random.default_rng(seed)
+    from scipy.stats import norm
+
+    z_stop = norm.ppf(1 - (1 - mkh.BOOT_STOP_CL/100) / 2)
+    levels = np.array([(1 - alpha_cl/100) / 2, 1 - (1 - alpha_cl/100) / 2])
+
+    slopes = np.zeros(0)
+    while len(slopes) < n_boot:
+        idx = _block_index(rng, len(resid), min(batch, n_boot - len(slopes)), blen, replace=True)
+        slopes = np.concatenate([slopes, _sen_rows(t_us, trend + resid[idx])])
+
+        # Stop as soon as both confidence limits are known precisely enough
+        samp = np.sort(slopes[~np.isnan(slopes)])
+        if len(samp) == 0:
+            continue
+        (lcl, ucl) = np.quantile(samp, levels)
+        if np.all(_quantile_spread(samp, levels, z_stop) <= mkh.BOOT_CL_TOL * (ucl - lcl)):
+            break
+
+    return tuple(np.nanquantile(slopes, levels))
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors of the Python version of the code listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains the exact null distribution of the Mann-Kendall S statistic.
+"""
+
+# Import the required packages
+from functools import lru_cache
+import numpy as np
+
+# Import from this package
+from . import mk_hardcoded as mkh
+from . import mk_tools as mkt
+
+
+def _mul_qint(poly, i):
+    """ Multiply a polynomial in q by the q-integer [i]_q = 1 + q + ... + q^(i-1).
+
+    Args:
+        poly (ndarray of int): the polynomial coefficients, by increasing power of q.
+        i (int): the q-integer.
+
+    Returns:
+        ndarray of int: the product.
+
+    """
+
+    cum = np.concatenate([np.array([0], dtype=object), np.cumsum(poly)])
+    k = np.arange(len(poly) + i - 1)
+
+    return cum[np.minimum(k, len(poly) - 1) + 1] - cum[np.maximum(0, k - i + 1)]
+
+def _div_qint(poly, i):
+    """ Divide a polynomial in q by the q-integer [i]_q. The division must be exact.
+
+    Args:
+        poly (ndarray of int): the polynomial coefficients, by increasing power of q.
+        i (int): the q-integer.
+
+    Returns:
+        ndarray of int: the quotient.
+
+    """
+
+    # [i]_q = (1 - q^i) / (1 - q): multiply by (1 - q) ...
+    out = np.concatenate([poly, [0]]) - np.concatenate([[0], poly])
+    # ... and divide by (1 - q^i), i.e. out[k] += out[k-i], one chunk of i coefficients at a time.
+    for start in range(i, len(out), i):
+        out[start:start+i] += out[start-i:start][:len(out[start:start+i])]
+
+    return out[:len(poly) - i + 1]
+
+@lru_cache(maxsize=256)
+def _inversion_cdf(groups):
+    """ Cumulative distribution of the number of inversions of a random permutation of a multiset.
+
+    Args:
+        groups (tuple of int): the sizes of the groups of identical elements, sorted.
+
+    Returns:
+        ndarray of float: P(inversions <= k), for k = 0 ... the maximum number of inversions.
+
+    Note:
+        The generating function of the inversions is the q-multinomial coefficient
+        [n]_q! / prod([g]_q!), computed exactly (with Python int) as a product of q-binomial
+        coefficients. Without ties, these are the Mahonian numbers.
+
+    """
+
+    poly = np.array([1], dtype=object)
+    n_tot = 0
+    for grp in groups:
+        for i in range(1, grp + 1):
+            # Each step gives a q-binomial coefficient, so that the division is always exact.
+            poly = _mul_qint(poly, n_tot + i)
+            if i > 1:
+                poly = _div_qint(poly, i)
+        n_tot += grp
+
+    cum = np.cumsum(poly)
+    out = np.array([item / cum[-1] for item in cum], dtype=float)
+    out.setflags(write=False)
+
+    return out
+
+def tie_groups(obs, obs_years):
+    """ Identify the tie structure relevant to the exact null distribution of S.
+
+    Args:
+        obs (ndarray of float): the observations. NaNs are ignored.
+        obs_years (ndarray of int): the year of each observation.
+
+    Returns:
+        tuple of int|None: the sizes of the groups of tied data points, either in value or in time
+        (year), sorted. None if there are ties both in value and in time, in which case no exact
+        distribution is available.
+
+    """
+
+    valid = ~np.isnan(obs)
+    val_groups = np.unique(obs[valid], return_counts=True)[1]
+    year_groups = np.unique(np.asarray(obs_years)[valid], return_counts=True)[1]
+
+    if np.all(val_groups == 1):
+        return tuple(sorted(int(item) for item in year_groups))
+    if np.all(year_groups == 1):
+        return tuple(sorted(int(item) for item in val_groups))
+
+    return None
+
+def s_cdf(groups_list):
+    """ Exact null distribution of the sum of the S statistics of independent series.
+
+    Args:
+        groups_list (list of tuple of int): the tie groups of each series, see tie_groups().
+
+    Returns:
+        (int, ndarray of float): the maximum S value M, and the cumulative distribution of the
+        number of discordant pairs k = (M - S) / 2, i.e. P(S >= M - 2k).
+
+    """
+
+    s_max = 0
+    pdf = np.ones(1)
+    for groups in groups_list:
+        n = sum(groups)
+        s_max += n * (n - 1) // 2 - sum(item * (item - 1) // 2 for item in groups)
+        cdf = _inversion_cdf(tuple(sorted(groups)))
+        pdf = np.convolve(pdf, np.diff(cdf, prepend=0))
+
+    return (s_max, np.cumsum(pdf))
+
+def p_value(s, groups_list):
+    """ Exact two-sided probability of the Mann-Kendall test, P(|S| >= |s|) under the null
+    hypothesis.
+
+    Args:
+        s (int|float): the S statistic. It is the sum of the S statistics of the series for
+            seasonal tests.
+        groups_list (list of tuple of int): the tie groups of each series, see tie_groups().
+
+    Returns:
+        float: the probability, or NaN if there are ties both in value and in time in a series.
+
+    """
+
+    if np.isnan(s) or any(item is None for item in groups_list):
+        return np.nan
+
+    (s_max, cdf) = s_cdf(groups_list)
+
+    # P(S >= |s|) = P(k <= (M - |s|)/2)
+    k = int(np.floor((s_max - np.abs(s)) / 2 + 1e-9))
+    if k < 0:
+        return 0.0
+
+    return float(min(1.0, 2 * cdf[min(k, len(cdf) - 1)]))
+
+def mk_p_value(s, multi_obs, multi_obs_dts, z):
+    """ Probability of the Mann-Kendall test: exact for small samples, from the normal
+    approximation otherwise.
+
+    The exact distribution is used if there are at most mk_hardcoded.MK_EXACT_MAX_N valid data
+    points in total, and if no series has ties both in value and in time.
+
+    Args:
+        s (float): the S statistic, summed over all the series.
+        multi_obs (list of ndarray of float): the observations of each series.
+        multi_obs_dts (list of ndarray of numpy.datetime64): the observation times of each series.
+        z (float): the normal standard variable Z, see mk_stats.std_normal_var().
+
+    Returns:
+        float: the (two-sided) probability.
+
+    """
+
+    n_valid = np.sum([np.count_nonzero(~np.isnan(item)) for item in multi_obs])
+
+    if n_valid <= mkh.MK_EXACT_MAX_N:
+        p_val = p_value(s, [tie_groups(item, mkt.dts_to_years(multi_obs_dts[ind]))
+                            for (ind, item) in enumerate(multi_obs)])
+        if not np.isnan(p_val):
+            return p_val
+
+    from scipy.stats import norm
+
+    return 2 * (1 - norm.cdf(np.abs(z), loc=0, scale=1))
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors of the Python version of the code listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains the split of a single time series into temporal aggregations (months, seasons,
+...) of the mannkendall package.
+"""
+
+# Import the required packages
+import numpy as np
+
+# Import from this package
+from . import mk_hardcoded as mkh
+from . import mk_tools as mkt
+
+#: list of str: the names of the meteorological seasons, in the order of their codes
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+
+#: list of str: the names of the days of the week, in the order of their codes
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def group_codes(obs_dts, by):
+    """ Compute the temporal aggregation of each observation time.
+
+    Args:
+        obs_dts (ndarray of numpy.datetime64[us]): the observation times. Must be 1-D.
+        by (str): one of mk_hardcoded.VALID_GROUPINGS:
+
+            - *month*: 1 (January) to 12 (December).
+            - *season*: the meteorological seasons, 0 (DJF) to 3 (SON), see SEASONS.
+            - *dayofweek*: 0 (Monday) to 6 (Sunday), see DAYS.
+            - *hour*: the hour of the day, 0 to 23.
+
+    Returns:
+        ndarray of int: the code of the temporal aggregation of each observation time.
+
+    """
+
+    if by not in mkh.VALID_GROUPINGS:
+        raise Exception('Ouch ! by must be one of %s, not: %s' % (mkh.VALID_GROUPINGS, by))
+
+    if by == 'hour':
+        return obs_dts.astype('datetime64[h]').astype(np.int64) % 24
+    if by == 'dayofweek':
+        # 1970-01-01 was a Thursday
+        return (obs_dts.astype('datetime64[D]').astype(np.int64) + 3) % 7
+
+    months = obs_dts.astype('datetime64[M]').astype(np.int64) % 12
+    if by == 'season':
+        return ((months + 1) % 12) // 3
+
+    return months + 1
+
+class Grouping:
+    """ Split of a single time series into temporal aggregations, as indices.
+
+    The observations are first put in time order (if needed), and the indices of each temporal
+    aggregation are contiguous slices of a single permutation: no data is copied to define the
+    groups. mk_temp_aggr() and mk_temp_aggr_batch() accept a Grouping (see their groups argument),
+    and then skip the concatenation and the (de-)sorting of the temporal aggregations.
+
+    Args:
+        obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int): the observation times.
+            Must be 1-D. int are taken as seconds since 1970-01-01.
+        by (str|ndarray): one of mk_hardcoded.VALID_GROUPINGS (see group_codes()), or the label
+            of the temporal aggregation of each observation (e.g. an array of str).
+
+    Attributes:
+        by (str|None): the kind of grouping, or None for custom labels.
+        labels (ndarray): the label of each group, sorted. Only the groups with observations are
+            listed.
+        sort_ind (ndarray of int|None): the indices that put the observations in time order, or
+            None if they already are.
+        time_index (mk_tools.TimeIndex): the observation times, in time order.
+        order (ndarray of int): the indices of the observations (in time order), group after
+            group. In each group, they are in time order.
+        bounds (ndarray of int): the start of each group in order, and the end of the last one.
+
+    Example:
+        >>> groups = Grouping(obs_dts, 'season')
+        >>> mk_temp_aggr(obs_dts, obs, 0.01, groups=groups)
+
+    """
+
+    def __init__(self, obs_dts, by='month'):
+
+        dts = mkt.dts_to_dt64(obs_dts)
+        if np.ndim(dts) != 1:
+            raise Exception('Ouch ! The observation times must be 1-D, not: %i-D' % (np.ndim(dts)))
+
+        self.sort_ind = None
+        if np.any(dts[1:] < dts[:-1]):
+            self.sort_ind = np.argsort(dts, kind='stable')
+            dts = dts[self.sort_ind]
+        self.time_index = mkt.TimeIndex(dts)
+
+        if isinstance(by, str):
+            (self.by, codes) = (by, group_codes(dts, by))
+            (vals, codes) = np.unique(codes, return_inverse=True)
+            self.labels = vals
+            if by == 'season':
+                self.labels = np.array(SEASONS)[vals]
+            elif by == 'dayofweek':
+                self.labels = np.array(DAYS)[vals]
+        else:
+            by = np.asarray(by)
+            if np.shape(by) != np.shape(dts):
+                raise Exception('Ouch ! I need one label per observation time.')
+            self.by = None
+            (self.labels, codes) = np.unique(by if self.sort_ind is None else by[self.sort_ind],
+                                             return_inverse=True)
+
+        codes = codes.reshape(-1)
+        self.order = np.argsort(codes, kind='stable')
+        self.bounds = np.concatenate([[0], np.cumsum(np.bincount(codes,
+                                                                 minlength=len(self.labels)))])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, ind):
+        """ The indices of the observations (in time order) of one group.
+
+        Args:
+            ind (int): the group.
+
+        Returns:
+            ndarray of int: the indices, as a view of the order attribute.
+
+        """
+
+        if not -len(self) <= ind < len(self):
+            raise IndexError('Ouch ! There are only %i groups.' % (len(self)))
+        ind = ind % len(self)
+
+        return self.order[self.bounds[ind]:self.bounds[ind+1]]
+
+    def sort(self, obs):
+        """ Put some observations in time order.
+
+        Args:
+            obs (ndarray): the observations, along the last axis, in the order of obs_dts.
+
+        Returns:
+            ndarray: the observations in time order, obs itself if they already are.
+
+        """
+
+        obs = np.asarray(obs)
+        if np.shape(obs)[-1] != len(self.time_index):
+            raise Exception('Ouch ! Inconsistent length between obs and obs_dts arrays.')
+
+        return obs if self.sort_ind is None else obs[..., self.sort_ind]
+
+    def split(self, obs):
+        """ Split some observations into the temporal aggregations.
+
+        Args:
+            obs (ndarray): the observations, along the last axis, in the order of obs_dts.
+
+        Returns:
+            list of ndarray: the observations of each group, in time order.
+
+        """
+
+        obs = self.sort(obs)
+
+        return [obs[..., item] for item in self]
+
+    def split_dts(self):
+        """ Split the observation times into the temporal aggregations.
+
+        Returns:
+            list of mk_tools.TimeIndex: the observation times of each group.
+
+        """
+
+        return [self.time_index[item] for item in self]
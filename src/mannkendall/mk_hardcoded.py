@@ -11,56 +11,63 @@ SPDX-License-Identifier: BSD-3-Clause
 This file contains the hardcoded parameters for the mannkendall package.
 """
 
-import numpy as np
-
 #: list: supported pre-whitening methods "tags"
 VALID_PW_METHODS = ['pw', 'tfpw_y', 'tfpw_ws', 'vctfpw', '3pw']
 
-#: ndarray: MannKendall probability array
-PROB_MK_N = np.array([
-    [np.nan, np.nan, np.nan, 0.625, 0.592, np.nan, np.nan, 0.548, 0.540, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, 0.500, 0.500, np.nan, np.nan, 0.500],
-    [np.nan, np.nan, np.nan, 0.375, 0.408, np.nan, np.nan, 0.452, 0.46, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, 0.360, 0.386, np.nan, np.nan, 0.431],
-    [np.nan, np.nan, np.nan, 0.167, 0.242, np.nan, np.nan, 0.360, 0.381, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, 0.235, 0.281, np.nan, np.nan, 0.364],
-    [np.nan, np.nan, np.nan, 0.042, 0.117, np.nan, np.nan, 0.274, 0.306, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, 0.136, 0.191, np.nan, np.nan, 0.300],
-    [np.nan, np.nan, np.nan, np.nan, 0.042, np.nan, np.nan, 0.199, 0.238, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, 0.068, 0.119, np.nan, np.nan, 0.242],
-    [np.nan, np.nan, np.nan, np.nan, 0.0083, np.nan, np.nan, 0.138, 0.179, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, 0.028, 0.068, np.nan, np.nan, 0.190],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.089, 0.130, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, 0.0083, 0.035, np.nan, np.nan, 0.146],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.054, 0.090, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, 0.0014, 0.015, np.nan, np.nan, 0.108],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.031, 0.060, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.0054, np.nan, np.nan, 0.078],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.016, 0.038, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.0014, np.nan, np.nan, 0.054],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.0071, 0.022, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.0002, np.nan, np.nan, 0.036],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.0028, 0.012, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.023],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.00087, 0.0063, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.014],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.00019, 0.0029, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.0083],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 2.50E-05, 0.0012, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.0046],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.00043, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.0023],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.00012, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.0011],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 2.50E-05, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.00047],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 2.80E-06, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 0.00018],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 5.80E-05],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 1.50E-05],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 2.80E-06],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
-    [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, 2.80E-07]])
+#: list: supported methods to compute the Sen's slope
+VALID_SEN_METHODS = ['auto', 'brute', 'select', 'chunked']
+
+#: int: number of valid data points above which the Sen's slope is computed by slope selection
+SEN_SELECT_MIN_N = 1000
+
+#: int: minimum number of pairwise slopes listed explicitly by the slope selection
+SEN_SELECT_CAP = 2**20
+
+#: int: number of pairwise slopes drawn at random to narrow down the slope selection
+SEN_SELECT_SAMPLE = 2**18
+
+#: int: default memory budget (in bytes) of the 'chunked' Sen's slope
+SEN_CHUNKED_MEMORY = 2**28
+
+#: int: maximum number of data pairs processed at once by the pairwise kernels
+PAIRWISE_BLOCK = 2**20
+
+#: list: supported backends of the pairwise kernels
+VALID_KERNEL_BACKENDS = ['auto', 'numpy', 'numba']
+
+#: str: backend of the pairwise kernels. 'auto' uses numba if it can be imported, and numpy
+#: otherwise. The results are identical for all the backends.
+KERNEL_BACKEND = 'auto'
+
+#: list: supported temporal aggregations of mk_groups.Grouping
+VALID_GROUPINGS = ['month', 'season', 'dayofweek', 'hour']
+
+#: list: supported floating point types of the pairwise slopes, see mk_kernels.pairwise_stats()
+VALID_PAIR_DTYPES = ['float64', 'float32']
+
+#: list: supported methods to assess the significance of the MK test and of the Sen's slope
+VALID_SIG_METHODS = ['analytic', 'boot']
+
+#: int: maximum number of resamples of the block permutation test and block bootstrap
+BOOT_N = 2000
+
+#: int: number of resamples evaluated at once by the block permutation test and block bootstrap
+BOOT_BATCH = 200
+
+#: float: confidence level (in %) on the resampled p-value required to stop the permutation test
+#: early
+BOOT_STOP_CL = 99.
+
+#: float: the block bootstrap of the Sen's slope stops early once the BOOT_STOP_CL confidence
+#: interval of each confidence limit is narrower than this fraction of the confidence interval
+BOOT_CL_TOL = 0.15
+
+#: list: fields (and dtype) of the structured arrays returned by mk_temp_aggr_batch()
+MK_RESULT_DTYPE = [('p', float), ('ss', float), ('slope', float), ('ucl', float), ('lcl', float)]
+
+#: int: default number of grid cells processed at once by mk_main.mk_temp_aggr_grid()
+GRID_CHUNK_CELLS = 1000
+
+#: int: number of valid data points up to which the MK probability is computed exactly, rather than
+#: from the normal approximation (see mk_exact.mk_p_value())
+MK_EXACT_MAX_N = 10
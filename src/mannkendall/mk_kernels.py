@@ -0,0 +1,924 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors of the original matlab version of the code listed in
+ORIGINAL_AUTHORS.
+Copyright (c) 2020 MeteoSwiss, contributors of the Python version of the code listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains the fast pairwise kernels for the mannkendall package.
+"""
+
+# Import the required packages
+import numpy as np
+
+# Import from this package
+from . import mk_hardcoded as mkh
+
+def _mkn():
+    """ Get the mk_numba module, imported on first use since numba is slow to import.
+
+    Returns:
+        module: mk_numba.
+
+    """
+
+    from . import mk_numba
+
+    return mk_numba
+
+def use_numba():
+    """ Whether the pairwise kernels should run with numba, see mk_hardcoded.KERNEL_BACKEND.
+
+    Returns:
+        bool: True to use numba, False to use numpy.
+
+    """
+
+    if mkh.KERNEL_BACKEND not in mkh.VALID_KERNEL_BACKENDS:
+        raise Exception('Ouch ! KERNEL_BACKEND must be one of %s, not: %s' %
+                        (mkh.VALID_KERNEL_BACKENDS, mkh.KERNEL_BACKEND))
+    if mkh.KERNEL_BACKEND == 'numba' and not _mkn().AVAILABLE:
+        raise Exception('Ouch ! KERNEL_BACKEND is "numba", but numba cannot be imported.')
+
+    return mkh.KERNEL_BACKEND != 'numpy' and _mkn().AVAILABLE
+
+def unique_ranks(vals, tiebreak):
+    """ Rank an array of values, breaking ties with a second array.
+
+    Args:
+        vals (ndarray): the values to rank. Must be 1-D.
+        tiebreak (ndarray): the values used to order the ties in vals. Must be 1-D, and unique.
+
+    Returns:
+        ndarray of int: the ranks (a permutation of 0...len(vals)-1).
+
+    """
+
+    order = np.lexsort((tiebreak, vals))
+    out = np.empty(len(vals), dtype=np.int64)
+    out[order] = np.arange(len(vals))
+
+    return out
+
+def _merge_levels(seq):
+    """ Run a vectorized bottom-up merge-sort of a permutation, and locate its inversions.
+
+    Args:
+        seq (ndarray of int): a permutation of 0...len(seq)-1. Must be 1-D.
+
+    Yields:
+        (ndarray, ndarray, ndarray, ndarray): one (right, start, end, left) tuple per merge level.
+        The inversions are the pairs (left[start[k]:end[k]], right[k]). left and right are
+        positions in seq.
+
+    """
+
+    n = len(seq)
+    pos = np.arange(n)
+    srt = np.asarray(seq, dtype=np.int64)
+    ind = pos.copy()
+    width = 1
+
+    while width < n:
+        blk = pos // width
+        is_left = blk % 2 == 0
+        keys = blk * n + srt
+        left_keys = keys[is_left]
+        is_right = ~is_left
+
+        # For each element of a right block, find the elements of the left block that are larger.
+        # Remember that the keys of the left block (blk-1) are all smaller than (blk-1)*n + n.
+        start = np.searchsorted(left_keys, keys[is_right] - n, side='right')
+        end = np.searchsorted(left_keys, blk[is_right] * n, side='left')
+
+        yield (ind[is_right], start, end, ind[is_left])
+
+        # Merge the blocks for the next level
+        order = np.argsort((pos // (2 * width)) * n + srt, kind='stable')
+        srt = srt[order]
+        ind = ind[order]
+        width *= 2
+
+def _radix_levels(seq):
+    """ Count the inversions of a permutation bit by bit, from the most significant one.
+
+    At each level, the elements are split in groups sharing the same higher bits, kept in their
+    order in seq. The inversions whose values first differ at the current bit are the pairs of a
+    group where a 1 comes before a 0. Each group is then split (stably) into its 0s and 1s for the
+    next level. Each level costs O(n) operations, i.e. O(n log(n)) in total.
+
+    Args:
+        seq (ndarray of int): a permutation of 0...len(seq)-1. Must be 1-D.
+
+    Yields:
+        (ndarray, ndarray): one (vals, cnt) tuple per bit. cnt[k] is the number of elements that
+        come before vals[k] in seq, and that are larger than vals[k] with the same higher bits.
+
+    """
+
+    vals = np.asarray(seq, dtype=np.int64)
+    n = len(vals)
+    pos = np.arange(n)
+
+    for bit in range((n - 1).bit_length() - 1, -1, -1):
+        # seq is a permutation: the group of the values with the higher bits h starts at h.
+        start = (vals >> (bit + 1)) << (bit + 1)
+        n_zeros = np.minimum(start + (1 << bit), n) - start
+        is_one = (vals >> bit) & 1
+
+        # The number of 1s before each element within its group
+        n_ones = np.cumsum(is_one) - is_one
+        ones_before = n_ones - n_ones[start]
+
+        yield (vals, np.where(is_one == 0, ones_before, 0))
+
+        # Split the groups: the 0s first, then the 1s, each in the same order as before.
+        dest = np.where(is_one == 0, pos - ones_before, start + n_zeros + ones_before)
+        new_vals = np.empty_like(vals)
+        new_vals[dest] = vals
+        vals = new_vals
+
+def inversion_ranges(seq, keep_pairs=True):
+    """ Count (and optionally locate) the inversions of a permutation.
+
+    An inversion is a pair of positions i<j with seq[i] > seq[j]. The counting is done with a
+    bottom-up merge-sort, where each merge level is fully vectorized. This costs O(n log(n)^2)
+    operations, but only O(n log(n)) memory.
+
+    Args:
+        seq (ndarray of int): a permutation of 0...len(seq)-1. Must be 1-D.
+        keep_pairs (bool, optional): if True, return where the inversions are. Defaults to True.
+
+    Returns:
+        (int, list): the number of inversions, and a list of (right, start, end, left) tuples of
+        ndarray, one per merge level. For each level, the inversions are the pairs
+        (left[start[k]:end[k]], right[k]). left and right are positions in seq.
+
+    """
+
+    total = 0
+    levels = []
+
+    for (right, start, end, left) in _merge_levels(seq):
+        cnt = end - start
+        total += int(cnt.sum())
+
+        if keep_pairs:
+            nonzero = cnt > 0
+            if np.any(nonzero):
+                levels += [(right[nonzero], start[nonzero], end[nonzero], left)]
+
+    return (total, levels)
+
+def count_inversions(seq):
+    """ Count the inversions of a permutation, i.e. the pairs i<j with seq[i] > seq[j].
+
+    Args:
+        seq (ndarray of int): a permutation of 0...len(seq)-1. Must be 1-D.
+
+    Returns:
+        int: the number of inversions.
+
+    """
+
+    if use_numba():
+        return int(_mkn().count_inversions(np.asarray(seq, dtype=np.int64)))
+
+    return int(sum(np.sum(cnt) for (_, cnt) in _radix_levels(seq)))
+
+def _n_tied_pairs(*keys):
+    """ Count the pairs of elements that share the same keys.
+
+    Args:
+        *keys (ndarray): the keys of the elements. Must be 1-D, with the same length.
+
+    Returns:
+        int: the number of pairs of elements with identical keys.
+
+    """
+
+    if len(keys[0]) == 0:
+        return 0
+
+    order = np.lexsort(keys)
+    new_grp = np.zeros(len(order), dtype=bool)
+    new_grp[0] = True
+    for item in keys:
+        new_grp[1:] |= item[order][1:] != item[order][:-1]
+    sizes = np.diff(np.append(np.nonzero(new_grp)[0], len(order)))
+
+    return int(np.sum(sizes * (sizes - 1) // 2))
+
+def s_stat(obs, years):
+    """ Compute the S statistic of the Mann-Kendall test, i.e. the sum of the signs of the
+    differences between all the pairs of data points that belong to different years.
+
+    Args:
+        obs (ndarray of float): the observations. Must be 1-D. NaNs are ignored.
+        years (ndarray of int): the year of each observation. Must be 1-D.
+
+    Returns:
+        int: the S statistic.
+
+    Note:
+        Rather than looping over all the pairs, this counts the number of discordant pairs as the
+        number of inversions of the data sorted by (year, value). This costs O(n log(n))
+        operations instead of O(n^2).
+
+    """
+
+    valid = ~np.isnan(obs)
+    obs = obs[valid]
+    years = np.asarray(years)[valid]
+    n = len(obs)
+
+    # Sort by year, and by value inside a year, so that the latter do not give any inversion.
+    order = np.lexsort((obs, years))
+    n_disc = count_inversions(unique_ranks(obs[order], np.arange(n)))
+
+    # All the other pairs are concordant, unless they are in the same year or are tied.
+    n_pairs = n * (n-1) // 2 - _n_tied_pairs(years)
+    n_ties = _n_tied_pairs(obs) - _n_tied_pairs(obs, years)
+
+    return n_pairs - n_ties - 2 * n_disc
+
+def _n_tied_pairs_rows(*keys):
+    """ Count, row by row, the pairs of elements that share the same keys.
+
+    Args:
+        *keys (ndarray): the keys of the elements. Must be 2-D, with the same shape, and sorted
+            lexicographically along each row.
+
+    Returns:
+        ndarray of int: the number of pairs of elements with identical keys, for each row.
+
+    """
+
+    pos = np.broadcast_to(np.arange(keys[0].shape[1]), keys[0].shape)
+    new_grp = np.ones(keys[0].shape, dtype=bool)
+    new_grp[:, 1:] = False
+    for item in keys:
+        new_grp[:, 1:] |= item[:, 1:] != item[:, :-1]
+
+    # Each element is tied with all the preceding elements of its group.
+    grp_start = np.maximum.accumulate(np.where(new_grp, pos, 0), axis=1)
+
+    return np.sum(pos - grp_start, axis=1)
+
+def s_stat_rows(obs, years):
+    """ Compute the S statistic of many series sharing the same observation years at once.
+
+    Args:
+        obs (ndarray of float): the observations, one series per row. Must be 2-D, without NaNs.
+        years (ndarray of int): the year of each observation. Must be 1-D.
+
+    Returns:
+        ndarray of int: the S statistic of each row, see s_stat().
+
+    Note:
+        With numpy, the rows are stacked in a single permutation, offset so that no inversion spans
+        two rows, and counted with a single pass over the bits of the values.
+
+    """
+
+    (n_rows, n) = np.shape(obs)
+    if n < 2:
+        return np.zeros(n_rows, dtype=np.int64)
+    years = np.broadcast_to(np.asarray(years, dtype=np.int64), (n_rows, n))
+    pos = np.broadcast_to(np.arange(n), (n_rows, n))
+
+    # Sort each row by year, and by value inside a year, so that the latter do not give any
+    # inversion.
+    order = np.lexsort((obs, years), axis=-1)
+    (obs, years) = (np.take_along_axis(obs, order, 1), np.take_along_axis(years, order, 1))
+
+    # Rank the values of each row, ties being ordered by position
+    ranks = np.empty((n_rows, n), dtype=np.int64)
+    np.put_along_axis(ranks, np.lexsort((pos, obs), axis=-1), pos, axis=1)
+
+    if use_numba():
+        n_disc = _mkn().count_inversions_rows(ranks)
+    else:
+        n_disc = np.zeros(n_rows, dtype=np.int64)
+        offset = n * np.arange(n_rows)[:, None]
+        for (vals, cnt) in _radix_levels((ranks + offset).ravel()):
+            n_disc += np.bincount(vals // n, weights=cnt, minlength=n_rows).astype(np.int64)
+
+    # All the other pairs are concordant, unless they are in the same year or are tied.
+    n_pairs = n * (n-1) // 2 - _n_tied_pairs(years[0])
+    n_ties = _n_tied_pairs_rows(np.sort(obs, axis=1)) - _n_tied_pairs_rows(years, obs)
+
+    return n_pairs - n_ties - 2 * n_disc
+
+def _expand_pairs(levels, picks=None):
+    """ Extract (some of) the pairs located by inversion_ranges().
+
+    Args:
+        levels (list): the level information returned by inversion_ranges().
+        picks (ndarray of int, optional): the pairs to extract, numbered from 0 to the total
+            number of pairs. Defaults to None = all of them.
+
+    Returns:
+        (ndarray, ndarray): the left and right positions of each pair.
+
+    """
+
+    if len(levels) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    # Flatten the levels, by offsetting the start/end positions in a global left array
+    offsets = np.cumsum([0] + [len(item[3]) for item in levels[:-1]])
+    right = np.concatenate([item[0] for item in levels])
+    start = np.concatenate([item[1] + offsets[ind] for (ind, item) in enumerate(levels)])
+    cnt = np.concatenate([item[2] - item[1] for item in levels])
+    left = np.concatenate([item[3] for item in levels])
+    cum = np.cumsum(cnt)
+
+    if picks is None:
+        picks = np.arange(cum[-1])
+
+    # Locate each pick within the ranges
+    k = np.searchsorted(cum, picks, side='right')
+    offset = picks - (cum[k] - cnt[k])
+
+    return (left[start[k] + offset], right[k])
+
+class _SlopeSelector:
+    """ Slope selection engine, used to extract order statistics of the pairwise slopes
+    (y[j]-y[i])/(t[j]-t[i]) without materializing all of them.
+
+    The number of slopes smaller than a value theta is the number of inversions of the sequence
+    u = y - theta * t ordered by time. This is used to bracket the requested order statistics with
+    random samples, until few enough slopes remain to be listed explicitly.
+
+    Rounding errors between the test on u and the actual (floating point) slope values are
+    handled with a safety margin around the brackets. The final slope values are always computed
+    with the same floating point operations as the brute force approach, so that the output is
+    bit-identical.
+
+    """
+
+    def __init__(self, t_us, obs, seed=0):
+        """ Init function.
+
+        Args:
+            t_us (ndarray of int): the observation times in microseconds, sorted, all different.
+            obs (ndarray of float): the observations, without NaNs.
+            seed (int, optional): the seed of the random number generator. Defaults to 0.
+
+        """
+
+        self.t_us = t_us
+        self.obs = obs
+        self.n = len(obs)
+        self.n_pairs = self.n * (self.n - 1) // 2
+        self.rng = np.random.default_rng(seed)
+        self.cap = max(mkh.SEN_SELECT_CAP, 4 * self.n)
+
+        # Elapsed time in s, used for the bracketing test
+        self.t_s = (t_us - t_us[0]) / 1e6
+        self.tpos = np.arange(self.n)
+
+        # The floating point accuracy of the bracketing test.
+        eps = np.spacing(1.0)
+        dt_min = np.min(np.diff(t_us)) / 1e6
+        self._margin = (64 * eps * np.max(np.abs(obs)) / dt_min,
+                        64 * eps * (2 * self.t_s[-1] / dt_min + 1))
+
+        # The slopes that are exactly 0 are identified exactly.
+        self.n_neg = count_inversions(unique_ranks(obs, self.tpos))
+        self.n_nonpos = count_inversions(unique_ranks(obs, -self.tpos))
+
+    def slopes(self, i, j):
+        """ Compute the slopes for some pairs of points.
+
+        Args:
+            i (ndarray of int): the first element of the pairs.
+            j (ndarray of int): the second element of the pairs.
+
+        Returns:
+            ndarray of float: the slopes, in 1/s.
+
+        """
+        return (self.obs[j] - self.obs[i]) / ((self.t_us[j] - self.t_us[i]) / 1e6)
+
+    def _test_rank(self, theta, closed):
+        """ Compute the ranks that identify the pairs with a slope smaller than theta.
+
+        Args:
+            theta (float): the slope threshold.
+            closed (bool): whether slopes equal to theta are counted, or not.
+
+        Returns:
+            ndarray of int: the ranks. A pair of points (p, q) with p < q has a slope smaller than
+            theta if rank[p] > rank[q].
+
+        """
+        if theta == -np.inf:
+            return self.tpos
+        if theta == np.inf:
+            return self.tpos[::-1].copy()
+        u = self.obs - theta * self.t_s
+        return unique_ranks(u, -self.tpos if closed else self.tpos)
+
+    def _window(self, bnds):
+        """ Locate the slopes inside a window.
+
+        Args:
+            bnds (list): [a, a_closed, b, b_closed] the window limits and their type.
+
+        Returns:
+            (int, int, list): the number of slopes below the window, inside the window, and
+            the pair locations within the window.
+
+        """
+        rank_a = self._test_rank(bnds[0], bnds[1])
+        rank_b = self._test_rank(bnds[2], bnds[3])
+        n_below = 0 if bnds[0] == -np.inf else count_inversions(rank_a)
+
+        perm = np.argsort(rank_a)
+        (n_in, levels) = inversion_ranges(rank_b[perm])
+
+        return (n_below, n_in, (perm, levels))
+
+    def _pairs(self, loc, picks=None):
+        """ Compute the slopes of (some of) the pairs in a window.
+
+        Args:
+            loc (tuple): the window pair locations, as returned by _window().
+            picks (ndarray of int, optional): which pairs to compute. Defaults to None = all.
+
+        Returns:
+            ndarray of float: the slopes.
+
+        """
+        (left, right) = _expand_pairs(loc[1], picks=picks)
+        return self.slopes(loc[0][left], loc[0][right])
+
+    def _bounds(self, lo, hi, sign):
+        """ Convert a slope interval into window limits, with a safety margin.
+
+        Args:
+            lo (float): the lower slope limit.
+            hi (float): the upper slope limit.
+            sign (int): -1 if the requested slopes are negative, 1 if they are positive.
+
+        Returns:
+            list: [a, a_closed, b, b_closed]
+
+        """
+        a = lo - (self._margin[0] + self._margin[1] * np.abs(lo)) if np.isfinite(lo) else lo
+        b = hi + (self._margin[0] + self._margin[1] * np.abs(hi)) if np.isfinite(hi) else hi
+
+        # The exact 0 limits are used whenever possible, to keep the null slopes out.
+        if sign < 0 and b >= 0:
+            return [a, True, 0.0, False]
+        if sign > 0 and a <= 0:
+            return [0.0, True, b, True]
+        return [a, True, b, True]
+
+    def _select(self, ranks, sign):
+        """ Find the values of a group of neighbouring order statistics with the same sign.
+
+        Args:
+            ranks (ndarray of int): the ranks to look for, sorted.
+            sign (int): -1 if these slopes are negative, 1 if they are positive.
+
+        Returns:
+            ndarray of float: the slope values.
+
+        """
+
+        # Start from all the negative (or positive) slopes
+        stack = [(-np.inf, 0.0) if sign < 0 else (0.0, np.inf)]
+        k_sig = 4.0
+
+        while True:
+            (lo, hi) = stack[-1]
+            bnds = self._bounds(lo, hi, sign)
+            (n_below, n_in, loc) = self._window(bnds)
+
+            if n_in > self.cap:
+                # Too many slopes: draw a random sample of them to narrow the window.
+                n_samp = min(n_in, mkh.SEN_SELECT_SAMPLE)
+                samp = np.sort(self._pairs(loc, self.rng.integers(0, n_in, size=n_samp)))
+                i_lo = int(np.floor((ranks[0] - n_below) / n_in * n_samp - k_sig * n_samp**0.5))
+                i_hi = int(np.ceil((ranks[-1] + 1 - n_below) / n_in * n_samp +
+                                   k_sig * n_samp**0.5))
+                new_lo = samp[i_lo] if i_lo >= 0 else lo
+                new_hi = samp[i_hi] if i_hi < n_samp else hi
+
+                # Only keep going if the window actually shrinks. If it does not, the slopes must
+                # have a lot of ties, and they will be listed regardless of their number.
+                if (new_lo, new_hi) != (lo, hi) and new_lo <= new_hi:
+                    stack += [(max(lo, new_lo), min(hi, new_hi))]
+                    continue
+
+            # List all the slopes in the window, and check that the ranks are inside.
+            vals = self._pairs(loc)
+            n_low = n_below + np.count_nonzero(vals < lo)
+            vals = np.sort(vals[(vals >= lo) & (vals <= hi)])
+
+            if n_low <= ranks[0] and ranks[-1] < n_low + len(vals):
+                return vals[ranks - n_low]
+
+            # Unlucky draw: go back to the previous window, and be more conservative.
+            if len(stack) == 1:
+                raise Exception('Ouch ! This error is impossible.')
+            stack.pop()
+            k_sig *= 2
+
+    def order_stats(self, ranks):
+        """ Compute some order statistics of the pairwise slopes.
+
+        Args:
+            ranks (ndarray of int): the ranks of the requested order statistics, starting at 0.
+
+        Returns:
+            ndarray of float: the requested order statistics, in 1/s.
+
+        """
+
+        ranks = np.asarray(ranks, dtype=np.int64)
+        out = np.zeros(len(ranks))
+
+        # If there are few slopes, just list them all.
+        if self.n_pairs <= self.cap:
+            (i, j) = np.triu_indices(self.n, k=1)
+            return np.sort(self.slopes(i, j))[ranks]
+
+        # The null slopes are already identified
+        is_null = (ranks >= self.n_neg) & (ranks < self.n_nonpos)
+        out[is_null] = 0.0
+
+        # Deal with the other ones in groups of neighbours
+        todo = np.unique(ranks[~is_null])
+        groups = np.split(todo, np.nonzero(np.diff(todo) > self.cap // 8)[0] + 1)
+        for group in groups:
+            if len(group) == 0:
+                continue
+            for sub in [group[group < self.n_neg], group[group >= self.n_nonpos]]:
+                if len(sub) == 0:
+                    continue
+                vals = self._select(sub, -1 if sub[0] < self.n_neg else 1)
+                for (rank, val) in zip(sub, vals):
+                    out[ranks == rank] = val
+
+        return out
+
+def slope_order_stats(t_us, obs, ranks, seed=0):
+    """ Compute some order statistics of the pairwise slopes (obs[j]-obs[i])/(t[j]-t[i]), without
+    computing all of them.
+
+    Args:
+        t_us (ndarray of int): the observation times, in microseconds. Must be 1-D, without
+            duplicates.
+        obs (ndarray of float): the observations. Must be 1-D, without NaNs.
+        ranks (ndarray of int): the ranks of the requested order statistics, starting at 0.
+        seed (int, optional): the seed of the random number generator. Defaults to 0.
+
+    Returns:
+        ndarray of float: the requested order statistics, in 1/s.
+
+    Note:
+        This is a randomized slope selection algorithm, similar to the one of Matousek (1991),
+        Randomized optimal algorithm for slope selection, Inf. Process. Lett. 39, 183-187. Its cost
+        is O(n log(n)^2) operations, with O(n log(n)) memory. The random seed only influences the
+        speed of the algorithm, not its output.
+
+    """
+
+    sort_ind = np.argsort(t_us, kind='stable')
+    t_us = np.asarray(t_us, dtype=np.int64)[sort_ind]
+    if np.any(np.diff(t_us) == 0):
+        raise Exception('Ouch ! The slope selection requires distinct observation times.')
+
+    selector = _SlopeSelector(t_us, np.asarray(obs, dtype=float)[sort_ind], seed=seed)
+
+    return selector.order_stats(ranks)
+
+def _pair_blocks(t, obs, years=None, block=None, t_scale=1e6):
+    """ Iterate over all the pairs i<j of data points, in blocks of rows.
+
+    Args:
+        t (ndarray of int or float): the observation times, in units of 1/t_scale s. Must be 1-D.
+        obs (ndarray of float): the observations. Must be 1-D, without NaNs.
+        years (ndarray of int, optional): the year of each observation. Defaults to None.
+        block (int, optional): the maximum number of pairs in a block.
+            Defaults to None = mk_hardcoded.PAIRWISE_BLOCK.
+        t_scale (float, optional): the number of time units in 1 s. Defaults to 1e6.
+
+    Yields:
+        (ndarray of float, int): the slopes of the pairs in the block, in 1/s, and the sum of
+        the signs of their differences over different years (0 if years is None).
+
+    """
+
+    n = len(obs)
+    block = mkh.PAIRWISE_BLOCK if block is None else block
+    i_0 = 0
+    while i_0 < n - 1:
+        if block < n - 1 - i_0:
+            # A single row does not fit: split it
+            for j_0 in range(i_0 + 1, n, block):
+                cols = np.arange(j_0, min(n, j_0 + block))
+                diff = obs[cols] - obs[i_0]
+                slopes = diff / ((t[cols] - t[i_0]) / t_scale)
+                s_blk = 0
+                if years is not None:
+                    s_blk = int(np.sum(np.sign(diff) * np.sign(years[cols] - years[i_0])))
+                yield (slopes, s_blk)
+            i_0 += 1
+            continue
+
+        # Take as many rows as possible
+        i_1 = min(n - 1, i_0 + max(1, block // (n - i_0)))
+        rows = np.arange(i_0, i_1)[:, None]
+        cols = np.arange(i_0 + 1, n)[None, :]
+        mask = cols > rows
+
+        diff = (obs[cols] - obs[rows])[mask]
+        # Same floating point operations as the brute force approach
+        slopes = diff / ((t[cols] - t[rows])[mask] / t_scale)
+
+        s_blk = 0
+        if years is not None:
+            s_blk = int(np.sum(np.sign(diff) * np.sign(years[cols] - years[rows])[mask]))
+
+        yield (slopes, s_blk)
+        i_0 = i_1
+
+def _pair_axes(t_us, obs, dtype):
+    """ Prepare the times and the observations for the pairwise kernels.
+
+    In float32, the times become offsets (in s) from the first one, and the observations
+    differences to the first one, so that the float32 numbers stay as small as possible.
+
+    Args:
+        t_us (ndarray of int): the observation times, in microseconds. Must be 1-D.
+        obs (ndarray of float): the observations. Must be 1-D, without NaNs.
+        dtype (str): one of mk_hardcoded.VALID_PAIR_DTYPES.
+
+    Returns:
+        (ndarray, numpy.floating, ndarray): the times, the number of time units in 1 s, and the
+        observations.
+
+    """
+
+    if dtype == 'float64':
+        return (t_us, np.float64(1e6), obs)
+
+    if len(obs) == 0:
+        return (np.zeros(0, dtype=dtype), np.ones(1, dtype=dtype)[0], np.zeros(0, dtype=dtype))
+
+    return (((t_us - t_us[0]) / 1e6).astype(dtype), np.ones(1, dtype=dtype)[0],
+            (obs - obs[0]).astype(dtype))
+
+def _bucket_codes(edges, slopes):
+    """ Bucket of some slopes, for the memory-bounded pairwise_stats().
+
+    The buckets are, in increasing order of the slopes: -inf, then alternately the open intervals
+    between consecutive edges and the edges themselves, then +inf and NaN. Bucket 2k+1 holds the
+    finite slopes in ]edges[k-1], edges[k][ (with edges[-1]=-inf and edges[len(edges)]=+inf),
+    and bucket 2k+2 the slopes equal to edges[k]. The slopes equal to an edge (e.g. the many zero
+    slopes of quantized data) are thus counted, but never need to be stored.
+
+    Args:
+        edges (ndarray of float): the edges of the buckets, finite, sorted, unique.
+        slopes (ndarray of float): the slopes.
+
+    Returns:
+        ndarray of int: the bucket of each slope, from 0 to 2*len(edges)+3.
+
+    """
+
+    bkt = np.searchsorted(edges, slopes, side='right')
+    lower = np.concatenate([[np.nan], edges]).astype(np.result_type(edges, slopes))
+    bkt = 1 + 2 * bkt - (lower[bkt] == slopes)
+    bkt[slopes == -np.inf] = 0
+    bkt[slopes == np.inf] = 2 * len(edges) + 2
+    bkt[np.isnan(slopes)] = 2 * len(edges) + 3
+
+    return bkt
+
+def _bucket_bounds(edges, bkt):
+    """ The values of the slopes in one bucket of _bucket_codes().
+
+    Args:
+        edges (ndarray of float): the edges of the buckets.
+        bkt (int): the bucket.
+
+    Returns:
+        (float, float, bool): the bounds of the bucket, and whether they are excluded (True for
+        an open interval between edges, False if the bucket holds a single value).
+
+    """
+
+    n_edges = len(edges)
+    if bkt == 0:
+        return (-np.inf, -np.inf, False)
+    if bkt >= 2 * n_edges + 2:
+        val = np.inf if bkt == 2 * n_edges + 2 else np.nan
+        return (val, val, False)
+    if bkt % 2 == 0:
+        return (edges[bkt // 2 - 1], edges[bkt // 2 - 1], False)
+
+    ind = (bkt - 1) // 2
+    return (edges[ind - 1] if ind > 0 else -np.inf, edges[ind] if ind < n_edges else np.inf, True)
+
+def _sample_edges(t, t_scale, obs, bounds, n_edges, n_draws, batch, rng):
+    """ Draw new bucket edges inside an open interval of slopes, from a random sample of pairs.
+
+    Args:
+        t (ndarray of int or float): the observation times, in units of 1/t_scale s.
+        t_scale (float): the number of time units in 1 s.
+        obs (ndarray of float): the observations, without NaNs.
+        bounds (float, float): the open interval of slopes to split.
+        n_edges (int): the maximum number of new edges.
+        n_draws (int): the maximum number of pairs drawn.
+        batch (int): the number of pairs drawn at once.
+        rng (numpy.random.Generator): the random number generator.
+
+    Returns:
+        ndarray of float: the new edges, sorted, unique, inside bounds. Can be empty.
+
+    """
+
+    n = len(obs)
+    (samp, n_samp) = ([], 0)
+    for _ in range(0, n_draws, batch):
+        (p_i, p_j) = (rng.integers(0, n, batch), rng.integers(0, n, batch))
+        (p_i, p_j) = (np.minimum(p_i, p_j), np.maximum(p_i, p_j))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Same floating point operations as _pair_blocks()
+            slp = (obs[p_j] - obs[p_i]) / ((t[p_j] - t[p_i]) / t_scale)
+        samp += [slp[(p_i != p_j) & (slp > bounds[0]) & (slp < bounds[1])]]
+        n_samp += len(samp[-1])
+        if n_samp >= 16 * n_edges:
+            break
+
+    samp = np.sort(np.concatenate(samp)).astype(float)
+    if len(samp) == 0:
+        return samp
+
+    return np.unique(samp[np.linspace(0, len(samp) - 1, n_edges + 2).astype(int)[1:-1]])
+
+def pairwise_stats(t_us, obs, ranks, years=None, max_memory=None, seed=0, dtype='float64'):
+    """ Compute, in one pass over all the pairs of data points, the S statistic and some order
+    statistics of the pairwise slopes (obs[j]-obs[i])/(t[j]-t[i]), i<j.
+
+    The pairs are processed in blocks, so that the memory footprint is bounded. If the slopes do
+    not fit in max_memory, they are counted in buckets during the first pass, and a last pass
+    collects the few buckets that contain the requested order statistics. The slopes equal to the
+    edges of the buckets are only counted, so that tied slopes (e.g. of quantized data) are never
+    stored. A bucket that is still too large is split by an extra counting pass (rarely needed,
+    unless the data has many more pairs than max_memory/1000 squared).
+
+    Args:
+        t_us (ndarray of int): the observation times, in microseconds. Must be 1-D.
+        obs (ndarray of float): the observations. Must be 1-D, without NaNs.
+        ranks (ndarray of int): the ranks of the requested order statistics, starting at 0.
+        years (ndarray of int, optional): the year of each observation. If set, S is computed over
+            the pairs of data points in different years. Defaults to None.
+        max_memory (int, optional): the memory available to store the slopes and the temporary
+            arrays, in bytes. Defaults to None (no limit). Below ~2**18 bytes, the temporary
+            arrays of a block (at least 1024 pairs) can exceed it.
+        seed (int, optional): the seed of the random number generator used to define the buckets.
+            Defaults to 0.
+        dtype (str, optional): one of mk_hardcoded.VALID_PAIR_DTYPES, the floating point type in
+            which the slopes are computed and stored. Defaults to 'float64'.
+
+    Returns:
+        (int|None, ndarray of float): the S statistic (None if years is None), and the requested
+        order statistics, in 1/s.
+
+    Note:
+        The order statistics are identical to the ones of the sorted array of all the slopes. Slopes
+        between data points with identical times are +/-inf or NaN, and NaNs are sorted last.
+        With numba (see use_numba()), the pairs are looped over one by one, and the slopes are not
+        stored at all during the first pass.
+
+        With dtype='float32', the memory needed to store the slopes and the memory traffic are
+        halved. The times are then offsets from the first one, in s, and the observations
+        differences to the first one. Let u = 2**-24, T the time span of the data and Y the largest
+        |obs[i]-obs[0]|: each slope s has an error of at most 2u(Y + |s|T)/(t[j]-t[i]) + 3u|s| (to
+        first order in u), and each order statistic is off by at most the largest of these errors.
+        This is negligible if the resolution of the data is much coarser than u*Y, and the time
+        steps much longer than u*T. S is still exact: it is computed with s_stat().
+
+    """
+
+    if dtype not in mkh.VALID_PAIR_DTYPES:
+        raise Exception('Ouch ! dtype must be one of %s, not: %s' % (mkh.VALID_PAIR_DTYPES, dtype))
+
+    t_us = np.asarray(t_us, dtype=np.int64)
+    obs = np.asarray(obs, dtype=float)
+    ranks = np.asarray(ranks, dtype=np.int64)
+    s_out = None
+    if years is not None:
+        years = np.asarray(years, dtype=np.int64)
+        if dtype != 'float64':
+            # The float32 differences could turn some pairs into ties: get S exactly instead.
+            (s_out, years) = (s_stat(obs, years), None)
+    n_pairs = len(obs) * (len(obs) - 1) // 2
+    (t, t_scale, obs_t) = _pair_axes(t_us, obs, dtype)
+    itemsize = np.dtype(dtype).itemsize
+
+    block = mkh.PAIRWISE_BLOCK
+    if max_memory is not None:
+        if max_memory < 8 * len(obs):
+            raise Exception('Ouch ! max_memory must be at least %i bytes.' % (8 * len(obs)))
+        # Leave room for the temporary arrays of a block (up to ~100 bytes per pair)
+        block = max(min(1024, block), min(block, max_memory // 128))
+
+    s_tot = 0
+    jit = use_numba()
+    # The numba kernels need the years, even if S is not requested
+    jit_years = np.zeros(len(obs), dtype=np.int64) if years is None and jit else years
+
+    # Easy case: keep all the slopes
+    if max_memory is None or itemsize * n_pairs <= max_memory // 4:
+        if jit:
+            slopes = np.empty(n_pairs, dtype=dtype)
+            s_tot = int(_mkn().pair_slopes(t, t_scale, obs_t, jit_years, slopes))
+        else:
+            slopes = []
+            for (slp, s_blk) in _pair_blocks(t, obs_t, years=years, block=block, t_scale=t_scale):
+                slopes += [slp]
+                s_tot += s_blk
+            slopes = np.concatenate(slopes) if slopes else np.zeros(0, dtype=dtype)
+        out = np.zeros(0)
+        if len(ranks):
+            slopes.partition(np.unique(ranks))
+            out = slopes[ranks]
+        return (s_tot if years is not None else s_out, out.astype(float))
+
+    # Else, count the slopes in buckets, and split the buckets of the requested order statistics
+    # until each holds at most max_slopes slopes. The edges of the buckets are drawn from random
+    # samples of slopes, so that the tied slopes (which fall on the edges) are never stored.
+    rng = np.random.default_rng(seed)
+    max_slopes = max(1, max_memory // (4 * (itemsize + 8) * max(1, len(np.unique(ranks)))))
+    max_edges = max(1, max_memory // 1024)
+    (keep, split, first) = (np.zeros(0), [((-np.inf, np.inf), n_pairs)], True)
+    while True:
+        # New edges, in the buckets to split
+        n_edges = [min(max(1, max_edges // len(split)), int(np.ceil(4 * count / max_slopes)))
+                   for (_, count) in split]
+        new = [_sample_edges(t, t_scale, obs_t, bounds, n_edges[ind],
+                             int(64 * n_edges[ind] * n_pairs / count) + 1, block // 4, rng)
+               for (ind, (bounds, count)) in enumerate(split)]
+        edges = np.unique(np.concatenate([keep] + new))
+
+        # Count the slopes in each bucket (and compute S, during the first pass)
+        counts = np.zeros(2 * len(edges) + 4, dtype=np.int64)
+        if jit:
+            s_blk = int(_mkn().bucket_counts(t, t_scale, obs_t, jit_years, edges, counts))
+        else:
+            s_blk = 0
+            for (slp, s_item) in _pair_blocks(t, obs_t, years=years if first else None,
+                                              block=block, t_scale=t_scale):
+                counts += np.bincount(_bucket_codes(edges, slp), minlength=len(counts))
+                s_blk += s_item
+        (s_tot, first) = (s_blk if first else s_tot, False)
+
+        # Which buckets do I need ?
+        cum = np.cumsum(counts)
+        bkts = np.searchsorted(cum, ranks, side='right')
+        bounds = {item: _bucket_bounds(edges, item) for item in np.unique(bkts)}
+        split = [(bounds[item][:2], counts[item]) for item in bounds
+                 if bounds[item][2] and counts[item] > max_slopes]
+        # Stop if no bucket is too large, or if I could not split them
+        if len(split) == 0 or not any(len(item) for item in new):
+            break
+        keep = np.array([val for item in bounds.values() for val in item[:2]
+                         if np.isfinite(val)])
+
+    # The buckets of a single value are already known
+    out = np.array([bounds[item][0] for item in bkts], dtype=float)
+    needed = np.array([item for item in bounds if bounds[item][2]], dtype=np.int64)
+
+    # Last pass: collect the slopes of the other buckets
+    kept = {item: [] for item in needed}
+    if jit:
+        is_needed = np.zeros(len(counts), dtype=bool)
+        is_needed[needed] = True
+        n_kept = int(counts[needed].sum())
+        (vals, vals_bkt) = (np.empty(n_kept, dtype=dtype), np.empty(n_kept, dtype=np.int64))
+        _mkn().bucket_collect(t, t_scale, obs_t, edges, is_needed, vals, vals_bkt)
+        for item in needed:
+            kept[item] += [vals[vals_bkt == item]]
+    else:
+        for (slp, _) in _pair_blocks(t, obs_t, block=block, t_scale=t_scale):
+            bkt = _bucket_codes(edges, slp)
+            sel = np.isin(bkt, needed)
+            for item in np.unique(bkt[sel]):
+                kept[item] += [slp[sel][bkt[sel] == item]]
+
+    for item in needed:
+        vals = np.sort(np.concatenate(kept[item]))
+        out[bkts == item] = vals[ranks[bkts == item] - (cum[item] - counts[item])]
+
+    return (s_tot if years is not None else s_out, out)
@@ -14,13 +14,16 @@ This file contains the core routines for the mannkendall package.
 # Import python packages
 import warnings
 import numpy as np
-import scipy.stats as spstats
 
 # Import from this package
 from . import mk_hardcoded as mkh
 from . import mk_tools as mkt
 from . import mk_stats as mks
 from . import mk_white as mkw
+from . import mk_parallel as mkp
+from . import mk_exact as mkx
+from . import mk_boot as mkb
+from . import mk_groups as mkg
 
 
 def prob_3pw(p_pw, p_tfpw_y, alpha_mk):
@@ -67,15 +70,28 @@ def prob_3pw(p_pw, p_tfpw_y, alpha_mk):
     return (p, ss)
 
 
-def compute_mk_stat(obs_dts, obs, resolution, alpha_mk=95, alpha_cl=90):
+def compute_mk_stat(obs_dts, obs, resolution, alpha_mk=95, alpha_cl=90, sig_method='analytic',
+                    boot_kwargs=None, dtype='float64'):
     """ Compute all the components for the MK statistics.
 
     Args:
-        obs_dts (ndarray of datetime.datetime): a list of observation datetimes.
+        obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int, or mk_tools.TimeIndex): a
+            list of observation datetimes. int are taken as seconds since 1970-01-01.
         obs (ndarray of floats): the data array. Must be 1-D.
         resolution (float): delta value below which two measurements are considered equivalent.
         alpha_mk (float, optional): confidence level for the Mann-Kendall test in %. Defaults to 95.
         alpha_cl (float, optional): confidence level for the Sen's slope in %. Defaults to 90.
+        sig_method (str, optional): one of ['analytic', 'boot']. 'analytic' derives the probability
+            from the distribution of S and the confidence limits of the Sen's slope from its
+            variance. 'boot' derives them from a block permutation test and a block bootstrap
+            (see mk_boot), which account for the autocorrelation of the data.
+            Defaults to 'analytic'.
+        boot_kwargs (dict, optional): options of the resampling ('n_boot', 'block_len', 'batch',
+            'seed'), see mk_boot.perm_p(). Defaults to None.
+        dtype (str, optional): one of ['float64', 'float32'], the floating point type of the
+            pairwise slopes of the Sen's slope. 'float32' halves their memory footprint, but the
+            slope and its confidence limits then carry an error bounded in
+            mk_kernels.pairwise_stats(). s, vari, z and p are not affected. Defaults to 'float64'.
 
     Returns:
         (dict, int, float, float): result, s, vari, z
@@ -88,19 +104,30 @@ def compute_mk_stat(obs_dts, obs, resolution, alpha_mk=95, alpha_cl=90):
             raise Exception('Ouch! alphas must be of type float, not: %s' %(type(item)))
     if alpha_mk < 0 or alpha_mk > 100 or alpha_cl < 0 or alpha_cl > 100:
         raise Exception("Ouch ! Confidence limits must be 0 <= CL <= 100.")
+    _check_methods(sig_method, dtype)
 
     result = {}
 
+    # Prepare the time axis only once
+    obs_dts = mkt.TimeIndex(obs_dts)
+
     t = mkt.nb_tie(obs, resolution)
-    (s, n) = mks.s_test(obs, obs_dts)
+    n = mks.year_counts(obs, obs_dts)
     vari = mkt.kendall_var(obs, t, n)
+
+    # Get S and the Sen's slope from a single pass over the data pairs
+    (s, slope, slope_min, slope_max) = mks.s_sen_slope(obs_dts, obs, vari, alpha_cl=alpha_cl,
+                                                       dtype=dtype)
     z = mks.std_normal_var(s, vari)
 
-    if len(obs) > 10:
-        result['p'] = 2 * (1 - spstats.norm.cdf(np.abs(z), loc=0, scale=1))
+    if sig_method == 'boot':
+        boot_kwargs = {} if boot_kwargs is None else boot_kwargs
+        result['p'] = mkb.perm_p(s, [obs], [obs_dts], alpha_mk=alpha_mk, **boot_kwargs)[0]
+        (slope_min, slope_max) = mkb.boot_sen_cl(obs_dts, obs, slope, alpha_cl=alpha_cl,
+                                                 **boot_kwargs)
     else:
-        prob_mk_n = mkh.PROB_MK_N
-        result['p'] = prob_mk_n[np.abs(s), len(obs)] # TODO: np.abs(s) + 1 ?
+        # Exact probability for small samples, normal approximation otherwise
+        result['p'] = mkx.mk_p_value(s, [obs], [obs_dts], z)
 
     # Determine the statistic significance
     if result['p'] <= 1- alpha_mk/100:
@@ -108,7 +135,6 @@ def compute_mk_stat(obs_dts, obs, resolution, alpha_mk=95, alpha_cl=90):
     else:
         result['ss'] = 0
 
-    (slope, slope_min, slope_max) = mks.sen_slope(obs_dts, obs, vari, alpha_cl=alpha_cl)
     # Transform the slop in 1/yr.
     result['slope'] = slope * 3600 * 24 * 365.25
     result['ucl'] = slope_max * 3600 * 24 *365.25
@@ -117,7 +143,9 @@ def compute_mk_stat(obs_dts, obs, resolution, alpha_mk=95, alpha_cl=90):
     return (result, s, vari, z)
 
 def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
-                 alpha_mk=95, alpha_cl=90, alpha_xhomo=90, alpha_ak=95):
+                 alpha_mk=95, alpha_cl=90, alpha_xhomo=90, alpha_ak=95, max_workers=1,
+                 chunksize=1, cache=None, sig_method='analytic', boot_kwargs=None,
+                 dtype='float64', groups=None):
     """ Applies the Mann-Kendall test and the Sen slope on the given time granularity for a data set
     split into different temporal aggregations.
 
@@ -144,8 +172,9 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
 
 
     Args:
-        multi_obs_dts (list of 1-D ndarray of datetime.datime): the observation times. Each array
-                                                                defines a new season.
+        multi_obs_dts (list of 1-D ndarray of datetime.datime, numpy.datetime64 or int): the
+            observation times. Each array defines a new season. int are taken as seconds since
+            1970-01-01.
         multi_obs (list of 1-D ndarray): the observations. Each array defines a new season.
         resolution (float): interval to determine the number of ties. It should be similar to the
                             resolution of the instrument.
@@ -157,6 +186,24 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
                                        Defaults to 90.
         alpha_ak (float, optional): confidence limit for the first lag autocorrelation in %.
                                     Defaults to 95.
+        max_workers (int, optional): number of processes used to compute the MK statistics of the
+            different temporal aggregations and prewhitening methods. None uses as many processes as
+            there are CPUs. Defaults to 1 (no parallelism).
+        chunksize (int, optional): number of computations sent to a process at once. Defaults to 1.
+        cache (mk_white.PrewhiteCache, optional): if set, re-use the prewhitened data of previous
+            calls with the same data, resolution and alpha_ak. Defaults to None.
+        sig_method (str, optional): one of ['analytic', 'boot']. With 'boot', the probabilities
+            and the confidence limits of the Sen's slopes come from a block permutation test and a
+            block bootstrap, see compute_mk_stat(). Defaults to 'analytic'.
+        boot_kwargs (dict, optional): options of the resampling, see mk_boot.perm_p().
+            Defaults to None.
+        dtype (str, optional): one of ['float64', 'float32'], the floating point type of the
+            pairwise slopes, see compute_mk_stat(). Defaults to 'float64'.
+        groups (str|ndarray|mk_groups.Grouping, optional): if set, multi_obs_dts and multi_obs
+            are a single series (1-D ndarray), split into temporal aggregations according to
+            groups: one of ['month', 'season', 'dayofweek', 'hour'], a label for each
+            observation, or a mk_groups.Grouping (whose observation times are then used). The
+            temporal aggregations are in the order of the sorted labels. Defaults to None.
 
     Returns:
         dict of dict: n+1 entries, where n= number of temporal aggregation. The last item
@@ -194,6 +241,24 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
     if pw_method not in mkh.VALID_PW_METHODS:
         raise Exception('Ouch ! pw_method unknown.')
 
+    _check_alphas(alpha_mk, alpha_cl, alpha_xhomo, alpha_ak)
+    _check_methods(sig_method, dtype)
+
+    kwargs = {'pw_method': pw_method, 'alpha_mk': alpha_mk, 'alpha_cl': alpha_cl,
+              'alpha_xhomo': alpha_xhomo, 'alpha_ak': alpha_ak, 'max_workers': max_workers,
+              'chunksize': chunksize, 'cache': cache, 'sig_method': sig_method,
+              'boot_kwargs': boot_kwargs, 'dtype': dtype}
+
+    if groups is not None:
+        # A single series: the groups are defined by indices, and there is nothing to concatenate
+        # nor to (de-)sort.
+        if not isinstance(groups, mkg.Grouping):
+            groups = mkg.Grouping(multi_obs_dts, groups)
+        if np.ndim(multi_obs) != 1:
+            raise Exception('Ouch ! With groups, I was expecting a single 1-D array of obs.')
+        return _mk_temp_aggr(groups.split_dts(), groups.sort(np.asarray(multi_obs, dtype=float)),
+                             _group_layout(groups), resolution, **kwargs)
+
     if not isinstance(multi_obs_dts, list):
         # If I received a 1-D array, be nice and deal with it.
         if isinstance(multi_obs_dts, np.ndarray):
@@ -211,6 +276,9 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
     if len(multi_obs_dts) != len(multi_obs):
         raise Exception('Ouch ! multi_obs_dts and multi_obs should have the same length !')
 
+    # Convert the datetimes only once
+    multi_obs_dts = [mkt.dts_to_dt64(item) for item in multi_obs_dts]
+
     if np.any([np.ndim(item) != 1 for item in multi_obs_dts]):
         raise Exception('Ouch ! I was expecting 1-D arrays inside multi_obs_dts.')
     if np.any([np.ndim(item) != 1 for item in multi_obs]):
@@ -219,31 +287,166 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
     if np.any([len(item) != len(multi_obs[ind]) for (ind, item) in enumerate(multi_obs_dts)]):
         raise Exception('Ouch ! Inconsistent length between obs and obs_dts arrays.')
 
-    for item in [alpha_mk, alpha_cl, alpha_xhomo, alpha_ak]:
+    return _mk_temp_aggr([mkt.TimeIndex(item) for item in multi_obs_dts], multi_obs,
+                         _ta_layout(multi_obs_dts), resolution, **kwargs)
+
+def _check_methods(sig_method, dtype):
+    """ Check the method used to assess the significance, and the type of the pairwise slopes.
+
+    Args:
+        sig_method (str): one of mk_hardcoded.VALID_SIG_METHODS.
+        dtype (str): one of mk_hardcoded.VALID_PAIR_DTYPES.
+
+    Raises:
+        Exception: if any of them is not supported.
+
+    """
+
+    if sig_method not in mkh.VALID_SIG_METHODS:
+        raise Exception('Ouch ! sig_method must be one of %s, not: %s' % (mkh.VALID_SIG_METHODS,
+                                                                         sig_method))
+    if dtype not in mkh.VALID_PAIR_DTYPES:
+        raise Exception('Ouch ! dtype must be one of %s, not: %s' % (mkh.VALID_PAIR_DTYPES, dtype))
+
+def _check_alphas(*alphas):
+    """ Check that the confidence limits are valid.
+
+    Args:
+        *alphas (float): the confidence limits to check, in %.
+
+    Raises:
+        Exception: if any of the alphas is not a number between 0 and 100.
+
+    """
+
+    for item in alphas:
         if not isinstance(item, (int, float)):
             raise Exception('Ouch ! alpha should be of type float, not: %s' % (type(item)))
         if (item > 100) or (item < 0):
-            raise Exception('Ouch ! I need 0 < alpha < 100, not:' % (item))
+            raise Exception('Ouch ! I need 0 < alpha < 100, not: %s' % (item))
+
+def _ta_layout(multi_obs_dts):
+    """ Compute how the temporal aggregations are interleaved in time.
+
+    This only depends on the observation times, and can thus be shared by all the series measured
+    at the same times.
+
+    Args:
+        multi_obs_dts (list of 1-D ndarray of numpy.datetime64[us]): the observation times.
+
+    Returns:
+        (1-D ndarray of int, 1-D ndarray of numpy.datetime64[us], list of 1-D ndarray of int): the
+        indices that sort the concatenated times, the sorted times, and for each temporal
+        aggregation, the indices of its data in the sorted data.
+
+    """
+
+    all_dts = np.concatenate(multi_obs_dts)
+    sort_ind = all_dts.argsort()
+    split_ind = np.cumsum([len(item) for item in multi_obs_dts])[:-1]
+    unsort_ind = mkt.de_sort(np.arange(len(sort_ind)), sort_ind)
+
+    return (sort_ind, all_dts[sort_ind], np.split(unsort_ind, split_ind))
+
+def _group_layout(groups):
+    """ The equivalent of _ta_layout() for a single series split by a mk_groups.Grouping.
+
+    Args:
+        groups (mk_groups.Grouping): the temporal aggregations.
+
+    Returns:
+        (None, mk_tools.TimeIndex, list of 1-D ndarray of int): None, as the series needs no
+        sorting, the observation times, and the indices of each temporal aggregation.
+
+    """
+
+    return (None, groups.time_index, list(groups))
+
+def _tot_p(s_tot, multi_obs, multi_obs_dts, z_tot, alpha_mk, sig_method, boot_kwargs):
+    """ Compute the probability of the MK test for the sum of all the temporal aggregations.
+
+    Args:
+        s_tot (float): the sum of the S statistics of the temporal aggregations.
+        multi_obs (list of 1-D ndarray): the (prewhitened) observations.
+        multi_obs_dts (list of mk_tools.TimeIndex): the observation times.
+        z_tot (float): the normal standard variable of s_tot.
+        alpha_mk (float): confidence limit for Mk test in %.
+        sig_method (str): one of ['analytic', 'boot'].
+        boot_kwargs (dict): options of the resampling, or None.
+
+    Returns:
+        float: the probability.
+
+    """
+
+    if sig_method == 'boot':
+        # Permute the blocks of all the temporal aggregations together
+        return mkb.perm_p(s_tot, multi_obs, multi_obs_dts, alpha_mk=alpha_mk,
+                          **({} if boot_kwargs is None else boot_kwargs))[0]
+
+    return mkx.mk_p_value(s_tot, multi_obs, multi_obs_dts, z_tot)
+
+def _mk_temp_aggr(multi_obs_dts, multi_obs, layout, resolution, pw_method='3pw',
+                  alpha_mk=95, alpha_cl=90, alpha_xhomo=90, alpha_ak=95, max_workers=1,
+                  chunksize=1, cache=None, sig_method='analytic', boot_kwargs=None,
+                  dtype='float64'):
+    """ Core of mk_temp_aggr(), without any sanity check of the input.
+
+    Args:
+        multi_obs_dts (list of mk_tools.TimeIndex): the observation times.
+        multi_obs (list of 1-D ndarray|1-D ndarray): the observations of each temporal aggregation,
+            or the whole series in time order if the layout comes from _group_layout().
+        layout (tuple): the output of _ta_layout(multi_obs_dts) or of _group_layout().
+        resolution (float): interval to determine the number of ties.
+        pw_method (str, optional): the prewhitening method. Defaults to '3pw'.
+        alpha_mk (float, optional): confidence limit for Mk test in %. Defaults to 95.
+        alpha_cl (float, optional): confidence limit for the Sen's slope in %. Defaults to 90.
+        alpha_xhomo (float, optional): confidence limit for the homogeneity between seasons in %.
+                                       Defaults to 90.
+        alpha_ak (float, optional): confidence limit for the first lag autocorrelation in %.
+                                    Defaults to 95.
+        max_workers (int, optional): number of processes used to compute the MK statistics of the
+            different temporal aggregations and prewhitening methods. None uses as many processes as
+            there are CPUs. Defaults to 1 (no parallelism).
+        chunksize (int, optional): number of computations sent to a process at once. Defaults to 1.
+        cache (mk_white.PrewhiteCache, optional): the cache of the prewhitened data.
+            Defaults to None.
+        sig_method (str, optional): one of ['analytic', 'boot']. Defaults to 'analytic'.
+        boot_kwargs (dict, optional): options of the resampling. Defaults to None.
+        dtype (str, optional): the floating point type of the pairwise slopes.
+            Defaults to 'float64'.
+
+    Returns:
+        dict of dict: see mk_temp_aggr().
+
+    """
+
+    from scipy.stats import chi2
+
+    (sort_ind, sorted_dts, ta_ind_sorted) = layout
 
     # How many different time aggregates do we have ?
     n_tas = len(multi_obs_dts)
-    # What is the length of each time aggregate ?
-    len_tas = [len(item) for item in multi_obs]
 
     # First, apply the necessary prewhitening to *all* the data combined.
     # To do that, I need to put the data in order !
-    sort_ind = np.concatenate(multi_obs_dts).argsort()
-    multi_obs_pw = mkw.prewhite(np.concatenate(multi_obs)[sort_ind],
-                                np.concatenate(multi_obs_dts)[sort_ind],
-                                resolution, alpha_ak=alpha_ak)
-
-    # Re-split the data according to the original input ... including
-    for key in multi_obs_pw:
-        # De-sort the output array
-        desorted = mkt.de_sort(multi_obs_pw[key], sort_ind)
-        # De-concatenate it.
-        multi_obs_pw[key] = list(np.split(desorted, np.array([np.sum(len_tas[:ind+1])
-                                                              for ind in range(n_tas-1)])))
+    if sort_ind is None:
+        # I got the whole series, already in order
+        (sorted_obs, multi_obs) = (multi_obs, [multi_obs[item] for item in ta_ind_sorted])
+    else:
+        sorted_obs = np.concatenate(multi_obs)[sort_ind]
+    # The prewhitened data is only read: get read-only arrays, without any defensive copy.
+    multi_obs_pw = mkw.prewhite(sorted_obs, sorted_dts,
+                                resolution, alpha_ak=alpha_ak, cache=cache, copy=False)
+    # Identical prewhitened series (e.g. without significant autocorrelation) are tested only once.
+    aliases = multi_obs_pw.aliases()
+
+    # Re-split the data according to the original input
+    for key in mkw.PW_KEYS:
+        if aliases[key] != key:
+            multi_obs_pw[key] = multi_obs_pw[aliases[key]]
+            continue
+        multi_obs_pw[key] = [multi_obs_pw[key][item] for item in ta_ind_sorted]
 
     # Create some useful variables
     s_tot = {'-': 0.0, 'pw': 0.0, 'tfpw_y': 0.0}
@@ -253,6 +456,22 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
     result = {}
     z = np.zeros(n_tas) * np.nan
 
+    # The MK statistics of the different periods and prewhitening methods are independent.
+    # Compute them all in one go, possibly in parallel.
+    keys = ['pw', 'tfpw_y', 'vctfpw'] if pw_method == '3pw' else [pw_method]
+    tasks = [(ta_ind, key) for ta_ind in range(n_tas) if len(multi_obs[ta_ind]) > 1
+             for key in dict.fromkeys(aliases[item] for item in keys)]
+    stats = mkp.pmap(compute_mk_stat,
+                     [(multi_obs_dts[ta_ind], multi_obs_pw[key][ta_ind], resolution)
+                      for (ta_ind, key) in tasks],
+                     kwargs={'alpha_mk': alpha_mk, 'alpha_cl': alpha_cl,
+                             'sig_method': sig_method, 'boot_kwargs': boot_kwargs,
+                             'dtype': dtype},
+                     max_workers=max_workers, chunksize=chunksize)
+    stats = dict(zip(tasks, stats))
+    stats = {(ta_ind, key): stats[(ta_ind, aliases[key])] for ta_ind in range(n_tas)
+             if len(multi_obs[ta_ind]) > 1 for key in keys}
+
     # Start looping through the different periods
     for ta_ind in range(n_tas):
 
@@ -267,32 +486,22 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
         # Now, run whichever method was requested
         # Compute the Mann-Kendall parameters for PW method
         if pw_method in ['pw', 'tfpw_y', 'tfpw_ws', 'vctfpw']:
-            (result[ta_ind], s, vari, z[ta_ind]) = compute_mk_stat(multi_obs_dts[ta_ind],
-                                                                   multi_obs_pw[pw_method][ta_ind],
-                                                                   resolution, alpha_mk=alpha_mk,
-                                                                   alpha_cl=alpha_cl)
+            (result[ta_ind], s, vari, z[ta_ind]) = stats[(ta_ind, pw_method)]
             s_tot['-'] += s
             var_tot['-'] += vari
             #ak = ak_y[pw_method]
 
         elif pw_method == '3pw':
 
-            (result_pw, s_pw, vari_pw, _) = compute_mk_stat(multi_obs_dts[ta_ind],
-                                                            multi_obs_pw['pw'][ta_ind], resolution,
-                                                            alpha_mk=alpha_mk, alpha_cl=alpha_cl)
+            (result_pw, s_pw, vari_pw, _) = stats[(ta_ind, 'pw')]
             s_tot['pw'] += s_pw
             var_tot['pw'] += vari_pw
 
-            (result_tfpw_y, s_tfpw_y, vari_tfpw_y, _) = \
-                compute_mk_stat(multi_obs_dts[ta_ind], multi_obs_pw['tfpw_y'][ta_ind], resolution,
-                                alpha_mk=alpha_mk, alpha_cl=alpha_cl)
+            (result_tfpw_y, s_tfpw_y, vari_tfpw_y, _) = stats[(ta_ind, 'tfpw_y')]
             s_tot['tfpw_y'] += s_tfpw_y
             var_tot['tfpw_y'] += vari_tfpw_y
 
-            (result_vctfpw, _, _, z[ta_ind]) = compute_mk_stat(multi_obs_dts[ta_ind],
-                                                               multi_obs_pw['vctfpw'][ta_ind],
-                                                               resolution, alpha_mk=alpha_mk,
-                                                               alpha_cl=alpha_cl)
+            (result_vctfpw, _, _, z[ta_ind]) = stats[(ta_ind, 'vctfpw')]
 
             # Determine the statistical significance
             (result[ta_ind]['p'], result[ta_ind]['ss']) = prob_3pw(result_pw['p'],
@@ -315,13 +524,8 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
 
         z_tot = mks.std_normal_var(s_tot['-'], var_tot['-'])
 
-        if np.sum([np.count_nonzero(~np.isnan(item)) for item in multi_obs]) > 10:
-            result[n_tas]['p'] = 2 * (1 - spstats.norm.cdf(np.abs(z_tot), loc=0, scale=1))
-        else:
-            # TODO: check this !
-            result[n_tas]['p'] = mkh.PROB_MK_N[np.nansum(np.abs(s_tot['-'])),
-                                               np.sum([np.count_nonzero(~np.isnan(item)) for item
-                                                       in multi_obs])]
+        result[n_tas]['p'] = _tot_p(s_tot['-'], multi_obs_pw[pw_method], multi_obs_dts, z_tot,
+                                    alpha_mk, sig_method, boot_kwargs)
 
         # Compute the statistical significance
         if result[n_tas]['p'] <= 1-alpha_mk/100:
@@ -336,21 +540,16 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
 
         z_tot_pw = mks.std_normal_var(s_tot['pw'], var_tot['pw'])
 
-        if np.sum([np.count_nonzero(~np.isnan(item)) for item in multi_obs]) > 10:
-            p_tot_pw = 2 * (1 - spstats.norm.cdf(np.abs(z_tot_pw), loc=0, scale=1))
-        else:
-            p_tot_pw = mkh.PROB_MK_N[np.nansum(np.abs(s_tot['pw'])),
-                                     np.sum([np.count_nonzero(~np.isnan(item)) for item
-                                             in multi_obs])] # TODO: check this !
+        p_tot_pw = _tot_p(s_tot['pw'], multi_obs_pw['pw'], multi_obs_dts, z_tot_pw, alpha_mk,
+                          sig_method, boot_kwargs)
 
         z_tot_tfpw_y = mks.std_normal_var(s_tot['tfpw_y'], var_tot['tfpw_y'])
 
-        if np.sum([np.count_nonzero(~np.isnan(item)) for item in multi_obs]) > 10:
-            p_tot_tfpw_y = 2 * (1 - spstats.norm.cdf(np.abs(z_tot_tfpw_y), loc=0, scale=1))
+        if aliases['tfpw_y'] == aliases['pw']:
+            p_tot_tfpw_y = p_tot_pw
         else:
-            p_tot_tfpw_y = mkh.PROB_MK_N[np.nansum(np.abs(s_tot['tfpw_y'])),
-                                         np.sum([np.count_nonzero(~np.isnan(item))
-                                                 for item in multi_obs])] # TODO: check this !
+            p_tot_tfpw_y = _tot_p(s_tot['tfpw_y'], multi_obs_pw['tfpw_y'], multi_obs_dts,
+                                  z_tot_tfpw_y, alpha_mk, sig_method, boot_kwargs)
 
         # Determine the statistical significance
         (result[n_tas]['p'], result[n_tas]['ss']) = prob_3pw(p_tot_pw, p_tot_tfpw_y, alpha_mk)
@@ -363,7 +562,7 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
     # xhomo has a chi-squared distribution with n-1 and 1 degree of freedom. Seasonal trends
     # are homogeneous if xhomo is smaller than the threshold defined by the degree of freedom and
     # the confidence level alpha_xhomo.
-    if n_tas == 1 or (xhomo <= spstats.distributions.chi2.ppf(1-alpha_xhomo/100, df=n_tas-1)):
+    if n_tas == 1 or (xhomo <= chi2.ppf(1-alpha_xhomo/100, df=n_tas-1)):
         for item in ['slope', 'ucl', 'lcl']:
             result[n_tas][item] = np.nanmedian([result[key][item] for key in result
                                                 if key != n_tas])
@@ -373,3 +572,357 @@ def mk_temp_aggr(multi_obs_dts, multi_obs, resolution, pw_method='3pw',
             result[n_tas][item] = np.nan
 
     return result
+
+def _batch_array(items, n_times, fill):
+    """ Stack the series of one temporal aggregation into a (n_series, n_times) array.
+
+    Args:
+        items (2-D ndarray, or list of 1-D ndarray): the series. Ragged series shorter than
+            n_times are padded at the end with fill.
+        n_times (int): the number of observation times.
+        fill (float|bool): the value used to pad ragged series.
+
+    Returns:
+        2-D ndarray: a fresh (n_series, n_times) array.
+
+    """
+
+    if isinstance(items, np.ndarray):
+        if np.ndim(items) != 2 or np.shape(items)[1] != n_times:
+            raise Exception('Ouch ! I was expecting a 2-D array of shape (n_series, %i).' %
+                            (n_times))
+        return np.array(items, dtype=type(fill))
+
+    out = np.full((len(items), n_times), fill, dtype=type(fill))
+    for (ind, item) in enumerate(items):
+        if np.ndim(item) != 1 or len(item) > n_times:
+            raise Exception('Ouch ! Series %i does not fit on the time axis.' % (ind))
+        out[ind, :len(item)] = item
+
+    return out
+
+def _batch_lists(multi_obs_dts, multi_obs, masks):
+    """ Prepare the input of mk_temp_aggr_batch(), given as lists of temporal aggregations.
+
+    Args:
+        multi_obs_dts (list of 1-D ndarray|1-D ndarray): the observation times.
+        multi_obs (list of 2-D ndarray|2-D ndarray|list of 1-D ndarray): the observations.
+        masks (list of 2-D ndarray of bool|2-D ndarray of bool|None): the observations to ignore.
+
+    Returns:
+        (list of mk_tools.TimeIndex, tuple, list of 2-D ndarray): the observation times, the output
+        of _ta_layout(), and a fresh (n_series, n_times) array for each temporal aggregation.
+
+    """
+
+    if isinstance(multi_obs_dts, np.ndarray):
+        multi_obs_dts = [multi_obs_dts]
+    if not isinstance(multi_obs_dts, list):
+        raise Exception('Ouch ! Unsupported type: %s' % (type(multi_obs_dts)))
+
+    # Convert the datetimes only once
+    multi_obs_dts = [mkt.dts_to_dt64(item) for item in multi_obs_dts]
+    if np.any([np.ndim(item) != 1 for item in multi_obs_dts]):
+        raise Exception('Ouch ! I was expecting 1-D arrays inside multi_obs_dts.')
+    n_tas = len(multi_obs_dts)
+
+    # A single temporal aggregation can be given directly, as a 2-D array or a list of series
+    if n_tas == 1 and not (isinstance(multi_obs, list) and len(multi_obs) == 1 and
+                           np.ndim(multi_obs[0]) == 2):
+        multi_obs = [multi_obs]
+        if masks is not None:
+            masks = [masks]
+    elif isinstance(masks, np.ndarray):
+        masks = [masks]
+
+    if not isinstance(multi_obs, list) or len(multi_obs) != n_tas:
+        raise Exception('Ouch ! multi_obs_dts and multi_obs should have the same length !')
+    if masks is not None and (not isinstance(masks, list) or len(masks) != n_tas):
+        raise Exception('Ouch ! masks and multi_obs should have the same structure !')
+
+    # Build a fresh (n_series, n_times) array for each temporal aggregation
+    multi_obs = [_batch_array(item, len(multi_obs_dts[ind]), np.nan)
+                 for (ind, item) in enumerate(multi_obs)]
+    n_series = len(multi_obs[0])
+    if np.any([len(item) != n_series for item in multi_obs]):
+        raise Exception('Ouch ! All the temporal aggregations must contain the same series.')
+
+    if masks is not None:
+        for (ind, item) in enumerate(masks):
+            mask = _batch_array(item, len(multi_obs_dts[ind]), True)
+            if len(mask) != n_series:
+                raise Exception('Ouch ! Inconsistent number of series between obs and masks.')
+            multi_obs[ind][mask] = np.nan
+
+    # The interleaving of the temporal aggregations, and the time axes, are the same for all the
+    # series
+    layout = _ta_layout(multi_obs_dts)
+
+    return ([mkt.TimeIndex(item) for item in multi_obs_dts], layout, multi_obs)
+
+def _batch_groups(obs_dts, obs, masks, groups):
+    """ Prepare the input of mk_temp_aggr_batch(), given as whole series and a grouping.
+
+    Args:
+        obs_dts (1-D ndarray): the observation times. Ignored if groups is a mk_groups.Grouping.
+        obs (2-D ndarray|list of 1-D ndarray): the observations, of shape (n_series, n_times).
+        masks (2-D ndarray of bool|list of 1-D ndarray of bool|None): the observations to ignore.
+        groups (str|ndarray|mk_groups.Grouping): the temporal aggregations, see mk_temp_aggr().
+
+    Returns:
+        (list of mk_tools.TimeIndex, tuple, 2-D ndarray): the observation times of each temporal
+        aggregation, the output of _group_layout(), and a fresh (n_series, n_times) array with the
+        series in time order.
+
+    """
+
+    if not isinstance(groups, mkg.Grouping):
+        groups = mkg.Grouping(obs_dts, groups)
+
+    obs = _batch_array(obs, len(groups.time_index), np.nan)
+    if masks is not None:
+        mask = _batch_array(masks, len(groups.time_index), True)
+        if len(mask) != len(obs):
+            raise Exception('Ouch ! Inconsistent number of series between obs and masks.')
+        obs[mask] = np.nan
+
+    return (groups.split_dts(), _group_layout(groups), groups.sort(obs))
+
+def mk_temp_aggr_batch(multi_obs_dts, multi_obs, resolution, masks=None, pw_method='3pw',
+                       alpha_mk=95, alpha_cl=90, alpha_xhomo=90, alpha_ak=95, max_workers=1,
+                       chunksize=1, cache=None, sig_method='analytic', boot_kwargs=None,
+                       dtype='float64', groups=None):
+    """ Apply mk_temp_aggr() to many series sharing the same observation times.
+
+    The sanity checks, the datetime conversion and the (de-)sorting of the temporal aggregations
+    are performed only once for all the series. Series without any valid data are skipped.
+
+    Args:
+        multi_obs_dts (list of 1-D ndarray of datetime.datime, numpy.datetime64 or int): the
+            observation times, shared by all the series. Each array defines a new season. A single
+            1-D ndarray is accepted for a single temporal aggregation.
+        multi_obs (list of 2-D ndarray): the observations. Each array defines a new season, and has
+            a shape (n_series, len(multi_obs_dts[i])). For a single temporal aggregation, a 2-D
+            ndarray, or a list of (possibly ragged) 1-D ndarray, is also accepted. Ragged series are
+            padded with NaNs at the end.
+        resolution (float): interval to determine the number of ties. It should be similar to the
+                            resolution of the instrument.
+        masks (list of 2-D ndarray of bool, optional): True for the observations to ignore. Must
+            have the same structure as multi_obs. Defaults to None.
+        pw_method (str): must be one of ['3pw', 'pw, 'tfpw_y', 'tfpw_ws', 'vctfpw'].
+                         Defaults to '3pw'.
+        alpha_mk (float, optional): confidence limit for Mk test in %. Defaults to 95.
+        alpha_cl (float, optional): confidence limit for the Sen's slope in %. Defaults to 90.
+        alpha_xhomo (float, optional): confidence limit for the homogeneity between seasons in %.
+                                       Defaults to 90.
+        alpha_ak (float, optional): confidence limit for the first lag autocorrelation in %.
+                                    Defaults to 95.
+        max_workers (int, optional): number of processes used to process the different series.
+            None uses as many processes as there are CPUs. Defaults to 1 (no parallelism).
+        chunksize (int, optional): number of series sent to a process at once. Defaults to 1.
+        cache (mk_white.PrewhiteCache, optional): if set, re-use the prewhitened data of previous
+            calls with the same data, resolution and alpha_ak. With max_workers > 1, only its
+            store on disk is shared with the processes. Defaults to None.
+        sig_method (str, optional): one of ['analytic', 'boot'], see mk_temp_aggr().
+            Defaults to 'analytic'.
+        boot_kwargs (dict, optional): options of the resampling, see mk_boot.perm_p().
+            Defaults to None.
+        dtype (str, optional): one of ['float64', 'float32'], the floating point type of the
+            pairwise slopes, see compute_mk_stat(). Defaults to 'float64'.
+        groups (str|ndarray|mk_groups.Grouping, optional): if set, multi_obs_dts is a single 1-D
+            ndarray, and multi_obs (and masks) a single (n_series, len(multi_obs_dts)) array (or a
+            list of 1-D ndarray), split into temporal aggregations as in mk_temp_aggr().
+            Defaults to None.
+
+    Returns:
+        ndarray: a structured array of shape (n_series, n+1), where n= number of temporal
+        aggregation, with the fields 'p', 'ss', 'slope', 'ucl', 'lcl' (see mk_temp_aggr()). The last
+        column corresponds to the yearly trend. Use pandas.DataFrame(out[:, i]) to get a DataFrame.
+
+    """
+
+    # Some sanity checks first
+    if pw_method not in mkh.VALID_PW_METHODS:
+        raise Exception('Ouch ! pw_method unknown.')
+
+    _check_alphas(alpha_mk, alpha_cl, alpha_xhomo, alpha_ak)
+    _check_methods(sig_method, dtype)
+
+    if groups is not None:
+        (multi_obs_dts, layout, multi_obs) = _batch_groups(multi_obs_dts, multi_obs, masks,
+                                                           groups)
+        valid = np.any(~np.isnan(multi_obs), axis=1)
+        # Each series is given whole, in time order
+        inputs = [multi_obs[series_ind] for series_ind in np.flatnonzero(valid)]
+    else:
+        (multi_obs_dts, layout, multi_obs) = _batch_lists(multi_obs_dts, multi_obs, masks)
+        valid = np.any([np.any(~np.isnan(item), axis=1) for item in multi_obs], axis=0)
+        inputs = [[item[series_ind] for item in multi_obs] for series_ind in np.flatnonzero(valid)]
+
+    out = np.full((len(valid), len(multi_obs_dts)+1), np.nan, dtype=mkh.MK_RESULT_DTYPE)
+
+    # Process the series, possibly in parallel (but then not the temporal aggregations)
+    results = mkp.pmap(_mk_temp_aggr,
+                       [(multi_obs_dts, item, layout, resolution) for item in inputs],
+                       kwargs={'pw_method': pw_method, 'alpha_mk': alpha_mk, 'alpha_cl': alpha_cl,
+                               'alpha_xhomo': alpha_xhomo, 'alpha_ak': alpha_ak, 'cache': cache,
+                               'sig_method': sig_method, 'boot_kwargs': boot_kwargs,
+                               'dtype': dtype},
+                       max_workers=max_workers, chunksize=chunksize)
+
+    for (series_ind, result) in zip(np.flatnonzero(valid), results):
+        for (ta_ind, item) in result.items():
+            out[series_ind, ta_ind] = tuple(item[name] for name in out.dtype.names)
+
+    return out
+
+def _grid_chunk(obs, groups, resolution, kwargs):
+    """ Process one chunk of grid cells of mk_temp_aggr_grid().
+
+    Args:
+        obs (2-D ndarray): the observations of the cells, of shape (n_cells, n_times), in any
+            numeric dtype. Cast to float here, one chunk at a time.
+        groups (mk_groups.Grouping): the temporal aggregations.
+        resolution (float): interval to determine the number of ties.
+        kwargs (dict): the other arguments of mk_temp_aggr_batch().
+
+    Returns:
+        ndarray: the output of mk_temp_aggr_batch().
+
+    """
+
+    return mk_temp_aggr_batch(None, np.asarray(obs, dtype=float), resolution, groups=groups,
+                              **kwargs)
+
+def _grid_cells(obs, cells):
+    """ Extract (a copy of) some cells of a grid, with the time axis last.
+
+    Args:
+        obs (ndarray): the grid, with the time axis last.
+        cells (ndarray of int): the flat indices of the cells.
+
+    Returns:
+        2-D ndarray: the observations of the cells, of shape (len(cells), n_times), in the dtype
+        of obs.
+
+    """
+
+    return obs[np.unravel_index(cells, np.shape(obs)[:-1])]
+
+def mk_temp_aggr_grid(obs_dts, obs, resolution, axis=0, groups=None, pw_method='3pw',
+                      alpha_mk=95, alpha_cl=90, alpha_xhomo=90, alpha_ak=95, max_workers=1,
+                      chunk_cells=None, cache=None, sig_method='analytic', boot_kwargs=None,
+                      dtype='float64'):
+    """ Apply mk_temp_aggr() along the time axis of a N-D array, e.g. (time, lat, lon) maps.
+
+    The grid cells are processed by chunks of chunk_cells series with mk_temp_aggr_batch(), so
+    that only one chunk of the data is copied at a time: obs keeps its dtype (e.g. float32), and
+    each chunk is only cast to float64 when it is processed. With max_workers > 1, at most
+    2*max_workers chunks are copied at any time. The cells without any valid data are found
+    upfront (chunk by chunk as well), and never processed. The time axis and the temporal
+    aggregations are prepared only once for the whole grid.
+
+    Args:
+        obs_dts (1-D ndarray of datetime.datime, numpy.datetime64 or int|None): the observation
+            times, shared by all the grid cells. int are taken as seconds since 1970-01-01. Can be
+            None if obs is an xarray.DataArray and axis the name of its time dimension, whose
+            coordinate is then used.
+        obs (ndarray|xarray.DataArray): the observations, of any numeric dtype. NaNs mark the
+            missing data.
+        resolution (float): interval to determine the number of ties. It should be similar to the
+                            resolution of the instrument.
+        axis (int|str, optional): the time axis of obs, or the name of the time dimension of an
+            xarray.DataArray. Defaults to 0.
+        groups (str|ndarray|mk_groups.Grouping, optional): the temporal aggregations, see
+            mk_temp_aggr(). Defaults to None, for a single temporal aggregation.
+        pw_method (str): must be one of ['3pw', 'pw, 'tfpw_y', 'tfpw_ws', 'vctfpw'].
+                         Defaults to '3pw'.
+        alpha_mk (float, optional): confidence limit for Mk test in %. Defaults to 95.
+        alpha_cl (float, optional): confidence limit for the Sen's slope in %. Defaults to 90.
+        alpha_xhomo (float, optional): confidence limit for the homogeneity between seasons in %.
+                                       Defaults to 90.
+        alpha_ak (float, optional): confidence limit for the first lag autocorrelation in %.
+                                    Defaults to 95.
+        max_workers (int, optional): number of processes, each processing one chunk at a time.
+            None uses as many processes as there are CPUs. Defaults to 1 (no parallelism).
+        chunk_cells (int, optional): number of grid cells per chunk. Defaults to None, i.e.
+            mk_hardcoded.GRID_CHUNK_CELLS.
+        cache (mk_white.PrewhiteCache, optional): see mk_temp_aggr_batch(). Defaults to None.
+        sig_method (str, optional): one of ['analytic', 'boot'], see mk_temp_aggr().
+            Defaults to 'analytic'.
+        boot_kwargs (dict, optional): options of the resampling, see mk_boot.perm_p().
+            Defaults to None.
+        dtype (str, optional): one of ['float64', 'float32'], the floating point type of the
+            pairwise slopes, see compute_mk_stat(). Defaults to 'float64'.
+
+    Returns:
+        ndarray: a structured array with the shape of the grid (i.e. of obs without its time axis)
+        plus a last dimension of length n+1, where n= number of temporal aggregations, with the
+        fields 'p', 'ss', 'slope', 'ucl', 'lcl' (see mk_temp_aggr()). E.g. out['slope'][..., -1]
+        is the map of the yearly Sen's slope. The cells without valid data are NaN.
+
+    Example:
+        >>> out = mk_temp_aggr_grid(None, data_array, 0.01, axis='time', groups='season')
+        >>> xarray.Dataset({name: (data_array.dims[1:] + ('season', ), out[..., :-1][name])
+        ...                 for name in out.dtype.names})
+
+    """
+
+    # Some sanity checks first
+    if pw_method not in mkh.VALID_PW_METHODS:
+        raise Exception('Ouch ! pw_method unknown.')
+
+    _check_alphas(alpha_mk, alpha_cl, alpha_xhomo, alpha_ak)
+    _check_methods(sig_method, dtype)
+
+    if chunk_cells is None:
+        chunk_cells = mkh.GRID_CHUNK_CELLS
+    if not isinstance(chunk_cells, int) or chunk_cells < 1:
+        raise Exception('Ouch ! chunk_cells should be an int >= 1, not: %s' % (chunk_cells))
+
+    # An xarray.DataArray (or anything alike) can be given with the name of its time dimension
+    if isinstance(axis, str):
+        if not hasattr(obs, 'dims') or axis not in obs.dims:
+            raise Exception('Ouch ! Unknown time dimension: %s' % (axis))
+        if obs_dts is None:
+            obs_dts = np.asarray(obs[axis].values)
+        axis = list(obs.dims).index(axis)
+    if obs_dts is None:
+        raise Exception('Ouch ! I need the observation times.')
+
+    # Put the time axis last, without any copy (nor cast)
+    obs = np.moveaxis(np.asarray(obs), axis, -1)
+    if not np.issubdtype(obs.dtype, np.number) or np.issubdtype(obs.dtype, np.complexfloating):
+        raise Exception('Ouch ! obs should contain real numbers, not: %s' % (obs.dtype))
+    grid_shape = np.shape(obs)[:-1]
+    if np.ndim(obs) == 1:
+        obs = obs[np.newaxis]
+
+    # The temporal aggregations are the same for all the cells
+    if groups is None:
+        groups = np.zeros(np.shape(obs)[-1], dtype=int)
+    if not isinstance(groups, mkg.Grouping):
+        groups = mkg.Grouping(obs_dts, groups)
+    if len(groups.time_index) != np.shape(obs)[-1]:
+        raise Exception('Ouch ! Inconsistent length between obs and obs_dts arrays.')
+
+    # Only the cells with some valid data are processed
+    n_cells = int(np.prod(np.shape(obs)[:-1]))
+    cells = np.concatenate([np.zeros(0, dtype=int)] + [
+        ind + np.flatnonzero(~np.all(np.isnan(_grid_cells(obs, np.arange(ind, min(
+            n_cells, ind + chunk_cells)))), axis=-1)) for ind in range(0, n_cells, chunk_cells)])
+    chunks = [cells[ind:ind+chunk_cells] for ind in range(0, len(cells), chunk_cells)]
+
+    kwargs = {'pw_method': pw_method, 'alpha_mk': alpha_mk, 'alpha_cl': alpha_cl,
+              'alpha_xhomo': alpha_xhomo, 'alpha_ak': alpha_ak, 'cache': cache,
+              'sig_method': sig_method, 'boot_kwargs': boot_kwargs, 'dtype': dtype}
+    # The chunks are only extracted when needed
+    results = mkp.pmap(_grid_chunk,
+                       ((_grid_cells(obs, item), groups, resolution, kwargs) for item in chunks),
+                       max_workers=max_workers)
+
+    out = np.full((int(np.prod(grid_shape)), len(groups)+1), np.nan, dtype=mkh.MK_RESULT_DTYPE)
+    for (item, result) in zip(chunks, results):
+        out[item] = result
+
+    return out.reshape(grid_shape + (len(groups)+1, ))
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors of the Python version of the code listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains the optional numba (JIT-compiled) versions of the pairwise kernels of the
+mannkendall package. They are only used if numba can be imported, see mk_kernels.use_numba().
+"""
+
+# Import the required packages
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+#: bool: whether numba can be used
+AVAILABLE = numba is not None
+
+
+def _jit(func):
+    """ JIT-compile a function with numba, if available.
+
+    Divisions by 0 follow the numpy (IEEE) rules, and no fast-math is allowed, so that the results
+    are identical to the ones of the numpy kernels.
+
+    Args:
+        func (callable): the function to compile.
+
+    Returns:
+        callable: the compiled function, or func itself without numba.
+
+    """
+
+    if numba is None:
+        return func
+
+    return numba.njit(error_model='numpy', nogil=True)(func)
+
+@_jit
+def _sign(val):
+    """ Sign of a number, as numpy.sign() (without NaNs), without branching. """
+
+    return int(val > 0) - int(val < 0)
+
+@_jit
+def count_inversions(seq):
+    """ Count the inversions of a permutation with a (sequential) bottom-up merge-sort.
+
+    Args:
+        seq (ndarray of int): a permutation of 0...len(seq)-1. Must be 1-D.
+
+    Returns:
+        int: the number of inversions, see mk_kernels.count_inversions().
+
+    """
+
+    n = len(seq)
+    src = seq.astype(np.int64)
+    dst = np.empty_like(src)
+    total = 0
+    width = 1
+
+    while width < n:
+        for low in range(0, n, 2 * width):
+            mid = min(low + width, n)
+            high = min(low + 2 * width, n)
+            (i, j, k) = (low, mid, low)
+            while i < mid and j < high:
+                if src[i] <= src[j]:
+                    dst[k] = src[i]
+                    i += 1
+                else:
+                    # All the remaining elements of the left block are larger
+                    dst[k] = src[j]
+                    j += 1
+                    total += mid - i
+                k += 1
+            while i < mid:
+                dst[k] = src[i]
+                i += 1
+                k += 1
+            while j < high:
+                dst[k] = src[j]
+                j += 1
+                k += 1
+        (src, dst) = (dst, src)
+        width *= 2
+
+    return total
+
+@_jit
+def count_inversions_rows(seqs):
+    """ Count the inversions of each row of a 2-D array of permutations.
+
+    Args:
+        seqs (ndarray of int): the permutations, one per row.
+
+    Returns:
+        ndarray of int: the number of inversions of each row.
+
+    """
+
+    out = np.zeros(seqs.shape[0], dtype=np.int64)
+    for row in range(seqs.shape[0]):
+        out[row] = count_inversions(seqs[row])
+
+    return out
+
+@_jit
+def pair_slopes(t, t_scale, obs, years, slopes):
+    """ Compute the slopes of all the pairs i<j of data points, and the S statistic.
+
+    Args:
+        t (ndarray of int or float): the observation times, in units of 1/t_scale s.
+        t_scale (float): the number of time units in 1 s. Its type sets the one of the slopes.
+        obs (ndarray of float): the observations, without NaNs.
+        years (ndarray of int): the year of each observation.
+        slopes (ndarray of float): the n(n-1)/2 slopes, in 1/s, filled row by row as
+            mk_kernels._pair_blocks().
+
+    Returns:
+        int: the S statistic.
+
+    """
+
+    n = len(obs)
+    s_tot = 0
+    k = 0
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            diff = obs[j] - obs[i]
+            slopes[k] = diff / ((t[j] - t[i]) / t_scale)
+            s_tot += _sign(diff) * _sign(years[j] - years[i])
+            k += 1
+
+    return s_tot
+
+@_jit
+def _search(edges, slope):
+    """ Bucket of a slope, as numpy.searchsorted(edges, slope, side='right'). """
+
+    (low, high) = (0, len(edges))
+    while low < high:
+        mid = (low + high) // 2
+        if edges[mid] <= slope:
+            low = mid + 1
+        else:
+            high = mid
+
+    return low
+
+@_jit
+def _lookup(edges):
+    """ Build a lookup table of the buckets over a regular grid of slopes.
+
+    Args:
+        edges (ndarray of float): the edges of the buckets, finite, sorted, unique.
+
+    Returns:
+        (ndarray of float, ndarray of float, ndarray of int, float, float): the edges padded with
+        a NaN at the end and at the start, the bucket of each grid point, the first grid point,
+        and the inverse of the grid step.
+
+    """
+
+    nan = np.full(1, np.nan)
+    (upper, lower) = (np.concatenate((edges, nan)), np.concatenate((nan, edges)))
+
+    n_tab = 32 * len(edges)
+    scale = n_tab / (edges[-1] - edges[0]) if len(edges) > 1 else 0.0
+    if not np.isfinite(scale) or scale == 0:
+        (n_tab, scale) = (1, 0.0)
+    low = edges[0] if len(edges) > 0 else 0.0
+    table = np.searchsorted(edges, low + np.arange(n_tab) / max(scale, 1e-300), side='right')
+
+    return (upper, lower, table, low, scale)
+
+@_jit
+def _bucket_pass(t, t_scale, obs, years, edges, counts, needed, vals, bkts):
+    """ Loop over all the pairs i<j of data points, and sort their slopes in buckets.
+
+    The lookup table gives the bucket of the closest grid point below each slope, which is then
+    corrected by (at most) one bucket without branching. The (rare) slopes for which this is not
+    enough fall back to a binary search, so that the buckets are always exact. This is written
+    inline: calling a function with array arguments for each pair is much slower.
+
+    Args:
+        t (ndarray of int or float): the observation times, in units of 1/t_scale s.
+        t_scale (float): the number of time units in 1 s.
+        obs (ndarray of float): the observations, without NaNs.
+        years (ndarray of int): the year of each observation.
+        edges (ndarray of float): the edges of the buckets, finite, sorted, unique. There are
+            2*len(edges)+4 buckets, see mk_kernels._bucket_codes().
+        counts (ndarray of int): the number of slopes in each bucket, incremented in place. Not
+            used if empty.
+        needed (ndarray of bool): whether to collect the slopes of each bucket. Not used if empty.
+        vals (ndarray of float): the collected slopes, filled in place.
+        bkts (ndarray of int): the bucket of each collected slope, filled in place.
+
+    Returns:
+        (int, int): the S statistic, and the number of slopes collected.
+
+    """
+
+    (upper, lower, table, low, scale) = _lookup(edges)
+    (do_count, do_collect) = (len(counts) > 0, len(needed) > 0)
+    n = len(obs)
+    (s_tot, k) = (0, 0)
+
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            diff = obs[j] - obs[i]
+            slope = diff / ((t[j] - t[i]) / t_scale)
+
+            # Same as mk_kernels._bucket_codes()
+            if slope != slope:
+                bkt = 2 * len(edges) + 3
+            elif slope == np.inf:
+                bkt = 2 * len(edges) + 2
+            elif slope == -np.inf:
+                bkt = 0
+            else:
+                # numpy.searchsorted(edges, slope, side='right')
+                pos = (slope - low) * scale
+                if pos < 0:
+                    bkt = 0
+                else:
+                    if not pos <= len(table) - 1:
+                        pos = len(table) - 1
+                    bkt = table[int(pos)]
+                    # The padding NaNs are never <= or > slope
+                    bkt += upper[bkt] <= slope
+                    if (upper[bkt] <= slope) | (lower[bkt] > slope):
+                        bkt = _search(edges, slope)
+                # The slopes equal to an edge get a bucket of their own
+                bkt = 1 + 2 * bkt - (lower[bkt] == slope)
+
+            if do_count:
+                counts[bkt] += 1
+                s_tot += _sign(diff) * _sign(years[j] - years[i])
+            if do_collect and needed[bkt]:
+                vals[k] = slope
+                bkts[k] = bkt
+                k += 1
+
+    return (s_tot, k)
+
+def bucket_counts(t, t_scale, obs, years, edges, counts):
+    """ Count the slopes of all the pairs i<j of data points in buckets, and compute S.
+
+    Args:
+        t (ndarray of int or float): the observation times, in units of 1/t_scale s.
+        t_scale (float): the number of time units in 1 s.
+        obs (ndarray of float): the observations, without NaNs.
+        years (ndarray of int): the year of each observation.
+        edges (ndarray of float): the edges of the buckets, finite, sorted, unique.
+        counts (ndarray of int): the number of slopes in each of the 2*len(edges)+4 buckets (see
+            mk_kernels._bucket_codes()), incremented in place.
+
+    Returns:
+        int: the S statistic.
+
+    """
+
+    return _bucket_pass(t, t_scale, obs, years, edges, counts, np.zeros(0, dtype=np.bool_),
+                        np.zeros(0, dtype=obs.dtype), np.zeros(0, dtype=np.int64))[0]
+
+def bucket_collect(t, t_scale, obs, edges, needed, vals, bkts):
+    """ Collect the slopes of the pairs i<j of data points that fall in some buckets.
+
+    Args:
+        t (ndarray of int or float): the observation times, in units of 1/t_scale s.
+        t_scale (float): the number of time units in 1 s.
+        obs (ndarray of float): the observations, without NaNs.
+        edges (ndarray of float): the edges of the buckets, finite, sorted, unique.
+        needed (ndarray of bool): whether to collect the slopes of each bucket.
+        vals (ndarray of float): the collected slopes, filled in place.
+        bkts (ndarray of int): the bucket of each collected slope, filled in place.
+
+    Returns:
+        int: the number of slopes collected.
+
+    """
+
+    return _bucket_pass(t, t_scale, obs, np.zeros(len(obs), dtype=np.int64), edges,
+                        np.zeros(0, dtype=np.int64), needed, vals, bkts)[1]
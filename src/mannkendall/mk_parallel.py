@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors of the Python version of the code listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains the parallel execution tools for the mannkendall package.
+"""
+
+# Import the required packages
+import os
+import warnings
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _call(func, args_list, kwargs):
+    """ Run func(*args, **kwargs) for a list of arguments, recording the warnings they raise.
+
+    Args:
+        func (callable): the function to run. Must be picklable.
+        args_list (list of tuple): the positional arguments of each call.
+        kwargs (dict): the keyword arguments, shared by all the calls.
+
+    Returns:
+        list of (object, list of (str, type)): the output of each call, and the warnings raised.
+
+    """
+
+    out = []
+    for args in args_list:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            out += [(func(*args, **kwargs), [(str(item.message), item.category)
+                                             for item in caught])]
+
+    return out
+
+def pmap(func, args_list, kwargs=None, max_workers=1, chunksize=1):
+    """ Apply func to a list of arguments, possibly in a pool of processes.
+
+    The outputs are returned in the same order as args_list. The warnings raised in the worker
+    processes are re-emitted in the calling process, in the same order.
+
+    Args:
+        func (callable): the function to run. Must be picklable, i.e. defined at the top level of
+            a module.
+        args_list (iterable of tuple): the positional arguments of each call. An iterator is
+            consumed lazily: with max_workers=1 one call at a time, and otherwise at most
+            2*max_workers*chunksize calls are pending at any time.
+        kwargs (dict, optional): keyword arguments shared by all the calls. Defaults to None.
+        max_workers (int, optional): number of processes. 1 runs everything in the current
+            process, and None uses as many processes as there are CPUs. Defaults to 1.
+        chunksize (int, optional): number of calls sent to a worker at once. Defaults to 1.
+
+    Returns:
+        list: the outputs of func.
+
+    """
+
+    # Some sanity checks
+    if max_workers is not None and (not isinstance(max_workers, int) or max_workers < 1):
+        raise Exception('Ouch ! max_workers should be None or an int >= 1, not: %s' %
+                        (max_workers))
+    if not isinstance(chunksize, int) or chunksize < 1:
+        raise Exception('Ouch ! chunksize should be an int >= 1, not: %s' % (chunksize))
+
+    kwargs = {} if kwargs is None else kwargs
+
+    # No need to spawn processes for this. Consume the arguments one at a time, in case they are
+    # generated on the fly.
+    if max_workers == 1:
+        return [func(*args, **kwargs) for args in args_list]
+
+    args_iter = iter(args_list)
+    head = list(islice(args_iter, 2))
+    if len(head) <= 1:
+        return [func(*args, **kwargs) for args in head]
+
+    # Submit the calls by chunks, keeping only a few chunks in flight
+    args_iter = chain(head, args_iter)
+    max_pending = 2 * ((os.cpu_count() or 1) if max_workers is None else max_workers)
+    (out, pending) = ([], deque())
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            while len(pending) < max_pending:
+                args_chunk = list(islice(args_iter, chunksize))
+                if len(args_chunk) == 0:
+                    break
+                pending.append(pool.submit(_call, func, args_chunk, kwargs))
+            if len(pending) == 0:
+                break
+            for (item, caught) in pending.popleft().result():
+                for (message, category) in caught:
+                    warnings.warn(message, category)
+                out += [item]
+
+    return out
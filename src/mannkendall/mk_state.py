@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors of the Python version of the code listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains the incremental Mann-Kendall statistics of the mannkendall package.
+"""
+
+# Import the required packages
+import numpy as np
+
+# Import from this package
+from . import mk_hardcoded as mkh
+from . import mk_tools as mkt
+from . import mk_stats as mks
+from . import mk_exact as mkx
+
+
+def _moments(counts):
+    """ Compute the sums of c(c-1)(2c+5), c(c-1)(c-2) and c(c-1) entering kendall_var().
+
+    Args:
+        counts (ndarray of int): the group sizes c.
+
+    Returns:
+        ndarray of int: the three sums.
+
+    """
+
+    counts = np.asarray(counts, dtype=np.int64)
+
+    return np.array([np.sum(counts*(counts-1)*(2*counts+5)),
+                     np.sum(counts*(counts-1)*(counts-2)),
+                     np.sum(counts*(counts-1))])
+
+class MKState:
+    """ Mann-Kendall statistics of a time series that grows with time.
+
+    The state keeps the values of the past (closed) years in sorted runs, the values of the
+    current (open) year, the number of valid data per year and the number of data in each tie bin.
+    When a year is closed, its values become a new run, merged with the previous runs that are not
+    larger (as the digits of a binary counter), so that there are at most O(log(n)) runs and each
+    value is merged O(log(n)) times. Appending k points thus costs O(k log(n)^2) operations
+    (amortized). S, its variance, Z and p are available at any time.
+
+    Args:
+        resolution (float): delta value below which two measurements are considered equivalent.
+        obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int, optional): the initial
+            observation times. See mk_tools.dts_to_dt64(). Defaults to None.
+        obs (ndarray of float, optional): the initial observations. Defaults to None.
+
+    Note:
+        The statistics are the ones of compute_mk_stat(), except that the ties are counted in bins
+        of size resolution anchored at the first valid value (see mk_tools.tie_keys()), rather
+        than at the minimum of the data (see mk_tools.nb_tie()). The bins thus never change as
+        data arrive, but the variance can differ slightly from the one of compute_mk_stat().
+
+    """
+
+    def __init__(self, resolution, obs_dts=None, obs=None):
+
+        if not isinstance(resolution, (int, float)):
+            raise Exception('Ouch! resolution should be of type float, not: %s' %
+                            (type(resolution)))
+
+        self._resolution = resolution
+        self._s = 0
+        self._last_dt = None
+        self._runs = []
+        self._open = []
+        self._open_year = None
+        self._years = {}
+        self._n_moments = np.zeros(3, dtype=np.int64)
+        self._t_origin = None
+        self._t_bins = {}
+        self._t_moments = np.zeros(3, dtype=np.int64)
+
+        if obs is not None:
+            self.append(obs_dts, obs)
+
+    @property
+    def n_valid(self):
+        """ int: the number of valid data points. """
+        return sum(len(item) for item in self._runs + self._open)
+
+    @property
+    def s(self):
+        """ int: the S statistic, see mk_stats.s_test(). """
+        return self._s
+
+    @property
+    def n(self):
+        """ ndarray of float: the number of valid data for each year, see mk_stats.s_test(). """
+        if not self._years:
+            return np.array([])
+        years = np.array(sorted(self._years))
+        out = np.zeros(years[-1] - years[0] + 1)
+        out[years - years[0]] = [self._years[item] for item in years]
+        return out
+
+    @property
+    def var(self):
+        """ float: the variance of S, see mk_tools.kendall_var(). """
+
+        l_real = self.n_valid
+        if l_real < 3:
+            return np.nan
+
+        # nb_tie() does not report any tie for 4 data points or less
+        t_moments = self._t_moments if l_real > 4 else np.zeros(3, dtype=np.int64)
+
+        var_s = (l_real*(l_real-1)*(2*l_real+5) - t_moments[0] - self._n_moments[0]) / 18
+        var_s += t_moments[1] * self._n_moments[1] / (9*l_real*(l_real-1)*(l_real-2))
+        var_s += t_moments[2] * self._n_moments[2] / (2*l_real*(l_real-1))
+
+        return float(var_s)
+
+    @property
+    def z(self):
+        """ float: the normal standard variable Z, see mk_stats.std_normal_var(). """
+        return mks.std_normal_var(self._s, self.var)
+
+    @property
+    def p(self):
+        """ float: the probability of the MK test, see compute_mk_stat(). """
+
+        from scipy.stats import norm
+
+        if self.n_valid > mkh.MK_EXACT_MAX_N:
+            return 2 * (1 - norm.cdf(np.abs(self.z), loc=0, scale=1))
+
+        # Small sample: the exact probability only depends on the sizes of the groups of ties
+        vals = np.concatenate(self._runs + self._open)
+        years = np.repeat(list(self._years), list(self._years.values()))
+        p_val = mkx.p_value(self._s, [mkx.tie_groups(vals, years)])
+        if np.isnan(p_val):
+            return 2 * (1 - norm.cdf(np.abs(self.z), loc=0, scale=1))
+
+        return p_val
+
+    def _add_ties(self, vals):
+        """ Add some values to the tie bins.
+
+        Args:
+            vals (ndarray of float): the new values.
+
+        """
+
+        if self._t_origin is None:
+            self._t_origin = vals[0]
+
+        (keys, counts) = np.unique(mkt.tie_keys(vals, self._t_origin, self._resolution),
+                                   return_counts=True)
+        old = np.array([self._t_bins.get(key, 0) for key in keys], dtype=np.int64)
+        self._t_moments += _moments(old + counts) - _moments(old)
+        self._t_bins.update(zip(keys, old + counts))
+
+    def _close_year(self):
+        """ Turn the values of the open year into a sorted run, merged with the smaller runs. """
+
+        if self._open:
+            run = np.sort(np.concatenate(self._open))
+            while self._runs and len(self._runs[-1]) <= len(run):
+                # Two sorted runs: the stable sort merges them in linear time
+                run = np.sort(np.concatenate([self._runs.pop(), run]), kind='stable')
+            self._runs += [run]
+        self._open = []
+
+    def append(self, obs_dts, obs):
+        """ Append new observations to the time series.
+
+        Args:
+            obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int): the observation times.
+                They must be sorted, and not earlier than the ones already appended.
+            obs (ndarray of float): the observations. NaNs are ignored.
+
+        """
+
+        obs_dts = mkt.dts_to_dt64(obs_dts)
+        obs = np.asarray(obs, dtype=float)
+
+        # Some sanity checks first
+        if np.ndim(obs) != 1 or np.shape(obs_dts) != np.shape(obs):
+            raise Exception('Ouch ! obs and obs_dts should be 1-D arrays of the same length !')
+        if len(obs) == 0:
+            return
+        if np.any(np.diff(obs_dts) < np.timedelta64(0)) or \
+           (self._last_dt is not None and obs_dts[0] < self._last_dt):
+            raise Exception('Ouch ! New observations must be sorted and come after the old ones.')
+
+        self._last_dt = obs_dts[-1]
+
+        valid = ~np.isnan(obs)
+        obs = obs[valid]
+        years = mkt.dts_to_years(obs_dts[valid])
+        if len(obs) == 0:
+            return
+
+        # Deal with the data year by year
+        (year_list, year_starts) = np.unique(years, return_index=True)
+        for (year, vals) in zip(year_list, np.split(obs, year_starts[1:])):
+
+            if year != self._open_year:
+                self._close_year()
+                self._open_year = year
+
+            # Sign of the differences with all the data of the past years
+            for run in self._runs:
+                n_less = np.searchsorted(run, vals, side='left')
+                n_more = len(run) - np.searchsorted(run, vals, side='right')
+                self._s += int(np.sum(n_less - n_more))
+
+            # Update the ties in value and in time
+            self._add_ties(vals)
+            old = self._years.get(year, 0)
+            self._n_moments += _moments([old + len(vals)]) - _moments([old])
+            self._years[year] = old + len(vals)
+
+            self._open += [vals]
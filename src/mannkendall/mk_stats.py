@@ -12,13 +12,12 @@ This file contains the core statistical routines for the package.
 """
 
 # Import the required packages
-from datetime import datetime
 import numpy as np
-from scipy.interpolate import interp1d
-from scipy.stats import norm
 
 # Import from this package
+from . import mk_hardcoded as mkh
 from . import mk_tools as mkt
+from . import mk_kernels as mkk
 
 def std_normal_var(s, var_s):
     """ Compute the normal standard variable Z.
@@ -51,7 +50,181 @@ def std_normal_var(s, var_s):
     # Deal with the other cases.
     return (s - np.sign(s))/var_s**0.5
 
-def sen_slope(obs_dts, obs, k_var, alpha_cl=90.):
+def _interp_order_stat(m, stats, n_pairs):
+    """ Linear interpolation between two consecutive order statistics.
+
+    This gives the same result (down to the last bit) as an interpolation over the complete
+    sorted array of slopes with scipy.interpolate.interp1d(), as done in the original code.
+
+    Args:
+        m (float): the (fractional) rank to interpolate at, starting at 0.
+        stats (dict): the order statistics, with their rank as key.
+        n_pairs (int): the total number of slopes.
+
+    Returns:
+        float: the interpolated value.
+
+    """
+
+    if np.isnan(m):
+        return np.nan
+    if m < 0:
+        return stats[0]
+    if m >= n_pairs - 1:
+        return stats[n_pairs-1]
+
+    j = int(np.floor(m))
+
+    return np.interp(m, [j, j+1], [stats[j], stats[j+1]])
+
+def _interp_ranks(m):
+    """ Identify the order statistics required by _interp_order_stat().
+
+    Args:
+        m (float): the (fractional) rank to interpolate at, starting at 0.
+
+    Returns:
+        list of int: the ranks required, that may be out of bounds.
+
+    """
+
+    if np.isnan(m):
+        return []
+    j = int(np.floor(m))
+    return [j, j+1]
+
+def _sen_ranks(n_pairs, k_var, alpha_cl):
+    """ Identify the order statistics of the pairwise slopes required by Sen's slope.
+
+    Args:
+        n_pairs (int): the number of pairwise slopes.
+        k_var (float|None): Kendall variance, computed with Kendall_var. None to only get the ranks
+            of the median.
+        alpha_cl (float): the desired confidence limit, in %.
+
+    Returns:
+        (ndarray of int, float, float): the ranks, and the (fractional) ranks of the lower and upper
+        confidence limits (None if k_var is None).
+
+    """
+
+    # Which order statistics do I need for the median ?
+    if n_pairs % 2 == 1:
+        ranks = [(n_pairs-1)//2]
+    else:
+        ranks = [n_pairs//2-1, n_pairs//2]
+
+    if k_var is None:
+        return (np.unique(np.clip(ranks, 0, n_pairs-1)), None, None)
+
+    # Apply the confidence limits
+    from scipy.stats import norm
+
+    cconf = -norm.ppf((1-alpha_cl/100)/2) * k_var**0.5
+
+    # Note: because python starts at 0 and not 1, we need an additional "-1" to the following
+    # values of m_1 and m_2 to match the matlab implementation.
+    m_1 = (0.5 * (n_pairs - cconf)) - 1
+    m_2 = (0.5 * (n_pairs + cconf)) - 1
+
+    # Which order statistics do I need for the confidence limits ?
+    ranks += [0, n_pairs-1] + _interp_ranks(m_1) + _interp_ranks(m_2)
+
+    return (np.unique(np.clip(ranks, 0, n_pairs-1)), m_1, m_2)
+
+def _sen(t_us, obs, k_var, alpha_cl=90., method='auto', years=None, max_memory=None,
+         dtype='float64'):
+    """ Core of sen_slope() and s_sen_slope(), without any sanity check.
+
+    Args:
+        t_us (ndarray of int): the observation times, in microseconds. Must be 1-D.
+        obs (ndarray of floats): the data array. Must be 1-D, without NaNs.
+        k_var (float|None): Kendall variance, computed with Kendall_var. None to skip the
+            confidence limits.
+        alpha_cl (float, optional): the desired confidence limit, in %. Defaults to 90.
+        method (str, optional): one of ['auto', 'brute', 'select', 'chunked'].
+            Defaults to 'auto'.
+        years (ndarray of int, optional): the year of each observation. If set, the S statistic is
+            computed as well. Defaults to None.
+        max_memory (int, optional): the memory budget of the 'chunked' method, in bytes.
+            Defaults to None.
+        dtype (str, optional): the floating point type of the pairwise slopes.
+            Defaults to 'float64'.
+
+    Return:
+        (int|None, float, float, float): S (None if years is None), Sen's slope, lower confidence
+        limit, upper confidence limit (NaN if k_var is None).
+
+    """
+
+    l = len(obs)
+    n_pairs = l * (l-1) // 2
+
+    # Which method should I use ?
+    if method == 'auto':
+        method = 'chunked'
+        if l > mkh.SEN_SELECT_MIN_N and len(np.unique(t_us)) == l:
+            method = 'select'
+
+    (ranks, m_1, m_2) = _sen_ranks(n_pairs, k_var, alpha_cl)
+
+    if method == 'brute':
+        # Let's compute the slope (and the sign of the differences) for all the possible pairs.
+        (s, vals) = mkk.pairwise_stats(t_us, obs, ranks, years=years, dtype=dtype)
+    elif method == 'chunked':
+        # Stream the slopes, and only keep the ones close to the requested order statistics
+        (s, vals) = mkk.pairwise_stats(t_us, obs, ranks, years=years,
+                                       max_memory=mkh.SEN_CHUNKED_MEMORY if max_memory is None
+                                       else max_memory, dtype=dtype)
+    else:
+        vals = mkk.slope_order_stats(t_us, obs, ranks)
+        s = None if years is None else mkk.s_stat(obs, years)
+    stats = dict(zip(ranks, vals))
+
+    if n_pairs % 2 == 1:
+        slope = stats[(n_pairs-1)//2]
+    else:
+        slope = (stats[n_pairs//2-1]+stats[n_pairs//2])/2
+
+    if k_var is None:
+        return (s, float(slope), np.nan, np.nan)
+
+    # Let's interpolate to get the best possible confidence limits
+    lcl = _interp_order_stat(m_1, stats, n_pairs)
+    ucl = _interp_order_stat(m_2, stats, n_pairs)
+
+    return (s, float(slope), float(lcl), float(ucl))
+
+def _check_sen_args(k_var, alpha_cl, method, max_memory=None, dtype='float64'):
+    """ Sanity checks of the arguments of sen_slope() and s_sen_slope().
+
+    Args:
+        k_var (float|None): Kendall variance, computed with Kendall_var. None if not needed.
+        alpha_cl (float): the desired confidence limit, in %.
+        method (str): the method.
+        max_memory (int, optional): the memory budget, in bytes. Defaults to None.
+        dtype (str, optional): the floating point type of the pairwise slopes.
+            Defaults to 'float64'.
+
+    """
+
+    if not isinstance(alpha_cl, (float, int)):
+        raise Exception('Ouch! confidence should be of type int, not: %s' % (type(alpha_cl)))
+    if alpha_cl > 100 or alpha_cl < 0:
+        raise Exception('Ouch ! confidence must be 0<=alpha_cl<=100, not: %f' % (float(alpha_cl)))
+    if k_var is not None and not isinstance(k_var, (int, float)):
+        raise Exception('Ouch ! The variance must be of type float, not: %s' % (type(k_var)))
+    if method not in mkh.VALID_SEN_METHODS:
+        raise Exception('Ouch ! method must be one of %s, not: %s' % (mkh.VALID_SEN_METHODS,
+                                                                     method))
+    if max_memory is not None and (not isinstance(max_memory, (int, np.integer)) or
+                                   max_memory <= 0):
+        raise Exception('Ouch ! max_memory must be None or an int > 0, not: %s' % (max_memory))
+    if dtype not in mkh.VALID_PAIR_DTYPES:
+        raise Exception('Ouch ! dtype must be one of %s, not: %s' % (mkh.VALID_PAIR_DTYPES, dtype))
+
+def sen_slope(obs_dts, obs, k_var, alpha_cl=90., method='auto', max_memory=None,
+              dtype='float64'):
     """ Compute Sen's slope.
 
     Specifically, this computes the median of the slopes for each interval::
@@ -62,10 +235,30 @@ def sen_slope(obs_dts, obs, k_var, alpha_cl=90.):
     point is small, such as for yearly averages for a 10 year trend.
 
     Args:
-        obs_dts (ndarray of datetime.datetime): an array of observation times. Must be 1-D.
+        obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int, or mk_tools.TimeIndex): an
+            array of observation times. Must be 1-D. int are taken as seconds since 1970-01-01.
         obs (ndarray of floats): the data array. Must be 1-D.
         k_var (float): Kendall variance, computed with Kendall_var.
-        confidence (float, optional): the desired confidence limit, in %. Defaults to 90.
+        alpha_cl (float, optional): the desired confidence limit, in %. Defaults to 90.
+        method (str, optional): one of ['auto', 'brute', 'select', 'chunked'].
+            Defaults to 'auto'.
+
+            - *brute*: all the pairwise slopes are computed (in blocks) and sorted. This requires
+              O(n^2) memory.
+            - *select*: the required slopes are found by slope selection in O(n log(n)^2)
+              operations and O(n log(n)) memory. The observation times must all be different.
+            - *chunked*: the pairwise slopes are streamed in blocks, and counted in buckets. A
+              second pass collects the slopes of the few buckets that contain the required ones.
+              This requires at most max_memory bytes (plus O(n) memory).
+            - *auto*: 'select' if there are more than mk_hardcoded.SEN_SELECT_MIN_N valid data
+              points with distinct times, else 'chunked'. The latter keeps all the slopes in
+              memory, as 'brute', as long as they fit in max_memory.
+        max_memory (int, optional): the memory budget of the 'chunked' method, in bytes.
+            Defaults to None = mk_hardcoded.SEN_CHUNKED_MEMORY.
+        dtype (str, optional): one of mk_hardcoded.VALID_PAIR_DTYPES, the floating point type of
+            the pairwise slopes of the 'brute' and 'chunked' methods. 'float32' halves their memory
+            footprint, at the cost of a small error, see mk_kernels.pairwise_stats().
+            Defaults to 'float64'.
 
     Return:
         (float, float, float): Sen's slope, lower confidence limit, upper confidence limit.
@@ -73,50 +266,123 @@ def sen_slope(obs_dts, obs, k_var, alpha_cl=90.):
     Note:
         The slopes are returned in units of 1/s.
 
+        All the methods return identical results (with dtype='float64').
+
     """
 
     # Start with some sanity checks
-    if not isinstance(alpha_cl, (float, int)):
-        raise Exception('Ouch! confidence should be of type int, not: %s' % (type(alpha_cl)))
-    if alpha_cl > 100 or alpha_cl < 0:
-        raise Exception('Ouch ! confidence must be 0<=alpha_cl<=100, not: %f' % (float(alpha_cl)))
-    if not isinstance(k_var, (int, float)):
-        raise Exception('Ouch ! The variance must be of type float, not: %s' % (type(k_var)))
+    _check_sen_args(k_var, alpha_cl, method, max_memory=max_memory, dtype=dtype)
 
     # Let's only keep the values that are valid
-    obs_dts = obs_dts[~np.isnan(obs)]
+    t_us = mkt.dts_to_us(obs_dts)[~np.isnan(obs)]
     obs = obs[~np.isnan(obs)]
 
-    l = len(obs)
+    return _sen(t_us, obs, k_var, alpha_cl=alpha_cl, method=method, max_memory=max_memory,
+                dtype=dtype)[1:]
 
-    # Let's compute the slope for all the possible pairs.
-    d = np.array([item for i in range(0, l-1)
-                  for item in list((obs[i+1:l] - obs[i])/mkt.dt_to_s(obs_dts[i+1:l] - obs_dts[i]))])
+def median_slope(obs_dts, obs, method='auto', max_memory=None):
+    """ Compute Sen's slope alone, without its confidence limits.
 
-    # Sort now to get the median and also to have
-    # the array sorted for finding lcl, ucl below
-    d.sort()
-    l = len(d)
-    if l % 2 == 1:
-        slope = d[(l-1)//2]
-    else:
-        slope = (d[l//2-1]+d[l//2])/2
+    This is what the iterative prewhitening needs: neither the number of ties nor the Kendall
+    variance are required, and only the median of the pairwise slopes is extracted.
 
-    # Apply the confidence limits
-    cconf = -norm.ppf((1-alpha_cl/100)/2) * k_var**0.5
+    Args:
+        obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int, or mk_tools.TimeIndex): an
+            array of observation times. Must be 1-D. int are taken as seconds since 1970-01-01.
+        obs (ndarray of floats): the data array. Must be 1-D.
+        method (str, optional): one of ['auto', 'brute', 'select', 'chunked']. See sen_slope().
+            Defaults to 'auto'.
+        max_memory (int, optional): the memory budget of the 'chunked' method, in bytes.
+            Defaults to None = mk_hardcoded.SEN_CHUNKED_MEMORY.
 
-    # Note: because python starts at 0 and not 1, we need an additional "-1" to the following
-    # values of m_1 and m_2 to match the matlab implementation.
-    m_1 = (0.5 * (len(d) - cconf)) - 1
-    m_2 = (0.5 * (len(d) + cconf)) - 1
+    Return:
+        float: Sen's slope, in 1/s, identical to the one of sen_slope().
+
+    """
+
+    _check_sen_args(None, 90., method, max_memory=max_memory)
+
+    valid = ~np.isnan(obs)
+
+    return _sen(mkt.dts_to_us(obs_dts)[valid], obs[valid], None, method=method,
+                max_memory=max_memory)[1]
+
+def s_sen_slope(obs_dts, obs, k_var, alpha_cl=90., method='auto', max_memory=None,
+                dtype='float64'):
+    """ Compute the S statistic and Sen's slope together.
+
+    With the 'brute' and 'chunked' methods (and 'auto', unless it picks slope selection), S is
+    computed during the (first) pass over all the pairs of data points that gives the slopes.
+    This gives the same results as s_test() and sen_slope(), that would each go through all the
+    pairs.
+
+    Args:
+        obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int, or mk_tools.TimeIndex): an
+            array of observation times. Must be 1-D. int are taken as seconds since 1970-01-01.
+        obs (ndarray of floats): the data array. Must be 1-D.
+        k_var (float): Kendall variance, computed with Kendall_var. Use year_counts() to get the
+            number of valid data in each year that it requires.
+        alpha_cl (float, optional): the desired confidence limit, in %. Defaults to 90.
+        method (str, optional): one of ['auto', 'brute', 'select', 'chunked']. See sen_slope().
+            Defaults to 'auto'.
+        max_memory (int, optional): the memory budget of the 'chunked' method, in bytes.
+            Defaults to None = mk_hardcoded.SEN_CHUNKED_MEMORY.
+        dtype (str, optional): the floating point type of the pairwise slopes, see sen_slope().
+            S is exact whatever the dtype. Defaults to 'float64'.
+
+    Return:
+        (float, float, float, float): S, Sen's slope, lower confidence limit, upper confidence
+        limit. The slopes are in units of 1/s.
+
+    """
 
-    # Let's setup a quick interpolation scheme to get the best possible confidence limits
-    f = interp1d(np.arange(0, len(d), 1), d, kind='linear',
-                 fill_value=(d[0], d[-1]), assume_sorted=True, bounds_error=False)
-    lcl = f(m_1)
-    ucl = f(m_2)
+    # Start with some sanity checks
+    _check_sen_args(k_var, alpha_cl, method, max_memory=max_memory, dtype=dtype)
 
-    return (float(slope), float(lcl), float(ucl))
+    # Let's only keep the values that are valid
+    obs_dts = mkt.TimeIndex(obs_dts)[~np.isnan(obs)]
+    obs = obs[~np.isnan(obs)]
+
+    (s, slope, lcl, ucl) = _sen(obs_dts.t_us, obs, k_var, alpha_cl=alpha_cl, method=method,
+                                years=obs_dts.years, max_memory=max_memory, dtype=dtype)
+
+    return (np.float64(s), slope, lcl, ucl)
+
+def year_counts(obs, obs_dts):
+    """ Count the valid data in each year.
+
+    Args:
+        obs (ndarray of floats): the observations array. Must be 1-D.
+        obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int, or mk_tools.TimeIndex): a
+            list of observation datetimes. int are taken as seconds since 1970-01-01.
+
+    Returns:
+        ndarray of float: the number of valid data in each year of the time series, see s_test().
+
+    """
+
+    if isinstance(obs_dts, mkt.TimeIndex):
+        return obs_dts.year_counts(obs)
+
+    return _year_counts(obs, mkt.dts_to_years(obs_dts))
+
+def _year_counts(obs, obs_years):
+    """ Count the valid data in each year.
+
+    Args:
+        obs (ndarray of floats): the observations array. Must be 1-D.
+        obs_years (ndarray of int): the year of each observation.
+
+    Returns:
+        ndarray of float: the number of valid data in each year, from the first to the last.
+
+    """
+
+    min_year = np.min(obs_years)
+    max_year = np.max(obs_years)
+
+    return np.bincount(obs_years[~np.isnan(obs)] - min_year,
+                       minlength=max_year - min_year + 1).astype(float)
 
 def s_test(obs, obs_dts):
     """ Compute the S statistics (Si) for the Mann-Kendall test.
@@ -125,7 +391,8 @@ def s_test(obs, obs_dts):
 
     Args:
         obs (ndarray of floats): the observations array. Must be 1-D.
-        obs_dts (ndarray of datetime.datetime): a list of observation datetimes.
+        obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int, or mk_tools.TimeIndex): a
+            list of observation datetimes. int are taken as seconds since 1970-01-01.
 
     Returns:
         (float, ndarray): S, n.
@@ -138,12 +405,12 @@ def s_test(obs, obs_dts):
     if isinstance(obs, list) and np.all([isinstance(item, (float, int)) for item in obs]):
         obs = np.array(obs)
 
-    # Idem for the obs_dts
-    if isinstance(obs_dts, list) and np.all([isinstance(item, datetime) for item in obs_dts]):
-        obs_dts = np.array(obs_dts)
+    # Idem for the obs_dts. This also checks that I was indeed given proper datetimes !
+    if isinstance(obs_dts, (list, np.ndarray, mkt.TimeIndex)):
+        obs_dts = mkt.TimeIndex(obs_dts)
 
     # Some sanity checks first
-    for item in [obs, obs_dts]:
+    for item in [obs, mkt.dts_to_dt64(obs_dts)]:
         if not isinstance(item, np.ndarray):
             raise Exception('Ouch ! I was expecting some numpy.ndarray, not: %s' % (type(item)))
         if np.ndim(item) != 1:
@@ -152,28 +419,5 @@ def s_test(obs, obs_dts):
         if len(item) != len(obs):
             raise Exception('Ouch ! obs and obs_dts should have the same length !')
 
-    # Check that I was indeed given proper datetimes !
-    if np.any([not isinstance(item, datetime) for item in obs_dts]):
-        raise Exception('Ouch ! I need proper datetime.datetime entities !')
-
-    # Find the limiting years
-    obs_years = np.array([item.year for item in obs_dts])
-    min_year = np.min(obs_years)
-    max_year = np.max(obs_years)
-
-    # An array to keep track of the number of valid data points in each season
-    n = np.zeros(max_year - min_year + 1) * np.nan
-    # Create a vector to keep track of the results
-    sij = np.zeros(max_year - min_year + 1) * np.nan
-
-    for (yr_ind, year) in enumerate(range(min_year, max_year+1)):
-        #How valid points do I have :
-        n[yr_ind] = np.count_nonzero(~np.isnan(obs[obs_years == year]))
-
-        # Compute s for that year, by summing the signs for the differences with all the upcoming
-        # years
-        sij[yr_ind] = np.nansum([np.sign(item - obs[obs_years == year])
-                                 for yr2 in range(year+1, max_year+1)
-                                 for item in obs[obs_years == yr2]])
-
-    return (np.nansum(sij), n)
+    # Sum the signs of the differences between each point and all the ones of the upcoming years
+    return (np.float64(mkk.s_stat(obs, obs_dts.years)), obs_dts.year_counts(obs))
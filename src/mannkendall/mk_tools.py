@@ -13,63 +13,222 @@ This file contains useful tools for the package.
 
 # Import the required packages
 import numpy as np
-from scipy import stats as spstats
-
-from statsmodels.tsa import stattools
 
 def de_sort(vals, inds):
     """ De-sort an array of values vals that were sorted according to the indices inds.
 
     Args:
-        vals (ndarray): a 1-D array to de-sort.
+        vals (ndarray): the array to de-sort, along its last axis.
         inds (ndarray of int): the sorting indices.
 
     Returns:
         ndarray: the de-sorted array.
 
-    """
+    Note:
+        De-sorting np.arange(len(inds)) gives the inverse permutation of inds, which can be used
+        to de-sort several arrays with a simple vals[..., inverse] look-up.
 
-    # Create the de-sorted structure
-    out = np.zeros_like(vals)
+    """
 
-    # Loop through every item.
-    for (sorted_ind, unsorted_ind) in enumerate(inds):
-        out[unsorted_ind] = vals[sorted_ind]
+    # Create the de-sorted structure, and scatter the values in it
+    out = np.empty_like(vals)
+    out[..., inds] = vals
 
     return out
 
 
 def dt_to_s(time_deltas):
-    """ A convenience function that converts an array of datetime.timedeltas into an array of
-    floats corresponding to the total_seconds() of each elements.
+    """ A convenience function that converts an array of time deltas into an array of floats
+    corresponding to the total_seconds() of each elements.
 
     Args:
-        time_deltas (ndarray of datetime.timedelta): array of timedeltas.
+        time_deltas (ndarray of datetime.timedelta or numpy.timedelta64): array of timedeltas.
 
     Returns:
         ndaray of flot: the same array with all elements converted to total_seconds().
 
     Note:
-        Adapted from `SO <https://stackoverflow.com/questions/19039080/elegant-way-of-convert-a-numpy-array-containing-datetime-timedelta-into-seconds>`__.
-        Reply by prgao.
+        The conversion goes through integer microseconds, which is the resolution of
+        datetime.timedelta. This gives the same floats as datetime.timedelta.total_seconds(),
+        without calling it for each element.
+
+    """
+
+    return np.asarray(time_deltas).astype('timedelta64[us]').astype(np.int64) / 1e6
+
+def dts_to_dt64(obs_dts):
+    """ Convert observation times into an array of numpy.datetime64 with a microsecond resolution.
+
+    This is meant to be called once, at the entry point of the high-level routines, so that the
+    rest of the code can work with vectorized datetimes.
+
+    Args:
+        obs_dts (list or ndarray): the observation times. Can be datetime.datetime,
+            numpy.datetime64, or int (in which case they are taken as seconds since 1970-01-01).
+
+    Returns:
+        ndarray of numpy.datetime64[us]: the observation times.
+
+    """
+
+    if isinstance(obs_dts, TimeIndex):
+        return obs_dts.dts
+
+    obs_dts = np.asarray(obs_dts)
+
+    if np.issubdtype(obs_dts.dtype, np.integer):
+        obs_dts = obs_dts.astype('datetime64[s]')
+    elif not np.issubdtype(obs_dts.dtype, np.datetime64) and obs_dts.dtype != object:
+        raise Exception('Ouch ! Unsupported type for datetimes: %s' % (obs_dts.dtype))
+
+    try:
+        return obs_dts.astype('datetime64[us]', copy=False)
+    except (TypeError, ValueError) as err:
+        raise Exception('Ouch ! I need proper datetime.datetime entities !') from err
+
+def dts_to_us(obs_dts):
+    """ Convert observation times into the number of microseconds elapsed since the first one.
+
+    Args:
+        obs_dts (list or ndarray): the observation times. See dts_to_dt64() for the supported types.
+
+    Returns:
+        ndarray of int: the elapsed time, in microseconds.
+
+    Note:
+        Microseconds are the resolution of datetime.datetime, and the resulting integers are exact.
+        Dividing their differences by 1e6 gives the same floats as datetime.timedelta.total_seconds.
+
+    """
+
+    if isinstance(obs_dts, TimeIndex):
+        return obs_dts.t_us
+
+    obs_dts = dts_to_dt64(obs_dts)
+
+    if len(obs_dts) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    return (obs_dts - obs_dts[0]).astype(np.int64)
+
+def dts_to_years(obs_dts):
+    """ Extract the years of observation times.
+
+    Args:
+        obs_dts (list or ndarray): the observation times. See dts_to_dt64() for the supported types.
+
+    Returns:
+        ndarray of int: the years.
+
+    """
+
+    if isinstance(obs_dts, TimeIndex):
+        return obs_dts.years
+
+    return dts_to_dt64(obs_dts).astype('datetime64[Y]').astype(np.int64) + 1970
+
+class TimeIndex:
+    """ Time axis of a series, with all the derived quantities needed by the MK statistics.
+
+    Building a TimeIndex once, and passing it instead of the observation times, spares the
+    conversion of the times in each routine (s_test(), sen_slope(), kendall_var(), prewhite(),
+    ...). dts_to_dt64(), dts_to_us() and dts_to_years() return the pre-computed arrays.
+
+    Args:
+        obs_dts (list, ndarray or TimeIndex): the observation times. See dts_to_dt64() for the
+            supported types.
+
+    Attributes:
+        dts (ndarray of numpy.datetime64[us]): the observation times.
+        t_us (ndarray of int): the time elapsed since the first observation, in microseconds.
+        years (ndarray of int): the year of each observation.
+        year_codes (ndarray of int): the year of each observation, counted from the first year.
+        n_years (int): the number of years, from the first to the last one.
+
     """
 
-    f = np.vectorize(lambda x: x.total_seconds())
+    def __init__(self, obs_dts):
+
+        if isinstance(obs_dts, TimeIndex):
+            self.__dict__.update(obs_dts.__dict__)
+            return
+
+        self._set(dts_to_dt64(obs_dts))
+
+    def _set(self, dts, t_us=None, years=None):
+        """ Set the attributes, from the ones already known.
+
+        Args:
+            dts (ndarray of numpy.datetime64[us]): the observation times.
+            t_us (ndarray of int, optional): the elapsed times, if known. Defaults to None.
+            years (ndarray of int, optional): the years, if known. Defaults to None.
+
+        """
+
+        if np.ndim(dts) != 1:
+            raise Exception('Ouch ! The observation times must be 1-D, not: %i-D' % (np.ndim(dts)))
+
+        self.dts = dts
+        if t_us is None:
+            t_us = dts_to_us(dts)
+        elif len(t_us) > 0:
+            t_us = t_us - t_us[0]
+        self.t_us = t_us
+        self.years = dts_to_years(dts) if years is None else years
+        first = np.min(self.years) if len(self.years) > 0 else 0
+        self.year_codes = self.years - first
+        self.n_years = int(np.max(self.year_codes)) + 1 if len(self.years) > 0 else 0
+
+    def __len__(self):
+        return len(self.dts)
+
+    def __getitem__(self, key):
+        """ Select some of the observation times, without any new conversion.
+
+        Args:
+            key (slice, ndarray of bool or int): the observations to keep.
+
+        Returns:
+            TimeIndex: the time index of the selected observations.
+
+        """
+
+        out = TimeIndex.__new__(TimeIndex)
+        out._set(self.dts[key], t_us=self.t_us[key], years=self.years[key])
+        return out
+
+    def year_counts(self, obs):
+        """ Count the valid data in each year.
+
+        Args:
+            obs (ndarray of floats): the observations. Must have the same length as the index.
 
-    return f(time_deltas)
+        Returns:
+            ndarray of float: the number of valid data in each year, from the first to the last.
+
+        """
+
+        return np.bincount(self.year_codes[~np.isnan(obs)],
+                           minlength=self.n_years).astype(float)
 
 def nb_tie(data, resolution):
     """ Compute the number of data point considered to be equivalent (and to be treated as "ties").
 
+    The data are grouped in bins of size resolution, starting at the minimum of the data, with the
+    same edges as numpy.linspace() (see tie_keys()), and the number of data points of each
+    non-empty bin is returned. This costs O(n log(n)) operations and O(n) memory, whatever the
+    range of the data.
+
     Args:
-        data (ndarray of floats): the data array. Must be 1-D.
+        data (ndarray of floats): the data array. Must be 1-D, or 2-D for a batch of series (one
+            per row).
         resolution (float): delta value below which two measurements are considered equivalent.
 
     Return:
-        ndarray of int: amount of ties in the data.
+        ndarray of int: amount of ties in the data, for each non-empty bin, in increasing order of
+        the data. [nan] if there are 4 valid data points or less. For 2-D data, a list with one such
+        array per row.
 
-    Todo:
-        * adjust docstring to better describe the function.
     """
 
     # If the user gave me a list ... be nice and deal with it.
@@ -81,31 +240,91 @@ def nb_tie(data, resolution):
         raise Exception('Ouch! data should be of type ndarray, not: %s' % (type(data)))
     if not isinstance(resolution, (int, float)):
         raise Exception('Ouch! data should be of type float, not: %s' % (type(data)))
+    if np.ndim(data) not in [1, 2]:
+        raise Exception('Ouch! data should be 1-D or 2-D, not: %i-D' % (np.ndim(data)))
+
+    rows = np.atleast_2d(np.asarray(data, dtype=float))
+    valid = ~np.isnan(rows)
+    n_valid = np.count_nonzero(valid, axis=1)
+
+    # Bin all the series at once, each from its own minimum
+    mins = np.min(np.where(valid, rows, np.inf), axis=1)
+    maxs = np.max(np.where(valid, rows, -np.inf), axis=1)
+    with np.errstate(invalid='ignore'):
+        n_bins = np.where(n_valid > 0, (maxs - mins) // resolution + 1, 1)
+    row_ind = np.nonzero(valid)[0]
+    keys = tie_keys(rows[valid], mins[row_ind], resolution, n_bins=n_bins[row_ind])
+
+    # Count the elements of each (row, bin). As numpy.histogram(), ignore the ones outside the bins.
+    order = np.lexsort((keys, row_ind))
+    order = order[keys[order] >= 0]
+    (keys, row_ind) = (keys[order], row_ind[order])
+    new_grp = np.ones(len(keys), dtype=bool)
+    new_grp[1:] = (keys[1:] != keys[:-1]) | (row_ind[1:] != row_ind[:-1])
+    starts = np.flatnonzero(new_grp)
+    counts = np.diff(np.append(starts, len(keys)))
+    groups = np.split(counts, np.searchsorted(row_ind[starts], np.arange(1, len(rows))))
+
+    # If there are less than 4 valid data point (or none), return nan.
+    out = [np.array([np.nan]) if n_valid[ind] <= 4 else item for (ind, item) in enumerate(groups)]
+
+    return out[0] if np.ndim(data) == 1 else out
+
+def tie_keys(data, origin, resolution, n_bins=None):
+    """ Compute the index of the tie bin of each data point.
+
+    Without n_bins, the bins are [origin + k*resolution, origin + (k+1)*resolution[, for any
+    integer k. With n_bins, the edges of the bins are the ones of numpy.linspace(origin,
+    origin + n_bins*resolution, n_bins+1), and the last bin is closed, as in numpy.histogram().
+    The index is estimated from the position of each data point, and then corrected against the
+    edges, computed exactly as numpy.linspace() does. This costs O(n) operations, whatever the
+    number of bins.
+
+    Args:
+        data (ndarray of floats): the data array.
+        origin (float|ndarray of floats): the lower edge of the first bin, for each data point.
+        resolution (float): the size of the bins.
+        n_bins (int|ndarray of int, optional): the number of bins, for each data point. Defaults to
+            None.
+
+    Returns:
+        ndarray of int: the bin index of each data point. With n_bins, -1 for the data outside of
+        the bins.
+
+    """
 
-    # if everything is a nan, return 0.
-    if np.all(np.isnan(data)):
-        return np.array([np.nan])
-    # If there are less than 4 valid data point, return nan.
-    if np.count_nonzero(~np.isnan(data)) <= 4:
-        return np.array([np.nan])
-    # If all the data is the same, just count it.
-    if np.nanmin(data) == np.nanmax(data):
-        return np.array([np.count_nonzero(~np.isnan(data))])
+    data = np.asarray(data, dtype=float)
+    origin = np.asarray(origin, dtype=float)
 
-    # If there's nothing weird with the data, let's compute the bin edges.
-    # Avoid the use of np.arange because of floating point errors, in favor of linspace
-    #bins = np.arange(np.nanmin(data), np.nanmax(data)+resolution, resolution)
-    nbins = int((np.nanmax(data)-np.nanmin(data))//resolution + 1)
-    bins = np.linspace(np.nanmin(data), np.nanmin(data) + nbins * resolution, num=nbins + 1)
-                       #dtype='float128') # Partial fix of #17, but does not work on all machines !
+    if n_bins is None:
+        (step, last, stop) = (resolution, np.inf, np.inf)
+    else:
+        # Same operations as numpy.linspace()
+        last = np.asarray(n_bins, dtype=float) - 1
+        stop = origin + (last + 1) * resolution
+        step = (stop - origin) / (last + 1)
 
-    # A sanity check
-    if len(bins) < 2:
-        raise Exception('Ouch! This error is impossible.')
+    def edge(key):
+        """ The lower edge of some bins. """
+        return np.where(key > last, stop, key * step + origin)
 
-    # Then compute the number of elements in each bin.
-    return np.histogram(data, bins=bins)[0]
+    with np.errstate(invalid='ignore'):
+        keys = np.clip(np.nan_to_num(np.floor((data - origin) / step)), -np.inf, last)
+        if n_bins is not None:
+            keys = np.maximum(keys, 0)
 
+        # The estimate is off by one bin at most, on the edges
+        for _ in range(4):
+            shift = ((data >= edge(keys + 1)) & (keys < last)).astype(int)
+            shift -= (data < edge(keys)) & ((keys > 0) | (n_bins is None))
+            if not np.any(shift):
+                break
+            keys += shift
+
+        if n_bins is not None:
+            keys[~((data >= origin) & (data <= stop))] = -1
+
+    return keys.astype(np.int64)
 
 def kendall_var(data, t, n):
     """ Compute the variance with ties in the data and ties in time.
@@ -113,7 +332,8 @@ def kendall_var(data, t, n):
     Args:
         data (ndarray of floats): the data array. Must be 1-D.
         t (ndarray of int): number of elements in each tie. Must be 1-D.
-        n (ndarray of int): number of non-missing data for each year. Must be 1-D.
+        n (ndarray of int|TimeIndex): number of non-missing data for each year. Must be 1-D. If
+            a TimeIndex of the data is given instead, the numbers are computed from it.
 
     Return:
         float: the variance.
@@ -123,6 +343,9 @@ def kendall_var(data, t, n):
 
     """
 
+    if isinstance(n, TimeIndex):
+        n = n.year_counts(data)
+
     # Some sanity checks first
     for item in [data, t, n]:
         if not isinstance(item, np.ndarray):
@@ -161,23 +384,41 @@ def nanautocorr(obs, nlags, r=0):
 
     """
 
-    # Some sanity checks
+    from scipy import fft as spfft
 
     # First, remove the mean of the data
     obs_corr = obs - np.nanmean(obs)
-    out = []
+    out = np.full(nlags+1, np.nan)
 
-    # Then, loop through the lags, and compute the perason r coefficient.
-    for ind in range(1, nlags+1):
-        obs_1 = obs_corr[ind:]
-        obs_2 = obs_corr[:-ind]
-        msk = ~np.isnan(obs_1) * ~np.isnan(obs_2)
-
-        out += [spstats.pearsonr(obs_1[msk], obs_2[msk])[0]]
+    # The Pearson r coefficient of each lag k is computed from sums over the valid pairs
+    # (obs[i+k], obs[i]). All these sums are cross-correlations of the zero-filled data, its square
+    # and its validity mask, that are computed for all the lags at once by FFT.
+    msk = ~np.isnan(obs_corr)
+    vals = np.where(msk, obs_corr, 0)
+    nfft = spfft.next_fast_len(len(obs) + nlags + 1, real=True)
+    (f_m, f_x, f_xx) = spfft.rfft(np.array([msk, vals, vals**2], dtype=float), n=nfft)
+
+    # c[k] = sum_i a[i+k] b[i] for the positive lags k, and c[-k] = sum_i a[i] b[i+k].
+    corr = spfft.irfft(np.array([f_m * np.conj(f_m), f_x * np.conj(f_m), f_xx * np.conj(f_m),
+                                 f_x * np.conj(f_x)]), n=nfft)
+    lags = np.arange(nlags+1)
+
+    n_k = np.round(corr[0][lags])
+    (s_x, s_y) = (corr[1][lags], corr[1][-lags])
+    (s_xx, s_yy) = (corr[2][lags], corr[2][-lags])
+    s_xy = corr[3][lags]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = s_xy - s_x * s_y / n_k
+        var_x = s_xx - s_x**2 / n_k
+        var_y = s_yy - s_y**2 / n_k
+        # Ignore the (numerically) constant series, like scipy.stats.pearsonr() does.
+        tol = 1e-10 * s_xx[0]
+        ok = (n_k >= 2) & (var_x > tol) & (var_y > tol)
+        out[ok] = np.clip(cov[ok] / np.sqrt(var_x[ok] * var_y[ok]), -1, 1)
 
     # For consistency with matlab, let's also include the full auto-correlation
-    msk = ~np.isnan(obs_corr)
-    out = np.array([spstats.pearsonr(obs_corr[msk], obs_corr[msk])[0]] + out)
+    out[0] = 1.0 if ok[0] else np.nan
 
     # confidence bounds
     b = 1.96 * len(obs)**(-0.5) * np.nansum(out[:r+1]**2)**0.5
@@ -185,18 +426,37 @@ def nanautocorr(obs, nlags, r=0):
     return (out, b)
 
 def levinson(r, n):
-    """ Adapts the levinson() routine from matlab.
+    """ Levinson-Durbin recursion, as the levinson() routine of matlab.
 
-    Basically re-arranges the outputs from statsmodels.tsa.stattools.levinson_durbin() to match
-    the matlab outputs. Includes a sign change and swapping a "1".
+    Solves the Yule-Walker equations of an autoregressive model of order n, given its
+    autocorrelation. Many autocorrelation vectors can be processed at once.
 
     For more info, see `<https://ch.mathworks.com/help/signal/ref/levinson.html?s_tid=srchtitle>`__.
 
-    Todo:
-        * fix this docstring
+    Args:
+        r (ndarray of float): the autocorrelation, from lag 0 to (at least) lag n. Can be N-D,
+            with the lags along the last axis.
+        n (int): the order of the model.
 
-    """
+    Returns:
+        (ndarray, float|ndarray, ndarray): the coefficients a of the model (starting with 1), the
+        prediction error e, and the reflection coefficients k, with the same leading dimensions
+        as r.
 
-    out = stattools.levinson_durbin(r, nlags=n, isacov=True)
+    """
 
-    return (np.array([1] + list(-out[1])), out[0], -out[2][1:])
+    r = np.asarray(r, dtype=float)
+    a = np.zeros(r.shape[:-1] + (n+1,))
+    a[..., 0] = 1
+    k = np.zeros(r.shape[:-1] + (n,))
+    e = r[..., 0].copy()
+
+    for ind in range(1, n+1):
+        # sum_j a[j] r[ind-j], j=0...ind-1
+        acc = r[..., ind] + np.sum(a[..., 1:ind] * r[..., ind-1:0:-1], axis=-1)
+        k[..., ind-1] = -acc / e
+        a[..., 1:ind] = a[..., 1:ind] + k[..., ind-1, None] * a[..., ind-1:0:-1]
+        a[..., ind] = k[..., ind-1]
+        e = e * (1 - k[..., ind-1]**2)
+
+    return (a, e[()], k)
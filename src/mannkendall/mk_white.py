@@ -13,13 +13,189 @@ This file contains the different pre-whiteneing routines for the mannkendall pac
 
 # Import the required packages
 import warnings
-import copy
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
 import numpy as np
-from scipy.stats import norm
 
+from .mk_version import VERSION
 from . import mk_tools as mkt
 from . import mk_stats as mks
 
+#: list: the keys of the prewhite() output
+PW_KEYS = ['pw', 'pw_cor', 'tfpw_y', 'tfpw_ws', 'vctfpw']
+
+class PrewhiteResult(dict):
+    """ The output of prewhite(): a dict of the prewhitened series (see PW_KEYS), with the
+    diagnostics of their computation.
+
+    Args:
+        *args, **kwargs: the items of the dict.
+        diagnostics (dict, optional): the diagnostics. Defaults to None.
+
+    Attributes:
+        diagnostics (dict): the diagnostics of the computation. They can include:
+
+            - 'ak_pw', 'ak_tfpw_y', 'ak_tfpw_ws', 'ak_vctfpw' (float): the first lag
+              autocorrelation used by each prewhitening method.
+            - 'ws_iterations' (int): the number of iterations of the Wang & Swail method.
+            - 'ws_stop' (str): why these iterations stopped: 'not_run' (no significant
+              autocorrelation of the detrended data), 'converged', 'max_iter', or
+              'not_significant' (the autocorrelation lost its significance on the way).
+            - 'ws_delta_ak', 'ws_delta_slope' (float): the change of the autocorrelation and of the
+              slope (in 1/s) over the last iteration.
+            - 'slope_or', 'slope_pw_cor' (float): the Sen's slopes of the original and of the
+              'pw_cor' data, in 1/s.
+
+    """
+
+    def __init__(self, *args, diagnostics=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.diagnostics = {'ws_iterations': 0, 'ws_stop': 'not_run', 'ws_delta_ak': np.nan,
+                            'ws_delta_slope': np.nan}
+        if diagnostics is not None:
+            self.diagnostics.update(diagnostics)
+
+    def aliases(self):
+        """ Find the prewhitened series that are identical, e.g. all of them when the data has no
+        significant autocorrelation. The MK statistics of such series only need to be computed once.
+
+        Returns:
+            dict: for each key, the first key (in the order of PW_KEYS) of an identical series.
+
+        """
+
+        out = {}
+        for key in [item for item in PW_KEYS if item in self]:
+            out[key] = next((item for item in dict.fromkeys(out.values())
+                             if self[item] is self[key] or
+                             np.array_equal(self[item], self[key], equal_nan=True)), key)
+
+        return out
+
+class PrewhiteCache:
+    """ A least-recently-used cache of the prewhite() outputs, with an optional store on disk.
+
+    The outputs are identified by a hash of obs, obs_dts, resolution, alpha_ak and the version of
+    the code. The cache returns copies of the stored arrays, that the caller can modify freely.
+
+    Args:
+        maxsize (int, optional): maximum number of outputs kept in memory. Defaults to 128.
+        path (str|pathlib.Path, optional): folder where to store the outputs as .npz files.
+            Defaults to None (no store on disk).
+
+    Note:
+        With a pool of processes, only the store on disk is shared between the processes.
+
+    """
+
+    def __init__(self, maxsize=128, path=None):
+
+        if not isinstance(maxsize, int) or maxsize < 1:
+            raise Exception('Ouch ! maxsize should be an int >= 1, not: %s' % (maxsize))
+
+        self.maxsize = maxsize
+        self.path = None if path is None else Path(path)
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def key(obs, obs_dts, resolution, alpha_ak):
+        """ Compute the fingerprint of a prewhite() call.
+
+        Args:
+            obs (ndarray of floats): the data array.
+            obs_dts (ndarray of numpy.datetime64): the observation times.
+            resolution (float): the resolution.
+            alpha_ak (float): the confidence level for the first lag autocorrelation.
+
+        Returns:
+            str: the hexadecimal fingerprint.
+
+        """
+
+        fingerprint = hashlib.sha256()
+        fingerprint.update(np.ascontiguousarray(obs, dtype=float).tobytes())
+        fingerprint.update(np.ascontiguousarray(mkt.dts_to_dt64(obs_dts),
+                                                dtype='datetime64[us]').tobytes())
+        fingerprint.update(repr((float(resolution), float(alpha_ak), VERSION)).encode())
+
+        return fingerprint.hexdigest()
+
+    def get(self, key, copy=True):
+        """ Fetch a prewhite() output.
+
+        Args:
+            key (str): the fingerprint of the prewhite() call.
+            copy (bool, optional): if False, return read-only views of the stored arrays instead of
+                copies. Defaults to True.
+
+        Returns:
+            PrewhiteResult|None: the output, or None if it is not in the cache.
+
+        """
+
+        if key in self._data:
+            self._data.move_to_end(key)
+        elif self.path is not None and (self.path / (key + '.npz')).exists():
+            with np.load(self.path / (key + '.npz')) as fid:
+                self._store(key, {item: fid[item] for item in fid.files})
+        else:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return PrewhiteResult({item: self._data[key][item].copy() if copy else
+                               self._data[key][item].view() for item in PW_KEYS},
+                              diagnostics={item[5:]: val.item()
+                                           for (item, val) in self._data[key].items()
+                                           if item.startswith('diag_')})
+
+    def put(self, key, data_pw):
+        """ Store a prewhite() output.
+
+        Args:
+            key (str): the fingerprint of the prewhite() call.
+            data_pw (PrewhiteResult): the output of prewhite().
+
+        """
+
+        # Read-only arrays cannot be modified by the caller: no need to copy those.
+        data = {item: data_pw[item] if not data_pw[item].flags.writeable else
+                np.array(data_pw[item]) for item in PW_KEYS}
+        data.update({'diag_' + item: np.array(val)
+                     for (item, val) in getattr(data_pw, 'diagnostics', {}).items()})
+        self._store(key, data)
+
+        if self.path is not None:
+            # Write to a temporary file first, so that other processes never read half a file.
+            tmp_fn = self.path / ('%s.%i.tmp.npz' % (key, os.getpid()))
+            np.savez(tmp_fn, **self._data[key])
+            os.replace(tmp_fn, self.path / (key + '.npz'))
+
+    def clear(self):
+        """ Empty the cache in memory (but not the store on disk). """
+
+        self._data.clear()
+
+    def _store(self, key, data_pw):
+        """ Store an output in memory, dropping the least recently used one if needed. """
+
+        for item in data_pw.values():
+            item.flags.writeable = False
+        self._data[key] = data_pw
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
 def nanprewhite_arok(obs, alpha_ak=95):
     """ Compute the first lag autocorrelation coefficient to prewhite data as an AR(Kmax) function.
 
@@ -40,6 +216,8 @@ def nanprewhite_arok(obs, alpha_ak=95):
 
     """
 
+    from scipy.stats import norm
+
     # Check the input. I shall be unforgiving.
     if not isinstance(obs, np.ndarray):
         raise Exception('Ouch ! data type should be numpy.ndarray, not: %s' % (type(obs)))
@@ -101,20 +279,135 @@ def nanprewhite_arok(obs, alpha_ak=95):
     return (ak_lag, data_prewhite, ak_ss)
 
 
-def prewhite(obs, obs_dts, resolution, alpha_ak=95):
+def _wang_swail(obs, obs_dts, elapsed_s, alpha_ak, c_1, ak_pw, ss_pw, b0_pw):
+    """ Iterative estimation of the first lag autocorrelation and of the trend of Wang & Swail.
+
+    The iteration works in place in a few buffers allocated once, and only computes the Sen's
+    slope (not its confidence limits) of the prewhitened data at each step.
+
+    Args:
+        obs (ndarray of floats): the data array, without infinites. Must be 1-D.
+        obs_dts (mk_tools.TimeIndex): the observation times.
+        elapsed_s (ndarray of float): the elapsed time since the first observation, in s.
+        alpha_ak (float): statistical significance in % for the first lag autocorrelation.
+        c_1 (float): the first lag autocorrelation of the data.
+        ak_pw (float): the first lag autocorrelation of the detrended PW data.
+        ss_pw (float): the significance of ak_pw.
+        b0_pw (float): the slope of the PW data, in 1/s.
+
+    Returns:
+        (ndarray of float, float, dict): the prewhitened data, the final first lag
+        autocorrelation, and the diagnostics of the iteration (see PrewhiteResult).
+
+    """
+
+    # The buffers: the prewhitened data (the current and the accepted ones), and the detrended data
+    (data_pw, data_new) = (np.empty_like(obs), np.empty_like(obs))
+    detrend = np.empty_like(obs)
+
+    def remove_ar(ak, out):
+        """ Remove the AR(1) component with coefficient ak from the data, in place in out. """
+        out[0] = obs[0]
+        np.multiply(obs[:-1], ak, out=out[1:])
+        np.subtract(obs[1:], out[1:], out=out[1:])
+        out[1:] /= (1-ak)
+
+    remove_ar(ak_pw, data_pw)
+    b1_pw = mks.median_slope(obs_dts, data_pw)
+
+    # Change so that while can be used with the same variable:
+    # ak is new c and c1 is the last c
+    nb_loop = 0
+    stop = 'converged'
+
+    # Remember that b0_pw and b1_pw are in 1/s.
+    while (np.abs(ak_pw-c_1) > 1e-4) & (np.abs(b1_pw-b0_pw) > (1e-4/24/3600)):
+
+        if (ak_pw >= 0.05) & (ss_pw == 95):
+
+            nb_loop += 1
+            # Remove the trend
+            np.multiply(elapsed_s, b1_pw, out=detrend)
+            np.subtract(obs, detrend, out=detrend)
+            (c_1, b0_pw) = (ak_pw, b1_pw)
+            (ak_pw, _, ss_pw) = nanprewhite_arok(detrend, alpha_ak=alpha_ak)
+
+            if (ak_pw > 0) & (ss_pw == 95):
+
+                remove_ar(ak_pw, data_new)
+                b1_pw = mks.median_slope(obs_dts, data_new)
+                (data_pw, data_new) = (data_new, data_pw)
+
+                if nb_loop > 10:
+                    stop = 'max_iter'
+                    break
+            else:
+                # b1_pw == b0_pw now, so that the loop ends with the previous data.
+                stop = 'not_significant'
+        else:
+            stop = 'not_significant'
+            break
+
+    diagnostics = {'ws_iterations': nb_loop, 'ws_stop': stop,
+                   'ws_delta_ak': float(np.abs(ak_pw-c_1)),
+                   'ws_delta_slope': float(np.abs(b1_pw-b0_pw))}
+
+    return (data_pw, ak_pw, diagnostics)
+
+def _hand_out(data_pw, copy):
+    """ Prepare the prewhitened series to be handed out to the caller, in place.
+
+    Args:
+        data_pw (PrewhiteResult): the prewhitened series, possibly sharing their memory.
+        copy (bool): if True, copy the series that share their memory with another one or that are
+            read-only, so that the caller can modify each of them freely. If False, make all the
+            series read-only instead.
+
+    Returns:
+        PrewhiteResult: data_pw.
+
+    """
+
+    if not copy:
+        # Identical series share a single read-only view. Keep the original arrays alive until the
+        # end, so that their id cannot be re-used.
+        views = {}
+        for key in PW_KEYS:
+            if id(data_pw[key]) not in views:
+                views[id(data_pw[key])] = (data_pw[key], data_pw[key].view())
+                views[id(data_pw[key])][1].flags.writeable = False
+            data_pw[key] = views[id(data_pw[key])][1]
+        return data_pw
+
+    handed_out = []
+    for key in PW_KEYS:
+        if (not data_pw[key].flags.writeable or
+                any(np.may_share_memory(data_pw[key], item) for item in handed_out)):
+            data_pw[key] = data_pw[key].copy()
+        handed_out += [data_pw[key]]
+
+    return data_pw
+
+def prewhite(obs, obs_dts, resolution, alpha_ak=95, cache=None, copy=True):
     """ Compute the necessary prewhitened datasets to assess the statistical significance, and to
     compute the Sen slope for each of the prewhitening method, including 3PW.
 
     Args:
         obs (ndarray of floats): the data array. Must be 1-D.
-        obs_dts (ndarray of datetime.datetime): a list of observation datetimes.
+        obs_dts (ndarray of datetime.datetime, numpy.datetime64 or int, or mk_tools.TimeIndex): a
+            list of observation datetimes. int are taken as seconds since 1970-01-01.
         resolution (float): delta value below which two measurements are considered equivalent.
                             It is used to compute the number of ties.
         alpha_ak (float, optional): statistical significance in % for the first lag autocorrelation.
                                     Defaults to 95.
+        cache (PrewhiteCache, optional): if set, re-use the outputs of previous identical calls.
+            Defaults to None.
+        copy (bool, optional): if False, return read-only arrays, that share their memory whenever
+            the prewhitened series are identical (e.g. all of them without significant
+            autocorrelation) or come from the cache. Defaults to True.
 
     Returns:
-        (dict): data_pw, that contains 5 PW timeseries:
+        (PrewhiteResult): data_pw, a dict that contains 5 PW timeseries:
                 * 'pw': PW with the first lag autocorrelation of the data
                 * 'pw_cor': PW corrected with 1/(1-ak1)
                 * 'tfpw_ws': PW with the first lag autocorrelation of the data after detrending
@@ -124,6 +417,11 @@ def prewhite(obs, obs_dts, resolution, alpha_ak=95):
                 * 'vctfpw': PW with the first lag autocorrelation of the data after detrending +
                             correction of the PW data for the variance (see Wang 2015)
 
+        The diagnostics of the computation are in data_pw.diagnostics, see PrewhiteResult.
+
+    Note:
+        obs is not modified: its infinites are replaced by NaNs in a copy.
+
     Todo:
         * fix this docstring
 
@@ -137,116 +435,81 @@ def prewhite(obs, obs_dts, resolution, alpha_ak=95):
                         (alpha_ak))
 
     # Create some storage dictionnaries
-    data_pw = {}
+    data_pw = PrewhiteResult()
     c_dict = {}
 
-    # Deal with infinites if there are any
-    obs[np.isinf(obs)] = np.nan
+    # Prepare the time axis once and for all, and get the elapsed time in s.
+    obs_dts = mkt.TimeIndex(obs_dts)
+    elapsed_s = obs_dts.t_us / 1e6
+
+    # Deal with infinites if there are any. This is the only copy of obs that is ever made.
+    obs = np.where(np.isinf(obs), np.nan, obs)
+
+    # Have I done this before ?
+    if cache is not None:
+        cache_key = cache.key(obs, obs_dts, resolution, alpha_ak)
+        data_pw = cache.get(cache_key, copy=copy)
+        if data_pw is None:
+            data_pw = prewhite(obs, obs_dts, resolution, alpha_ak=alpha_ak, copy=False)
+            cache.put(cache_key, data_pw)
+            data_pw = _hand_out(data_pw, copy)
+        return data_pw
 
     # Compute the autocorrelation
     (c_dict['pw'], data_ar_removed, c_dict['ss']) = nanprewhite_arok(obs, alpha_ak=alpha_ak)
+    data_pw.diagnostics['ak_pw'] = float(c_dict['pw'])
 
     # no statistically significant correlation ? Then get out now.
     if not((np.count_nonzero(~np.isnan(data_ar_removed)) > 0) & (c_dict['ss'] == alpha_ak) &
            (c_dict['pw'] >= 0.05)):
 
-        data_pw['pw'] = copy.copy(obs)
-        data_pw['pw_cor'] = copy.copy(obs)
-        data_pw['tfpw_y'] = copy.copy(obs)
-        data_pw['tfpw_ws'] = copy.copy(obs)
-        data_pw['vctfpw'] = copy.copy(obs)
+        for key in PW_KEYS:
+            data_pw[key] = obs
 
-        return data_pw
+        return _hand_out(data_pw, copy)
 
     # Else, compute the obs PW corrected
-    data_pw['pw'] = copy.copy(data_ar_removed)
+    data_pw['pw'] = data_ar_removed
     data_pw['pw_cor'] = data_ar_removed/(1-c_dict['pw'])
 
     # data VCTFPW corrected
-    # compute the trend slope of the PW data
-    t = mkt.nb_tie(data_pw['pw_cor'], resolution)
-    (_, n) = mks.s_test(data_pw['pw_cor'], obs_dts)
-    vari = mkt.kendall_var(obs, t, n)
-    (b0_pw, _, _) = mks.sen_slope(obs_dts, data_pw['pw_cor'], vari) # slope of the original data
-
-    t = mkt.nb_tie(obs, resolution)
-    (_, n) = mks.s_test(obs, obs_dts)
-    vari = mkt.kendall_var(obs, t, n)
-    (b0_or, _, _) = mks.sen_slope(obs_dts, obs, vari)
+    # compute the trend slope of the PW data, and of the original data. Only the slopes are needed,
+    # not their confidence limits.
+    b0_pw = mks.median_slope(obs_dts, data_pw['pw_cor'])
+    b0_or = mks.median_slope(obs_dts, obs)
+    data_pw.diagnostics.update({'slope_or': b0_or, 'slope_pw_cor': b0_pw})
 
     # Remove the trend
-    data_detrend_pw = obs - b0_pw * mkt.dt_to_s(obs_dts-obs_dts[0])
-    data_detrend_or = obs - b0_or * mkt.dt_to_s(obs_dts-obs_dts[0])
+    data_detrend_pw = obs - b0_pw * elapsed_s
+    data_detrend_or = obs - b0_or * elapsed_s
 
     # Compute the autocorrelation of the detrended time series
     (c_dict['vctfpw'], data_ar_removed_or, c_dict['ss_vc']) = \
                                         nanprewhite_arok(data_detrend_or, alpha_ak=alpha_ak)
-    c_dict['tfpw_y'] = copy.copy(c_dict['vctfpw'])
+    c_dict['tfpw_y'] = c_dict['vctfpw']
     (ak_pw, data_ar_removed_pw, ss_pw) = nanprewhite_arok(data_detrend_pw, alpha_ak=alpha_ak)
 
     # Compute TFPW correction following Yue et al., 2002
     # blended data
     if np.count_nonzero(~np.isnan(data_ar_removed_or)) > 0:
-        data_pw['tfpw_y'] = data_ar_removed_or + b0_or * mkt.dt_to_s(obs_dts - obs_dts[0])
+        data_pw['tfpw_y'] = data_ar_removed_or + b0_or * elapsed_s
     else:
-        data_pw['tfpw_y'] = copy.copy(obs)
+        data_pw['tfpw_y'] = obs
 
     # Compute the TFPW correction of Wang and Sail
     if (np.abs(ak_pw) >= 0.05) & (ss_pw == 95):
-        # Change so that while can be used with the same variable:
-        # ak is new c and c1 is the last c
-        c_1 = copy.copy(c_dict['pw'])
-
-        data_ar_removed_pw = copy.copy(obs)
-        data_ar_removed_pw[1:] -= ak_pw * obs[:-1]
-        data_ar_removed_pw[1:] /= (1-ak_pw)
-
-        t = mkt.nb_tie(data_ar_removed_pw, resolution)
-        (_, n) = mks.s_test(data_ar_removed_pw, obs_dts)
-        vari = mkt.kendall_var(data_ar_removed_pw, t, n)
-        (b1_pw, _, _) = mks.sen_slope(obs_dts, data_ar_removed_pw, vari)
-
-        # Remove the trend
-        nb_loop = 0
-
-        # Remember that b0_pw and b1_pw are in 1/s.
-        while (np.abs(ak_pw-c_1) > 1e-4) & (np.abs(b1_pw-b0_pw) > (1e-4/24/3600)):
-
-            if (ak_pw >= 0.05) & (ss_pw == 95):
-
-                nb_loop += 1
-                data_detrend_pw = obs - b1_pw * mkt.dt_to_s(obs_dts-obs_dts[0])
-                c_1 = copy.copy(ak_pw)
-                b0_pw = copy.copy(b1_pw)
-                (ak_pw, data_ar_removed2_pw, ss_pw) = \
-                                            nanprewhite_arok(data_detrend_pw, alpha_ak=alpha_ak)
-
-                if (ak_pw > 0) & (ss_pw == 95):
-
-                    data_ar_removed2_pw = copy.copy(obs)
-                    data_ar_removed2_pw[1:] -= ak_pw * obs[:-1]
-                    data_ar_removed2_pw[1:] /= (1-ak_pw)
-
-                    t = mkt.nb_tie(data_ar_removed2_pw, resolution)
-                    (_, n) = mks.s_test(data_ar_removed2_pw, obs_dts)
-                    vari = mkt.kendall_var(data_ar_removed2_pw, t, n)
-                    (b1_pw, _, _) = mks.sen_slope(obs_dts, data_ar_removed2_pw, vari)
-                    data_ar_removed_pw = copy.copy(data_ar_removed2_pw)
-
-                    if nb_loop > 10:
-                        break
-            else:
-                break
+        (data_ar_removed_pw, ak_pw, ws_diags) = _wang_swail(obs, obs_dts, elapsed_s, alpha_ak,
+                                                            c_dict['pw'], ak_pw, ss_pw, b0_pw)
+        data_pw.diagnostics.update(ws_diags)
     else:
-        b1_pw = copy.copy(b0_pw)
-        ak_pw = copy.copy(c_dict['pw'])
+        ak_pw = c_dict['pw']
 
     # blended data
     if np.count_nonzero(~np.isnan(data_ar_removed_pw)) > 0:
-        data_pw['tfpw_ws'] = copy.copy(data_ar_removed_pw)
-        c_dict['tfpw_ws'] = copy.copy(ak_pw)
+        data_pw['tfpw_ws'] = data_ar_removed_pw
+        c_dict['tfpw_ws'] = ak_pw
     else:
-        data_pw['tfpw_ws'] = copy.copy(obs)
+        data_pw['tfpw_ws'] = obs
         # Note:
         # not setting c['tfpw_ws'] here will create a case-dependant mismatch in the output
 
@@ -261,9 +524,12 @@ def prewhite(obs, obs_dts, resolution, alpha_ak=95):
     if c_dict['vctfpw'] >= 0:
         b_vc = b0_or / np.sqrt((1+c_dict['vctfpw'])/(1-c_dict['vctfpw']))
     else:
-        b_vc = copy.copy(b0_or)
+        b_vc = b0_or
 
     # Add the trend again
-    data_pw['vctfpw'] = data_ar_removed_var + b_vc * mkt.dt_to_s(obs_dts-obs_dts[0])
+    data_pw['vctfpw'] = data_ar_removed_var + b_vc * elapsed_s
 
-    return data_pw
+    data_pw.diagnostics.update({'ak_%s' % (key): float(c_dict[key])
+                                for key in ['tfpw_y', 'tfpw_ws', 'vctfpw'] if key in c_dict})
+
+    return _hand_out(data_pw, copy)
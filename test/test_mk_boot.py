@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains test functions for the mk_boot module.
+"""
+
+# Import from other Python packages
+import numpy as np
+import pytest
+from scipy.signal import lfilter
+
+# Import from current package
+from mannkendall import mk_boot as mkb
+from mannkendall import mk_hardcoded as mkh
+from mannkendall import mk_main as mkm
+from mannkendall import mk_stats as mks
+
+def test_block_index():
+    """ Test the resampling indices.
+
+    This method specifically tests:
+        - the permutations keep every data point once, in blocks of consecutive points
+        - the bootstrap draws blocks of consecutive points
+    """
+
+    rng = np.random.default_rng(42)
+
+    idx = mkb._block_index(rng, 10, 50, 3, replace=False)
+    assert np.all(np.sort(idx, axis=1) == np.arange(10))
+    # The point after 0, 3 and 6 in a resample is always the next one
+    for start in [0, 3, 6]:
+        (rows, cols) = np.nonzero(idx[:, :-1] == start)
+        assert np.all(idx[rows, cols + 1] == start + 1)
+
+    idx = mkb._block_index(rng, 10, 50, 4, replace=True)
+    assert idx.shape == (50, 10)
+    assert np.all(np.diff(idx.reshape(50, -1)[:, :4], axis=1) == 1)
+    assert np.all((idx >= 0) & (idx < 10))
+
+def test_boot():
+    """ Test the block permutation test and block bootstrap.
+
+    This method specifically tests:
+        - reproducible results with a given seed
+        - early stopping when the trend is obvious
+        - no false positive for strongly autocorrelated data, where the analytic test fails
+        - the confidence limits bracket the Sen's slope
+        - sig_method in compute_mk_stat() and mk_temp_aggr()
+    """
+
+    n = 200
+    obs_dts = np.datetime64('1990-01-15') + np.arange(n) * np.timedelta64(30, 'D')
+    rng = np.random.default_rng(4)
+    noise = lfilter([1], [1, -0.8], rng.normal(size=n))
+
+    # Strong trend: the test stops after the first batch
+    obs = np.arange(n) * 0.1 + noise
+    (s, _) = mks.s_test(obs, obs_dts)
+    (p_val, n_used) = mkb.perm_p(s, [obs], [obs_dts], batch=100, seed=1)
+    assert n_used == 100
+    assert p_val == 1 / 101
+    assert mkb.perm_p(s, [obs], [obs_dts], batch=100, seed=1) == (p_val, n_used)
+
+    # Autocorrelated noise only
+    (result, s, _, _) = mkm.compute_mk_stat(obs_dts, noise, 0.01)
+    assert result['ss'] == 95
+    (result, _, _, _) = mkm.compute_mk_stat(obs_dts, noise, 0.01, sig_method='boot',
+                                            boot_kwargs={'n_boot': 500, 'seed': 0})
+    assert result['ss'] == 0
+    assert result['lcl'] <= result['slope'] <= result['ucl']
+    assert mkm.compute_mk_stat(obs_dts, noise, 0.01, sig_method='boot',
+                               boot_kwargs={'n_boot': 500, 'seed': 0})[0] == result
+
+    # Seasonal test: the seasons are permuted together for the total
+    seasons = np.arange(n) % 4
+    out = mkm.mk_temp_aggr([obs_dts[seasons == ind] for ind in range(4)],
+                           [noise[seasons == ind] for ind in range(4)], 0.01, pw_method='pw',
+                           sig_method='boot', boot_kwargs={'n_boot': 200})
+    assert np.all([0 < out[ind]['p'] <= 1 for ind in range(5)])
+
+    with pytest.raises(Exception):
+        mkm.compute_mk_stat(obs_dts, noise, 0.01, sig_method='bootstrap')
+    with pytest.raises(Exception):
+        mkb.perm_p(s, [obs], [obs_dts], block_len=0)
+
+def test_boot_sen_cl(monkeypatch):
+    """ Test the block bootstrap of the Sen's slope.
+
+    This method specifically tests:
+        - early stopping, and all the resamples with BOOT_CL_TOL = 0
+        - the long series kernels (slope selection, chunked) give the same slopes as short ones
+    """
+
+    n = 200
+    obs_dts = np.datetime64('1990-01-15') + np.arange(n) * np.timedelta64(30, 'D')
+    noise = lfilter([1], [1, -0.8], np.random.default_rng(4).normal(size=n))
+
+    n_rows = []
+    sen_rows = mkb._sen_rows # pylint: disable=protected-access
+    monkeypatch.setattr(mkb, '_sen_rows', lambda t_us, obs: n_rows.append(len(obs)) or
+                        sen_rows(t_us, obs))
+
+    (lcl, ucl) = mkb.boot_sen_cl(obs_dts, noise, 1e-9)
+    assert lcl < ucl
+    assert 200 <= np.sum(n_rows) < mkh.BOOT_N
+    n_rows.clear()
+    monkeypatch.setattr(mkh, 'BOOT_CL_TOL', 0)
+    mkb.boot_sen_cl(obs_dts, noise, 1e-9)
+    assert np.sum(n_rows) == mkh.BOOT_N
+
+    # No residuals: all the slopes are equal, and one batch is enough
+    n_rows.clear()
+    assert mkb.boot_sen_cl(obs_dts, np.zeros(n), 0) == (0, 0)
+    assert np.sum(n_rows) == mkh.BOOT_BATCH
+
+    # Force the long series kernels, with unique and duplicated times
+    t_us = (obs_dts - obs_dts[0]).astype('timedelta64[us]').astype(np.int64)
+    rng = np.random.default_rng(0)
+    rows = noise[mkb._block_index(rng, n, 5, 7, True)] # pylint: disable=protected-access
+    ref = sen_rows(t_us, rows)
+    monkeypatch.setattr(mkh, 'PAIRWISE_BLOCK', 100)
+    monkeypatch.setattr(mkh, 'SEN_SELECT_MIN_N', 10)
+    monkeypatch.setattr(mkh, 'SEN_CHUNKED_MEMORY', 2**14)
+    assert np.array_equal(sen_rows(t_us, rows), ref)
+    t_us[1] = t_us[0]
+    (p_i, p_j) = np.triu_indices(n, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ref = np.median((rows[:, p_j] - rows[:, p_i]) / ((t_us[p_j] - t_us[p_i]) / 1e6), axis=1)
+    assert np.array_equal(sen_rows(t_us, rows), ref)
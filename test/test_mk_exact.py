@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains test functions for the mk_exact module.
+"""
+
+# Import from other Python packages
+from itertools import permutations
+import numpy as np
+
+# Import from current package
+from mannkendall import mk_exact as mkx
+from mannkendall import mk_main as mkm
+
+def test_p_value():
+    """ Test the exact probability of the MK test.
+
+    This method specifically tests:
+        - agreement with the hardcoded table (to its precision)
+        - agreement with the enumeration of all permutations, with ties in value or time
+        - sum of independent series
+    """
+
+    # Some values of the table of P(S >= s) used by the earlier releases (and the matlab code).
+    # The table is one-sided, and rounded to 2 or 3 significant digits.
+    table = {4: {2: 0.375, 6: 0.042}, 5: {4: 0.242, 10: 0.0083}, 6: {5: 0.235, 15: 0.0014},
+             7: {9: 0.119, 19: 0.0014}, 8: {14: 0.054, 28: 2.5e-05}, 9: {16: 0.06, 36: 2.8e-06},
+             10: {19: 0.054, 45: 2.8e-07}}
+    for (n, item) in table.items():
+        for (s, ref) in item.items():
+            prob = mkx.p_value(s, [(1,) * n]) / 2
+            assert np.abs(prob - ref) < 10**(np.floor(np.log10(ref)) - 1)
+
+    def s_stat(obs, years):
+        return sum(np.sign(obs[j]-obs[i]) * np.sign(years[j]-years[i])
+                   for i in range(len(obs)) for j in range(i+1, len(obs)))
+
+    for (obs, years) in [(np.array([1., 2, 2, 3, 5, 5]), np.arange(6)),
+                         (np.array([4., 1, 3, 2, 6, 5]), np.array([0, 0, 1, 2, 2, 2])),
+                         (np.array([4., 1, np.nan, 2, 6, 5]), np.array([0, 0, 1, 2, 2, 2]))]:
+        valid = ~np.isnan(obs)
+        groups = mkx.tie_groups(obs, years)
+        ref = np.array([s_stat(obs[valid][list(perm)], years[valid])
+                        for perm in permutations(range(np.sum(valid)))])
+        for s in np.unique(ref):
+            assert np.round(mkx.p_value(s, [groups]) - min(1, 2 * np.mean(ref >= abs(s))),
+                            12) == 0
+
+    # Ties both in value and in time: no exact distribution
+    assert mkx.tie_groups(np.array([1., 1, 2]), np.array([0, 0, 1])) is None
+    assert np.isnan(mkx.p_value(1, [None]))
+
+    # Two series of 3 points: S ranges from -6 to 6 with 36 equally likely outcomes
+    assert mkx.p_value(6, [(1, 1, 1), (1, 1, 1)]) == 2 / 36
+    assert mkx.p_value(0, [(1, 1, 1), (1, 1, 1)]) == 1
+    assert mkx.p_value(7, [(1, 1, 1), (1, 1, 1)]) == 0
+
+def test_compute_mk_stat_small():
+    """ Test compute_mk_stat() for small samples.
+
+    This method specifically tests:
+        - exact (two-sided) p-value for up to MK_EXACT_MAX_N valid data points, including with
+          NaNs
+    """
+
+    obs_dts = np.datetime64('2000-07-01') + np.arange(8) * np.timedelta64(365, 'D')
+    obs = np.array([1., 2, np.nan, 3, 5, 4, 6, 7])
+
+    (result, s, _, _) = mkm.compute_mk_stat(obs_dts, obs, 0.1)
+
+    assert s == 19
+    assert result['p'] == mkx.p_value(19, [(1,) * 7])
+    # The probability is two-sided: 7 of the 7! permutations have S >= 19, and as many S <= -19.
+    # The earlier releases meant to return the one-sided value of the table instead (0.0014).
+    assert np.round(result['p'], 12) == np.round(2 * 7 / 5040, 12)
+    assert result['ss'] == 95
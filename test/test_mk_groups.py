@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains tests functions for the mk_groups module.
+"""
+
+# Import from Python packages
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+
+# Import from current package
+import mannkendall as mk
+from mannkendall import mk_groups as mkg
+from .test_hardcoded import load_test_data
+
+def load_tas(test_id):
+    """ Load the temporal aggregations of a MK_tempAggr test data set.
+
+    Args:
+        test_id (int): the test data set.
+
+    Returns:
+        (list of ndarray, list of ndarray): the observation times and the observations.
+
+    """
+
+    test_in = load_test_data('MK_tempAggr_test%i_in.csv' % (test_id))
+    n_tas = np.shape(test_in)[1] // 7
+
+    test_in_dts = [np.array([datetime(*[int(val) for val in item[:6]])
+                             for item in test_in[:, tas_ind:tas_ind+7]
+                             if not np.isnan(item[0])])
+                   for tas_ind in range(0, n_tas*7, 7)]
+    test_in_obs = [np.array([item[6] for item in test_in[:, tas_ind:tas_ind+7]
+                             if not np.isnan(item[0])])
+                   for tas_ind in range(0, n_tas*7, 7)]
+
+    return (test_in_dts, test_in_obs)
+
+def test_group_codes():
+    """ Test the group_codes() function.
+
+    This method specifically tests:
+        - the codes of all the groupings, against the datetime module
+        - unknown groupings
+    """
+
+    dts = [datetime(1999, 12, 25, 5) + timedelta(hours=37*ind) for ind in range(500)]
+    dt64 = np.array(dts, dtype='datetime64[us]')
+
+    assert np.array_equal(mkg.group_codes(dt64, 'month'), [item.month for item in dts])
+    assert np.array_equal(mkg.group_codes(dt64, 'season'),
+                          [(item.month % 12) // 3 for item in dts])
+    assert np.array_equal(mkg.group_codes(dt64, 'dayofweek'), [item.weekday() for item in dts])
+    assert np.array_equal(mkg.group_codes(dt64, 'hour'), [item.hour for item in dts])
+
+    with pytest.raises(Exception):
+        mkg.group_codes(dt64, 'week')
+
+def test_grouping():
+    """ Test the Grouping class.
+
+    This method specifically tests:
+        - the labels, and the indices of each group
+        - unsorted observation times, and custom labels
+    """
+
+    dts = np.datetime64('2000-01-01') + np.arange(0, 400, 10).astype('timedelta64[D]')
+    obs = np.arange(len(dts), dtype=float)
+
+    groups = mkg.Grouping(dts, 'season')
+    assert groups.sort_ind is None
+    assert list(groups.labels) == mkg.SEASONS
+    assert np.array_equal(np.sort(np.concatenate(list(groups))), np.arange(len(dts)))
+    for (ind, item) in enumerate(groups.split(obs)):
+        assert np.all(mkg.group_codes(dts[item.astype(int)], 'season') == ind)
+        assert np.all(np.diff(item) > 0)
+    assert np.shares_memory(groups[0], groups.order)
+
+    # Shuffled input, with custom labels
+    perm = np.random.default_rng(1).permutation(len(dts))
+    labels = np.where(obs < 20, 'early', 'late')
+    groups = mkg.Grouping(dts[perm], labels[perm])
+    assert groups.by is None
+    assert list(groups.labels) == ['early', 'late']
+    assert np.array_equal(groups.sort(obs[perm]), obs)
+    (early, late) = groups.split(obs[perm])
+    assert np.array_equal(early, obs[:20])
+    assert np.array_equal(late, obs[20:])
+    assert np.array_equal(groups.split_dts()[1].dts, dts[20:])
+
+    with pytest.raises(Exception):
+        mkg.Grouping(dts, labels[:-1])
+    with pytest.raises(IndexError):
+        groups[2]
+
+@pytest.mark.parametrize('test_id, by', [(2, 'season'), (3, 'month')])
+def test_mk_temp_aggr_groups(test_id, by):
+    """ Test the groups argument of mk_temp_aggr() and mk_temp_aggr_batch().
+
+    This method specifically tests:
+        - same results as with the list of temporal aggregations
+        - shuffled input, and masks in the batch
+    """
+
+    (test_in_dts, test_in_obs) = load_tas(test_id)
+    ref = mk.mk_temp_aggr(test_in_dts, test_in_obs, 0.01)
+
+    perm = np.random.default_rng(2).permutation(np.sum([len(item) for item in test_in_dts]))
+    dts = np.concatenate(test_in_dts)[perm]
+    obs = np.concatenate(test_in_obs)[perm]
+
+    out = mk.mk_temp_aggr(dts, obs, 0.01, groups=by)
+    assert len(out) == len(ref)
+    for ta_ind in ref:
+        for item in ['p', 'ss', 'slope', 'ucl', 'lcl']:
+            assert np.array_equal(out[ta_ind][item], ref[ta_ind][item], equal_nan=True)
+
+    with pytest.raises(Exception):
+        mk.mk_temp_aggr(dts, [obs], 0.01, groups=by)
+
+    # The batch, with a masked series
+    masks = np.zeros((2, len(obs)), dtype=bool)
+    masks[1, ::3] = True
+    out = mk.mk_temp_aggr_batch(dts, np.array([obs, obs]), 0.01, masks=masks,
+                                groups=mkg.Grouping(dts, by))
+    ref_masked = mk.mk_temp_aggr(dts, np.where(masks[1], np.nan, obs), 0.01, groups=by)
+    for ta_ind in ref:
+        for item in out.dtype.names:
+            assert np.array_equal(out[0, ta_ind][item], ref[ta_ind][item], equal_nan=True)
+            assert np.array_equal(out[1, ta_ind][item], ref_masked[ta_ind][item], equal_nan=True)
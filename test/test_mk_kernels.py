@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains test functions for the mk_kernels module.
+"""
+
+# Import from python packages
+import tracemalloc
+import numpy as np
+import pytest
+
+# Import from current package
+from mannkendall import mk_hardcoded as mkh
+from mannkendall import mk_kernels as mkk
+
+def test_count_inversions():
+    """ Test the count_inversions() function.
+
+    This method specifically tests:
+        - the number of inversions matches a brute force count.
+        - the pairs located by inversion_ranges() are the inversions.
+    """
+
+    rng = np.random.default_rng(42)
+
+    for n in [1, 2, 7, 64, 257]:
+        seq = rng.permutation(n)
+        (i, j) = np.triu_indices(n, k=1)
+        assert mkk.count_inversions(seq) == np.count_nonzero(seq[i] > seq[j])
+
+    (_, levels) = mkk.inversion_ranges(seq)
+    (left, right) = mkk._expand_pairs(levels) # pylint: disable=protected-access
+    assert np.all(left < right)
+    assert np.all(seq[left] > seq[right])
+
+def test_slope_order_stats(monkeypatch):
+    """ Test the slope_order_stats() function.
+
+    This method specifically tests:
+        - the order statistics are identical to the ones of the sorted array of slopes.
+        - duplicated times are refused.
+    """
+
+    # Force the narrowing of the slope windows, even for small arrays
+    monkeypatch.setattr(mkh, 'SEN_SELECT_CAP', 50)
+    monkeypatch.setattr(mkh, 'SEN_SELECT_SAMPLE', 64)
+
+    rng = np.random.default_rng(42)
+    n = 400
+    t_us = np.cumsum(rng.integers(1, 5, size=n)) * 3600 * 10**6
+
+    # Test with and without ties in the data
+    for obs in [rng.normal(size=n), np.round(rng.normal(size=n) + np.arange(n)/200, 1)]:
+        (i, j) = np.triu_indices(n, k=1)
+        slopes = np.sort((obs[j]-obs[i])/((t_us[j]-t_us[i])/1e6))
+        ranks = np.array([0, 1, 500, len(slopes)//2, len(slopes)//2 + 1, len(slopes) - 1])
+
+        assert np.all(mkk.slope_order_stats(t_us, obs, ranks) == slopes[ranks])
+        # The order of the data should not matter
+        perm = rng.permutation(n)
+        assert np.all(mkk.slope_order_stats(t_us[perm], obs[perm], ranks) == slopes[ranks])
+
+    t_us[1] = t_us[0]
+    pytest.raises(Exception, mkk.slope_order_stats, t_us, obs, ranks)
+
+def test_s_stat():
+    """ Test the s_stat() function.
+
+    This method specifically tests:
+        - S matches a brute force sum of signs, ignoring pairs in the same year and NaNs.
+    """
+
+    rng = np.random.default_rng(42)
+    obs = np.round(rng.normal(size=300), 1)
+    obs[::11] = np.nan
+    years = np.sort(rng.integers(2000, 2010, size=300))
+
+    (i, j) = np.triu_indices(300, k=1)
+    keep = years[i] != years[j]
+    s_brute = np.nansum(np.sign(obs[j][keep] - obs[i][keep]))
+
+    assert mkk.s_stat(obs, years) == s_brute
+    # Shuffling the points should not matter, as long as the years follow
+    perm = rng.permutation(300)
+    assert mkk.s_stat(obs[perm], years[perm]) == s_brute
+    # Trivial cases
+    assert mkk.s_stat(obs, np.ones(300, dtype=int)) == 0
+    assert mkk.s_stat(np.zeros(0), np.zeros(0, dtype=int)) == 0
+
+def test_s_stat_rows():
+    """ Test the s_stat_rows() function.
+
+    This method specifically tests:
+        - same S as s_stat() for each row, with ties in value and in time, and unsorted years
+    """
+
+    rng = np.random.default_rng(42)
+
+    for n in [1, 2, 7, 301]:
+        years = rng.integers(0, max(1, n // 3), n)
+        obs = np.round(rng.normal(size=(20, n)), 1)
+        assert np.array_equal(mkk.s_stat_rows(obs, years),
+                              [mkk.s_stat(item, years) for item in obs])
+
+def test_pairwise_stats(monkeypatch):
+    """ Test the pairwise_stats() function.
+
+    This method specifically tests:
+        - S matches s_stat(), and the order statistics match a sorted array of all the slopes.
+        - identical results with or without a memory limit, with several blocks.
+    """
+
+    # Force the use of several blocks
+    monkeypatch.setattr(mkh, 'PAIRWISE_BLOCK', 1000)
+
+    rng = np.random.default_rng(42)
+    n = 300
+    # Some identical times, that give infinite and NaN slopes
+    t_us = np.sort(rng.integers(0, 2000, n)) * 86400 * 10**6
+    obs = np.round(rng.normal(size=n), 1)
+    years = t_us // (365 * 86400 * 10**6)
+
+    (i, j) = np.triu_indices(n, k=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ref = np.sort((obs[j] - obs[i]) / ((t_us[j] - t_us[i]) / 1e6))
+    ranks = np.array([0, 1, 500, 22424, 22425, len(ref)-2, len(ref)-1])
+
+    for max_memory in [None, 10**6, 20000]:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            (s, out) = mkk.pairwise_stats(t_us, obs, ranks, years=years, max_memory=max_memory)
+        assert s == mkk.s_stat(obs, years)
+        assert np.array_equal(out, ref[ranks], equal_nan=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        assert mkk.pairwise_stats(t_us, obs, ranks)[0] is None
+    pytest.raises(Exception, mkk.pairwise_stats, t_us, obs, ranks, max_memory=100)
+
+def test_pairwise_stats_memory(monkeypatch):
+    """ Test the memory budget of the pairwise_stats() function.
+
+    This method specifically tests:
+        - the peak memory stays within max_memory on quantized data, where most slopes are tied.
+        - the order statistics match a sorted array of all the slopes.
+    """
+
+    monkeypatch.setattr(mkh, 'KERNEL_BACKEND', 'numpy')
+
+    rng = np.random.default_rng(42)
+    n = 2000
+    t_us = np.arange(n, dtype=np.int64) * 3600 * 10**6
+    years = t_us // (8760 * 3600 * 10**6)
+
+    # Warm up, so that the lazy imports of numpy are not counted
+    mkk.pairwise_stats(t_us[:300], np.round(rng.normal(size=300)), [5], max_memory=2**14)
+
+    (i, j) = np.triu_indices(n, k=1)
+    for obs in [np.round(rng.normal(size=n)), np.zeros(n), rng.normal(size=n)]:
+        ref = np.sort((obs[j] - obs[i]) / ((t_us[j] - t_us[i]) / 1e6))
+        ranks = np.array([0, len(ref) // 3, len(ref) // 2, len(ref) - 1])
+        for max_memory in [2**18, 2**20]:
+            tracemalloc.start()
+            (s, out) = mkk.pairwise_stats(t_us, obs, ranks, years=years, max_memory=max_memory)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert peak <= max_memory
+            assert s == mkk.s_stat(obs, years)
+            assert np.array_equal(out, ref[ranks])
+
+def test_pairwise_stats_float32():
+    """ Test the pairwise_stats() function in float32.
+
+    This method specifically tests:
+        - S is exact.
+        - the order statistics are within the documented error bound of the float64 ones.
+    """
+
+    rng = np.random.default_rng(42)
+    n = 300
+    t_us = np.sort(rng.integers(0, 2000, n)) * 86400 * 10**6
+    # A large offset, that float32 cannot resolve without the differences to obs[0]
+    obs = np.round(rng.normal(size=n), 1) + 1000
+    years = t_us // (365 * 86400 * 10**6)
+
+    (i, j) = np.triu_indices(n, k=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (obs[j] - obs[i]) / ((t_us[j] - t_us[i]) / 1e6)
+        # The error bound of each slope
+        (u, y_max, t_span) = (2.**-24, np.max(np.abs(obs - obs[0])), (t_us[-1] - t_us[0]) / 1e6)
+        bound = (2 * u * (y_max + np.abs(slopes) * t_span) / ((t_us[j] - t_us[i]) / 1e6) +
+                 3 * u * np.abs(slopes))
+    ref = np.sort(slopes)
+    bound = np.max(bound[np.isfinite(bound)])
+    ranks = np.array([0, 1, 500, 22424, 22425, len(ref)-2, len(ref)-1])
+
+    for max_memory in [None, 20000]:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            (s, out) = mkk.pairwise_stats(t_us, obs, ranks, years=years, max_memory=max_memory,
+                                          dtype='float32')
+        assert s == mkk.s_stat(obs, years)
+        assert out.dtype == np.float64
+        finite = np.isfinite(ref[ranks])
+        assert np.array_equal(out[~finite], ref[ranks][~finite], equal_nan=True)
+        assert np.all(np.abs(out[finite] - ref[ranks][finite]) <= bound)
+        assert np.any(out[finite] != ref[ranks][finite])
+
+    pytest.raises(Exception, mkk.pairwise_stats, t_us, obs, ranks, dtype='float16')
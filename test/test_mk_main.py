@@ -10,10 +10,16 @@ SPDX-License-Identifier: BSD-3-Clause
 # Import from other Python find_packages
 from pathlib import Path
 from datetime import datetime
+import os
+import subprocess
+import sys
+import tracemalloc
 import numpy as np
+import pytest
 
 # Import from current package
 from mannkendall import __version__
+from mannkendall import mk_hardcoded as mkh
 import mannkendall as mk
 
 # Get the local parameters I need to run the tests
@@ -36,6 +42,24 @@ def test_version():
     # Compare with the package version
     assert __version__ == version_ff
 
+def test_import():
+    """ Test the import of the package in a fresh process.
+
+    This method specifically tests:
+        - the slow modules are only imported when needed (the import time itself is measured by
+          benchmarks/bench_import.py).
+    """
+
+    code = ('import sys; import mannkendall; '
+            'print([item for item in ["scipy.stats", "scipy.fft", "numba"] '
+            'if item in sys.modules])')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(Path(mk.__file__).parents[1])] +
+                                                      sys.path))
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         env=env).stdout.split('\n')
+
+    assert out[0] == '[]'
+
 def test_prob_3pw():
     """ Test the prob_3pw() function.
 
@@ -104,6 +128,32 @@ def test_compute_mk_stats():
         assert np.round(out[2], TEST_TOLERANCE) == np.round(test_out3, TEST_TOLERANCE)
         assert np.round(out[3], TEST_TOLERANCE) == np.round(test_out4, TEST_TOLERANCE)
 
+def test_compute_mk_stats_dt64():
+    """ Test the compute_mk_stats() function with different types of datetimes.
+
+    This method specifically tests:
+        - numpy.datetime64 and int give the same results as datetime.datetime.
+
+    """
+
+    # Load the test data
+    test_in1 = load_test_data('compute_MK_stat_test1_in1.csv')
+    test_in2 = load_test_data('compute_MK_stat_test1_in2.csv')
+    test_in3 = float(load_test_data('compute_MK_stat_test1_in3.csv'))
+
+    # Create proper datetimes
+    test_in1_dts = np.array([datetime(int(item[0]), int(item[1]), int(item[2]),
+                                      int(item[3]), int(item[4]), int(item[5]))
+                             for item in test_in1])
+
+    out = mk.compute_mk_stat(test_in1_dts, test_in2, test_in3)
+    out_dt64 = mk.compute_mk_stat(test_in1_dts.astype('datetime64[s]'), test_in2, test_in3)
+    out_int = mk.compute_mk_stat(test_in1_dts.astype('datetime64[s]').astype(np.int64), test_in2,
+                                 test_in3)
+
+    assert out[0] == out_dt64[0] == out_int[0]
+    assert out[1:] == out_dt64[1:] == out_int[1:]
+
 def test_mk_temp_aggr_single():
     """ Test the mk_temp_aggr() function.
 
@@ -172,3 +222,195 @@ def test_mk_temp_aggr_single():
                 else:
                     assert np.round(out[tas_ind][item], TEST_TOLERANCE) == \
                            np.round(test_out[tas_ind][item_ind], TEST_TOLERANCE)
+
+def test_mk_temp_aggr_batch():
+    """ Test the mk_temp_aggr_batch() function.
+
+    This method specifically tests:
+        - same results as mk_temp_aggr() for each series
+        - masks, ragged and empty series
+    """
+
+    # load the data
+    test_in = load_test_data('MK_tempAggr_test3_in.csv')
+    n_tas = np.shape(test_in)[1] // 7
+
+    test_in_dts = [np.array([datetime(int(item[0]), int(item[1]), int(item[2]),
+                                      int(item[3]), int(item[4]), int(item[5]))
+                             for item in test_in[:, tas_ind:tas_ind+7]
+                             if not np.isnan(item[0])])
+                   for tas_ind in range(0, n_tas*7, 7)]
+    test_in_obs = [np.array([item[6] for item in test_in[:, tas_ind:tas_ind+7]
+                             if not np.isnan(item[0])])
+                   for tas_ind in range(0, n_tas*7, 7)]
+
+    # Build 3 series: the original one, a masked one, and an empty one
+    masks = [np.zeros((3, len(item)), dtype=bool) for item in test_in_obs]
+    for item in masks:
+        item[1, ::3] = True
+    batch_obs = [np.array([item, 2 * item, np.nan * item]) for item in test_in_obs]
+
+    out = mk.mk_temp_aggr_batch(test_in_dts, batch_obs, 0.01, masks=masks)
+    assert np.shape(out) == (3, n_tas+1)
+    assert np.all([np.isnan(out[2][item]) for item in out.dtype.names])
+
+    for series_ind in range(2):
+        obs = [np.where(masks[ind][series_ind], np.nan, item[series_ind])
+               for (ind, item) in enumerate(batch_obs)]
+        ref = mk.mk_temp_aggr(test_in_dts, obs, 0.01)
+        for tas_ind in range(n_tas+1):
+            for item in out.dtype.names:
+                assert np.array_equal(out[series_ind, tas_ind][item], ref[tas_ind][item],
+                                      equal_nan=True)
+
+    # Ragged series on a single temporal aggregation
+    out = mk.mk_temp_aggr_batch(test_in_dts[0], [test_in_obs[0], test_in_obs[0][:-5]], 0.01)
+    ref = mk.mk_temp_aggr(test_in_dts[0][:-5], test_in_obs[0][:-5], 0.01)
+    for item in out.dtype.names:
+        assert np.array_equal(out[1, 0][item], ref[0][item], equal_nan=True)
+
+def test_mk_temp_aggr_aliases(monkeypatch):
+    """ Test that mk_temp_aggr() tests identical prewhitened series only once.
+
+    This method specifically tests:
+        - without significant autocorrelation, a single MK test per temporal aggregation
+        - the results are those of the MK test of the original data
+    """
+
+    rng = np.random.default_rng(5)
+    obs_dts = np.datetime64('2000-01-01') + np.arange(0, 240 * 30, 30).astype('timedelta64[D]')
+    obs = np.round(rng.normal(size=240), 2)
+
+    calls = []
+    compute_mk_stat = mk.mk_main.compute_mk_stat
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return compute_mk_stat(*args, **kwargs)
+    monkeypatch.setattr(mk.mk_main, 'compute_mk_stat', counted)
+
+    out = mk.mk_temp_aggr([obs_dts[::2], obs_dts[1::2]], [obs[::2], obs[1::2]], 0.01)
+    assert len(calls) == 2
+
+    for ta_ind in range(2):
+        (ref, _, _, _) = compute_mk_stat(obs_dts[ta_ind::2], obs[ta_ind::2], 0.01)
+        assert out[ta_ind] == ref
+
+def test_mk_temp_aggr_float32(monkeypatch):
+    """ Test the dtype argument of mk_temp_aggr().
+
+    This method specifically tests:
+        - with float32 pairwise slopes, p and ss are identical, and the slopes and confidence
+          limits match the float64 ones within 1e-5 (relative to the slope), on the test data.
+        - unknown dtypes are refused.
+    """
+
+    # Compute all the pairwise slopes, rather than a slope selection
+    monkeypatch.setattr(mkh, 'SEN_SELECT_MIN_N', 10**6)
+
+    for test_id in [2, 3]:
+        test_in = load_test_data('MK_tempAggr_test%i_in.csv' % (test_id))
+        n_tas = np.shape(test_in)[1] // 7
+        test_in_dts = [np.array([datetime(*[int(val) for val in item[:6]])
+                                 for item in test_in[:, ind:ind+7] if not np.isnan(item[0])])
+                       for ind in range(0, n_tas*7, 7)]
+        test_in_obs = [np.array([item[6] for item in test_in[:, ind:ind+7]
+                                 if not np.isnan(item[0])])
+                       for ind in range(0, n_tas*7, 7)]
+
+        ref = mk.mk_temp_aggr(test_in_dts, test_in_obs, 0.01)
+        out = mk.mk_temp_aggr(test_in_dts, test_in_obs, 0.01, dtype='float32')
+
+        for (ind, item) in ref.items():
+            assert np.array_equal([item['p'], item['ss']], [out[ind]['p'], out[ind]['ss']],
+                                  equal_nan=True)
+            for key in ['slope', 'ucl', 'lcl']:
+                if np.isnan(item[key]):
+                    assert np.isnan(out[ind][key])
+                else:
+                    assert np.abs(out[ind][key] - item[key]) <= 1e-5 * np.abs(item['slope'])
+
+    pytest.raises(Exception, mk.mk_temp_aggr, test_in_dts, test_in_obs, 0.01, dtype='float16')
+
+class FakeDataArray:
+    """ The bare minimum of the xarray.DataArray interface, to test the duck typing. """
+
+    def __init__(self, values, dims, coords):
+        self.values = values
+        self.dims = dims
+        self.coords = coords
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    def __getitem__(self, key):
+        return FakeDataArray(self.coords[key], (key, ), {})
+
+def test_mk_temp_aggr_grid():
+    """ Test the mk_temp_aggr_grid() function.
+
+    This method specifically tests:
+        - same results as mk_temp_aggr() for each grid cell, whatever the chunks and time axis
+        - cells without valid data
+        - xarray-like input
+        - float32 input, that is not upcast as a whole
+    """
+
+    # load the data, as a single series
+    test_in = load_test_data('MK_tempAggr_test3_in.csv')
+    test_in = np.concatenate([test_in[:, ind:ind+7] for ind in range(0, np.shape(test_in)[1], 7)])
+    test_in = test_in[~np.isnan(test_in[:, 0])][::4]
+    obs_dts = np.array([datetime(*[int(val) for val in item[:6]]) for item in test_in])
+    obs = test_in[:, 6]
+
+    # A (time, 2, 2) grid, with one empty cell
+    grid = np.full((len(obs), 2, 2), np.nan)
+    (grid[:, 0, 0], grid[:, 0, 1], grid[:, 1, 1]) = (obs, -obs, np.where(obs > 3, obs, np.nan))
+
+    out = mk.mk_temp_aggr_grid(obs_dts, grid, 0.01, groups='season', chunk_cells=2)
+    assert np.shape(out) == (2, 2, 5)
+    assert np.all([np.isnan(out[1, 0][item]) for item in out.dtype.names])
+    for (row, col) in [(0, 0), (0, 1), (1, 1)]:
+        ref = mk.mk_temp_aggr(obs_dts, grid[:, row, col], 0.01, groups='season')
+        for ta_ind in range(5):
+            for item in out.dtype.names:
+                assert np.array_equal(out[row, col, ta_ind][item], ref[ta_ind][item],
+                                      equal_nan=True)
+
+    # Time axis last, and a single temporal aggregation
+    out = mk.mk_temp_aggr_grid(obs_dts, np.moveaxis(grid, 0, -1)[:1], 0.01, axis=-1)
+    ref = mk.mk_temp_aggr(obs_dts, obs, 0.01)
+    assert np.shape(out) == (1, 2, 2)
+    for item in out.dtype.names:
+        assert np.array_equal(out[0, 0, 0][item], ref[0][item], equal_nan=True)
+
+    # A xarray.DataArray, with the observation times as coordinate
+    data_array = FakeDataArray(grid[:, :1], ('time', 'lat', 'lon'), {'time': obs_dts})
+    out_da = mk.mk_temp_aggr_grid(None, data_array, 0.01, axis='time')
+    for item in out.dtype.names:
+        assert np.array_equal(out_da[..., 0][item], out[..., 0][item], equal_nan=True)
+
+    # float32 input: same results as the same values in float64
+    out = mk.mk_temp_aggr_grid(obs_dts, grid.astype(np.float32), 0.01, chunk_cells=2)
+    ref = mk.mk_temp_aggr_grid(obs_dts, grid.astype(np.float32).astype(float), 0.01)
+    for item in out.dtype.names:
+        assert np.array_equal(out[item], ref[item], equal_nan=True)
+
+    # A large float32 grid, mostly empty: only one chunk at a time is copied (and cast)
+    big = np.full((len(obs), 100, 100), np.nan, dtype=np.float32)
+    big[:, 0, :2] = grid[:, 0, :2]
+    peaks = []
+    for item in [big[:, :1, :2], big[:, :1, :2], big]:
+        tracemalloc.start()
+        out = mk.mk_temp_aggr_grid(obs_dts, item, 0.01, chunk_cells=200)
+        peaks += [tracemalloc.get_traced_memory()[1]]
+        tracemalloc.stop()
+    # Same as processing the valid cells alone, plus a few chunks
+    assert peaks[2] - peaks[1] < big.nbytes / 10
+    assert np.array_equal(out[0, :2, 0]['slope'], ref[0, :, 0]['slope'])
+
+    with pytest.raises(Exception):
+        mk.mk_temp_aggr_grid(None, grid, 0.01)
+    with pytest.raises(Exception):
+        mk.mk_temp_aggr_grid(obs_dts[:-1], grid, 0.01)
+    with pytest.raises(Exception):
+        mk.mk_temp_aggr_grid(obs_dts, grid.astype(str), 0.01)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+
+This file contains test functions for the mk_numba module.
+"""
+
+# Import from python packages
+from datetime import datetime
+import numpy as np
+import pytest
+
+# Import from current package
+import mannkendall as mk
+from mannkendall import mk_hardcoded as mkh
+from mannkendall import mk_kernels as mkk
+from mannkendall import mk_stats as mks
+
+# Get the local parameters I need to run the tests
+from .test_hardcoded import load_test_data
+
+pytest.importorskip('numba')
+
+def _both(monkeypatch, func, *args, **kwargs):
+    """ Run a function with the numpy and the numba backends. """
+
+    out = []
+    for backend in ['numpy', 'numba']:
+        monkeypatch.setattr(mkh, 'KERNEL_BACKEND', backend)
+        out += [func(*args, **kwargs)]
+
+    return out
+
+def test_kernels(monkeypatch):
+    """ Test the numba kernels.
+
+    This method specifically tests:
+        - identical results with numpy, for the inversions, S and the slopes.
+        - identical results with the bucketed (memory-bounded) pairwise statistics, in float64 and
+          float32.
+    """
+
+    rng = np.random.default_rng(42)
+
+    for n in [1, 2, 7, 64, 257]:
+        seq = rng.permutation(n)
+        (ref, out) = _both(monkeypatch, mkk.count_inversions, seq)
+        assert ref == out
+
+    # Ties in value and duplicated times
+    t_us = np.sort(rng.integers(0, 10**12, 400))
+    t_us[10:15] = t_us[10]
+    obs = np.round(rng.normal(size=400), 1)
+    years = t_us // 10**11
+    ranks = np.arange(0, 400 * 399 // 2, 997)
+
+    (ref, out) = _both(monkeypatch, mkk.s_stat, obs, years)
+    assert ref == out
+
+    rows = np.array([obs[rng.permutation(400)] for _ in range(3)])
+    (ref, out) = _both(monkeypatch, mkk.s_stat_rows, rows, years)
+    assert np.array_equal(ref, out)
+
+    # Also on quantized data, where most slopes are tied
+    for item in [obs, np.round(obs)]:
+        for max_memory in [None, 2**14]:
+            for dtype in ['float64', 'float32']:
+                (ref, out) = _both(monkeypatch, mkk.pairwise_stats, t_us, item, ranks,
+                                   years=years, max_memory=max_memory, dtype=dtype)
+                assert ref[0] == out[0]
+                assert np.array_equal(ref[1], out[1], equal_nan=True)
+
+def test_fixtures(monkeypatch):
+    """ Test the numba backend on the test data.
+
+    This method specifically tests:
+        - identical outputs of s_test(), sen_slope() and mk_temp_aggr() with numpy and numba.
+    """
+
+    test_in = load_test_data('Sen_slope_test1_in1.csv')
+    obs = load_test_data('Sen_slope_test1_in2.csv')
+    k_var = float(load_test_data('Sen_slope_test1_in3.csv'))
+    obs_dts = np.array([datetime(*[int(val) for val in item[:6]]) for item in test_in])
+
+    (ref, out) = _both(monkeypatch, mks.s_test, obs, obs_dts)
+    assert ref[0] == out[0]
+    for method in ['brute', 'chunked']:
+        (ref, out) = _both(monkeypatch, mks.sen_slope, obs_dts, obs, k_var, method=method)
+        assert ref == out
+
+    test_in = load_test_data('MK_tempAggr_test3_in.csv')
+    n_tas = np.shape(test_in)[1] // 7
+    multi_obs_dts = [np.array([datetime(*[int(val) for val in item[:6]])
+                               for item in test_in[:, ind:ind+7] if not np.isnan(item[0])])
+                     for ind in range(0, n_tas*7, 7)]
+    multi_obs = [np.array([item[6] for item in test_in[:, ind:ind+7] if not np.isnan(item[0])])
+                 for ind in range(0, n_tas*7, 7)]
+
+    (ref, out) = _both(monkeypatch, mk.mk_temp_aggr, multi_obs_dts, multi_obs, 0.01)
+    for (ind, item) in ref.items():
+        for key in item:
+            assert np.array_equal(item[key], out[ind][key], equal_nan=True)
+
+def test_backend(monkeypatch):
+    """ Test the choice of backend.
+
+    This method specifically tests:
+        - 'auto' uses numba if available, and numpy otherwise.
+        - errors for an unknown backend, or a missing numba.
+    """
+
+    monkeypatch.setattr(mkh, 'KERNEL_BACKEND', 'auto')
+    assert mkk.use_numba()
+    monkeypatch.setattr(mkk._mkn(), 'AVAILABLE', False) # pylint: disable=protected-access
+    assert not mkk.use_numba()
+
+    monkeypatch.setattr(mkh, 'KERNEL_BACKEND', 'numba')
+    pytest.raises(Exception, mkk.use_numba)
+    monkeypatch.setattr(mkh, 'KERNEL_BACKEND', 'cuda')
+    pytest.raises(Exception, mkk.use_numba)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+"""
+
+# Import from other Python packages
+import warnings
+from datetime import datetime
+import numpy as np
+
+# Import from current package
+import mannkendall as mk
+from mannkendall import mk_parallel as mkp
+
+# Get the local parameters I need to run the tests
+from .test_hardcoded import load_test_data
+
+def test_pmap():
+    """ Test the pmap() function.
+
+    This method specifically tests:
+        - deterministic ordering of the results, also for iterators in a pool
+        - warnings raised in the workers are re-emitted
+    """
+
+    args_list = [(item, 3) for item in range(20)]
+    assert mkp.pmap(pow, args_list) == [item**3 for item in range(20)]
+    assert mkp.pmap(pow, args_list, max_workers=2, chunksize=3) == [item**3 for item in range(20)]
+    assert mkp.pmap(pow, iter(args_list)) == [item**3 for item in range(20)]
+    assert mkp.pmap(pow, iter(args_list), max_workers=2, chunksize=3) == \
+           [item**3 for item in range(20)]
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        mkp.pmap(warnings.warn, [('a', UserWarning), ('b', RuntimeWarning)], max_workers=2)
+    assert [(str(item.message), item.category) for item in caught] == \
+           [('a', UserWarning), ('b', RuntimeWarning)]
+
+def test_mk_temp_aggr_parallel():
+    """ Test the max_workers argument of mk_temp_aggr() and mk_temp_aggr_batch().
+
+    This method specifically tests:
+        - same results in parallel and in series
+    """
+
+    # load the data
+    test_in = load_test_data('MK_tempAggr_test3_in.csv')
+    n_tas = np.shape(test_in)[1] // 7
+
+    test_in_dts = [np.array([datetime(int(item[0]), int(item[1]), int(item[2]),
+                                      int(item[3]), int(item[4]), int(item[5]))
+                             for item in test_in[:, tas_ind:tas_ind+7]
+                             if not np.isnan(item[0])])
+                   for tas_ind in range(0, n_tas*7, 7)]
+    test_in_obs = [np.array([item[6] for item in test_in[:, tas_ind:tas_ind+7]
+                             if not np.isnan(item[0])])
+                   for tas_ind in range(0, n_tas*7, 7)]
+
+    out = mk.mk_temp_aggr(test_in_dts, test_in_obs, 0.01)
+    out_par = mk.mk_temp_aggr(test_in_dts, test_in_obs, 0.01, max_workers=2, chunksize=2)
+    assert out.keys() == out_par.keys()
+    for key in out:
+        for item in out[key]:
+            assert np.array_equal(out[key][item], out_par[key][item], equal_nan=True)
+
+    batch_obs = [np.array([item, -item, 3 * item]) for item in test_in_obs]
+    out = mk.mk_temp_aggr_batch(test_in_dts, batch_obs, 0.01)
+    out_par = mk.mk_temp_aggr_batch(test_in_dts, batch_obs, 0.01, max_workers=2)
+    for item in out.dtype.names:
+        assert np.array_equal(out[item], out_par[item], equal_nan=True)
+
+    # A (time, 3) grid, split in chunks of 2 cells
+    grid = np.moveaxis(np.concatenate(batch_obs, axis=1), 0, -1)
+    obs_dts = np.concatenate(test_in_dts)
+    labels = np.concatenate([np.full(len(item), ind) for (ind, item) in enumerate(test_in_dts)])
+    out_par = mk.mk_temp_aggr_grid(obs_dts, grid, 0.01, groups=labels, chunk_cells=2,
+                                   max_workers=2)
+    for item in out.dtype.names:
+        assert np.array_equal(out[item], out_par[item], equal_nan=True)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2020 MeteoSwiss, contributors listed in AUTHORS.
+
+Distributed under the terms of the BSD 3-Clause License.
+
+SPDX-License-Identifier: BSD-3-Clause
+"""
+
+# Import from other Python packages
+import numpy as np
+import pytest
+
+# Import from current package
+import mannkendall as mk
+from mannkendall import mk_main as mkm
+from mannkendall import mk_stats as mks
+from mannkendall import mk_tools as mkt
+
+def test_mkstate():
+    """ Test the MKState class.
+
+    This method specifically tests:
+        - same S, n and variance as s_test() and kendall_var(), whatever the chunks appended
+        - rejection of unsorted times
+    """
+
+    rng = np.random.default_rng(42)
+
+    for resolution in [0.1, 0.5]:
+
+        obs_dts = np.sort(np.datetime64('2000-01-01') +
+                          rng.integers(0, 10*365*24, 500).astype('timedelta64[h]'))
+        obs = np.round(rng.normal(size=500) * 10 + np.arange(500) * 0.01, 1)
+        obs[rng.random(500) < 0.1] = np.nan
+
+        state = mk.MKState(resolution)
+        for chunk in np.array_split(np.arange(500), [1, 2, 10, 200, 201, 450]):
+            state.append(obs_dts[chunk], obs[chunk])
+
+        (s, n) = mks.s_test(obs, obs_dts)
+        valid = obs[~np.isnan(obs)]
+        # The tie bins are anchored at the first valid value
+        t = np.unique(mkt.tie_keys(valid, valid[0], resolution), return_counts=True)[1]
+        var = mkt.kendall_var(obs, t, n)
+
+        assert state.s == s
+        assert state.n_valid == len(valid)
+        assert np.all(state.n == n)
+        assert np.round(state.var, 6) == np.round(var, 6)
+        assert np.round(state.z, 6) == np.round(mks.std_normal_var(s, var), 6)
+        assert 0 <= state.p <= 1
+
+    pytest.raises(Exception, state.append, obs_dts[:1], obs[:1])
+
+    # Small samples: exact probability, as compute_mk_stat()
+    obs_dts = np.datetime64('2000-07-01') + np.arange(8) * np.timedelta64(365, 'D')
+    obs = np.array([1., 2, np.nan, 3, 5, 4, 6, 7])
+    state = mk.MKState(0.1, obs_dts[:3], obs[:3])
+    state.append(obs_dts[3:], obs[3:])
+    assert state.p == mkm.compute_mk_stat(obs_dts, obs, 0.1)[0]['p']
@@ -10,10 +10,13 @@ This file contains test functions for the mk_stats module.
 """
 
 # Import from python packages
-from datetime import datetime
+from datetime import datetime, timedelta
+import tracemalloc
 import numpy as np
+import pytest
 
 # Import from current package
+from mannkendall import mk_hardcoded as mkh
 from mannkendall import mk_stats as mks
 
 # Get the local parameters I need to run the tests
@@ -95,3 +98,85 @@ def test_sen_slope():
     assert np.round(out[0], TEST_TOLERANCE) == np.round(test_out1, TEST_TOLERANCE)
     assert np.round(out[1], TEST_TOLERANCE) == np.round(test_out2, TEST_TOLERANCE)
     assert np.round(out[2], TEST_TOLERANCE) == np.round(test_out3, TEST_TOLERANCE)
+
+def test_sen_slope_methods(monkeypatch):
+    """ Test the different methods of the sen_slope() function.
+
+    This method specifically tests:
+        - the 'brute', 'select' and 'chunked' methods give identical results.
+        - median_slope() gives the slope of sen_slope(), with all the methods.
+        - unknown methods are refused.
+    """
+
+    # Force the narrowing of the slope windows, even for small arrays
+    monkeypatch.setattr(mkh, 'SEN_SELECT_CAP', 100)
+    monkeypatch.setattr(mkh, 'SEN_SELECT_SAMPLE', 128)
+
+    rng = np.random.default_rng(42)
+    obs_dts = np.array([datetime(2000, 1, 1) + timedelta(days=int(item))
+                        for item in np.cumsum(rng.integers(1, 4, size=300))])
+    obs = np.round(rng.normal(size=300) + np.arange(300)/100, 1)
+    obs[::13] = np.nan
+
+    for alpha_cl in [50, 90, 99.9]:
+        out_brute = mks.sen_slope(obs_dts, obs, 1500., alpha_cl=alpha_cl, method='brute')
+        out_select = mks.sen_slope(obs_dts, obs, 1500., alpha_cl=alpha_cl, method='select')
+        assert out_brute == out_select
+        for max_memory in [None, 20000]:
+            assert mks.sen_slope(obs_dts, obs, 1500., alpha_cl=alpha_cl, method='chunked',
+                                 max_memory=max_memory) == out_brute
+
+    for method in ['brute', 'select', 'chunked']:
+        assert mks.median_slope(obs_dts, obs, method=method) == out_brute[0]
+    assert mks.median_slope(obs_dts, obs, method='chunked', max_memory=20000) == out_brute[0]
+
+    pytest.raises(Exception, mks.sen_slope, obs_dts, obs, 1500., method='fast')
+    pytest.raises(Exception, mks.sen_slope, obs_dts, obs, 1500., method='chunked', max_memory=100)
+    pytest.raises(Exception, mks.median_slope, obs_dts, obs, method='fast')
+
+def test_s_sen_slope():
+    """ Test the s_sen_slope() function.
+
+    This method specifically tests:
+        - same results as s_test() and sen_slope(), with both methods.
+    """
+
+    rng = np.random.default_rng(42)
+    obs_dts = np.array([datetime(2000, 1, 1) + timedelta(days=int(item))
+                        for item in np.cumsum(rng.integers(1, 30, size=300))])
+    obs = np.round(rng.normal(size=300) + np.arange(300)/100, 1)
+    obs[::13] = np.nan
+
+    (s, n) = mks.s_test(obs, obs_dts)
+    assert np.all(n == mks.year_counts(obs, obs_dts))
+
+    for method in ['brute', 'select']:
+        out = mks.s_sen_slope(obs_dts, obs, 1500., method=method)
+        assert out[0] == s
+        assert out[1:] == mks.sen_slope(obs_dts, obs, 1500., method=method)
+
+def test_s_sen_slope_memory(monkeypatch):
+    """ Test the memory footprint of the 'auto' method of s_sen_slope().
+
+    This method specifically tests:
+        - with duplicated times, the slopes are only all kept in memory if they fit in
+          SEN_CHUNKED_MEMORY, and the results are the ones of the 'brute' method.
+    """
+
+    monkeypatch.setattr(mkh, 'KERNEL_BACKEND', 'numpy')
+    monkeypatch.setattr(mkh, 'SEN_CHUNKED_MEMORY', 2**20)
+
+    rng = np.random.default_rng(42)
+    n = 2000
+    obs_dts = np.datetime64('2000-01-01') + np.arange(n) * np.timedelta64(1, 'D')
+    obs_dts[1] = obs_dts[0]
+    obs = np.round(rng.normal(size=n) + np.arange(n)/1000, 1)
+
+    ref = mks.s_sen_slope(obs_dts, obs, 1e6, method='brute')
+    tracemalloc.start()
+    out = mks.s_sen_slope(obs_dts, obs, 1e6)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert out == ref
+    # The 'brute' method would need 16 MB for the slopes alone
+    assert peak <= mkh.SEN_CHUNKED_MEMORY
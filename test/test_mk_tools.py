@@ -10,12 +10,16 @@ This file contains test functions for the mk_tools module.
 """
 
 # Import from python packages
-from datetime import datetime
+from datetime import datetime, timedelta
 import numpy as np
 import pytest
+from scipy import stats as spstats
+from scipy.signal import lfilter
 
 # Import from current package
+from mannkendall import mk_stats as mks
 from mannkendall import mk_tools as mkt
+from mannkendall import mk_white as mkw
 
 # Get the local parameters I need to run the tests
 from .test_hardcoded import load_test_data, TEST_TOLERANCE
@@ -25,6 +29,7 @@ def test_de_sort():
 
     This method specifically tests:
         - correct indices swapping.
+        - inverse permutation, and de-sorting along the last axis.
     """
 
     a = np.random.rand(50)
@@ -32,6 +37,35 @@ def test_de_sort():
 
     assert np.all(a == mkt.de_sort(a[sort_inds], sort_inds))
 
+    unsort_inds = mkt.de_sort(np.arange(50), sort_inds)
+    assert np.all(a == a[sort_inds][unsort_inds])
+
+    b = np.random.rand(3, 50)
+    assert np.all(b == mkt.de_sort(b[:, sort_inds], sort_inds))
+
+def test_tie_keys():
+    """ Test the tie_keys() utility function.
+
+    This method specifically tests:
+        - same bins as numpy.histogram() with numpy.linspace() edges, for data on the edges
+        - bins of size resolution without n_bins, also below the origin
+    """
+
+    rng = np.random.default_rng(42)
+    data = np.round(rng.normal(size=1000) * 5, 1) + 0.3
+    for resolution in [0.1, 0.2, 0.3]:
+        n_bins = int(np.ptp(data) // resolution + 1)
+        edges = np.linspace(np.min(data), np.min(data) + n_bins * resolution, n_bins + 1)
+        keys = mkt.tie_keys(data, np.min(data), resolution, n_bins=n_bins)
+        assert np.array_equal(np.bincount(keys, minlength=n_bins),
+                              np.histogram(data, bins=edges)[0])
+        assert np.all(mkt.tie_keys(data, np.max(data), resolution, n_bins=n_bins)[data <
+                                                                                np.max(data)] == -1)
+
+    edges = 1.3 + np.arange(-1000, 1000) * 0.1
+    keys = mkt.tie_keys(data, 1.3, 0.1)
+    assert np.array_equal(keys, np.searchsorted(edges, data, side='right') - 1001)
+
 def test_dt_to_s():
     """ Test the dt_to_s utility function.
 
@@ -55,23 +89,94 @@ def test_dt_to_s():
     assert np.all(mkt.dt_to_s(dts-np.array([t_1])) ==
                   np.array([0, 1, 60, 3600, 3600*24, 3600*24*31, 3600*24*366]))
 
+    # Check that numpy.timedelta64 are supported, with the same result as total_seconds()
+    dts = np.array([t_1, t_1 + timedelta(days=7000, microseconds=3), t_7])
+    assert np.all(mkt.dt_to_s(dts.astype('datetime64[ns]') - np.datetime64(t_1)) ==
+                  np.array([(item - t_1).total_seconds() for item in dts]))
+
+def test_dts_to_dt64():
+    """ Test the dts_to_dt64 utility function.
+
+    This method specifically tests:
+        - proper handling of datetime.datetime, numpy.datetime64 and int.
+        - the elapsed time and years derived from it.
+    """
+
+    dts = [datetime(2019, 12, 31, 23, 59, 59), datetime(2020, 1, 1, 0, 0, 0)]
+    out = mkt.dts_to_dt64(dts)
+
+    assert out.dtype == np.dtype('datetime64[us]')
+    assert np.all(mkt.dts_to_dt64(np.array(dts, dtype='datetime64[s]')) == out)
+    assert np.all(mkt.dts_to_dt64(np.array([1577836799, 1577836800])) == out)
+    assert np.all(mkt.dts_to_us(dts) == np.array([0, 10**6]))
+    assert np.all(mkt.dts_to_years(out) == np.array([2019, 2020]))
+
+    pytest.raises(Exception, mkt.dts_to_dt64, np.array([1.5, 2.5]))
+    pytest.raises(Exception, mkt.dts_to_dt64, np.array(['a', 'b'], dtype=object))
+
+def test_time_index():
+    """ Test the TimeIndex class.
+
+    This method specifically tests:
+        - same times, elapsed times and years as the conversion functions
+        - selections, and year counts
+        - same results for the routines given a TimeIndex or the times
+    """
+
+    rng = np.random.default_rng(42)
+    obs_dts = np.datetime64('2000-03-01') + np.cumsum(rng.integers(1, 30, 200)).astype('m8[D]')
+    obs = np.round(rng.normal(size=200) + np.arange(200) / 50, 1)
+    obs[::7] = np.nan
+    tindex = mkt.TimeIndex(obs_dts)
+
+    assert len(tindex) == 200
+    assert mkt.dts_to_dt64(tindex) is tindex.dts
+    assert np.array_equal(mkt.dts_to_us(tindex), mkt.dts_to_us(obs_dts))
+    assert np.array_equal(mkt.dts_to_years(tindex), mkt.dts_to_years(obs_dts))
+    assert tindex.n_years == np.ptp(mkt.dts_to_years(obs_dts)) + 1
+    assert mkt.TimeIndex(tindex).dts is tindex.dts
+
+    # Selections are re-referenced to their first time
+    sub = tindex[10:]
+    assert np.array_equal(sub.t_us, mkt.dts_to_us(obs_dts[10:]))
+    assert np.array_equal(sub.year_codes, mkt.dts_to_years(obs_dts[10:]) - 2000)
+
+    assert np.array_equal(tindex.year_counts(obs), mks.year_counts(obs, obs_dts))
+
+    # The routines do not care
+    assert mks.s_test(obs, tindex)[0] == mks.s_test(obs, obs_dts)[0]
+    assert np.array_equal(mks.s_test(obs, tindex)[1], mks.s_test(obs, obs_dts)[1])
+    t = mkt.nb_tie(obs, 0.1)
+    vari = mkt.kendall_var(obs, t, mks.year_counts(obs, obs_dts))
+    assert mkt.kendall_var(obs, t, tindex) == vari
+    assert mks.sen_slope(tindex, obs, vari) == mks.sen_slope(obs_dts, obs, vari)
+    out = mkw.prewhite(obs.copy(), tindex, 0.1)
+    ref = mkw.prewhite(obs.copy(), obs_dts, 0.1)
+    for key in ref:
+        assert np.array_equal(out[key], ref[key], equal_nan=True)
+
 def test_nb_tie():
     """ Test the nb_tie function.
 
     This method specifically tests:
         - proper sectioning of the data array.
+        - 2-D batches of series
+        - data with a large range compared to the resolution
     """
 
    # A few basic tests to begin with
     pytest.raises(Exception, mkt.nb_tie, 'a', 2) # Check exceptions
     pytest.raises(Exception, mkt.nb_tie, np.zeros(2), '2') # Check exceptions
+    pytest.raises(Exception, mkt.nb_tie, np.zeros((2, 2, 2)), 2) # Check exceptions
     assert np.isnan(mkt.nb_tie(np.zeros(5) * np.nan, 2)) # nan if all nan's
     assert np.isnan(mkt.nb_tie(np.zeros(4), 2)) # nans if less than 4 valid data points.
     assert np.all(mkt.nb_tie(np.ones(5), 2) == np.array([5])) # Identical values
     assert np.all(mkt.nb_tie(np.array([0, 0, 0, 1, 1]), 2.4) == np.array([5])) # res > interval
     assert np.all(mkt.nb_tie(np.array([1, 1, 1, 1, 1, np.nan]), 2.4) == np.array([5])) # same values
+    # Only the non-empty bins are returned
+    assert np.all(mkt.nb_tie(np.array([0, 0, 0.1, 5, 5, 5]), 1) == np.array([3, 3]))
 
-    # Now some validation tests with matlab
+    # Now some validation tests with matlab. Only the non-empty bins are returned.
     test_params = {'1': 2.,
                    '2': 0.01}
 
@@ -82,7 +187,23 @@ def test_nb_tie():
         # Run the function
         out = mkt.nb_tie(test_data, test_params[test_id])
 
-        assert np.all(np.round(out, TEST_TOLERANCE) == np.round(test_out, TEST_TOLERANCE))
+        assert np.all(np.round(out, TEST_TOLERANCE) ==
+                      np.round(test_out[test_out > 0], TEST_TOLERANCE))
+
+    # 2-D batches
+    rng = np.random.default_rng(42)
+    data = np.round(rng.normal(size=(5, 50)), 1)
+    data[1, 3:] = np.nan
+    data[2, ::2] = np.nan
+    out = mkt.nb_tie(data, 0.2)
+    assert len(out) == 5
+    for (ind, item) in enumerate(data):
+        assert np.array_equal(out[ind], mkt.nb_tie(item, 0.2), equal_nan=True)
+    assert np.isnan(out[1])
+
+    # Large range: no need for 10**12 bins
+    data = np.array([0, 1e-3, 1e-3, 1e9, 1e9, 1e9 + 1e-3])
+    assert np.all(mkt.nb_tie(data, 1e-3) == np.array([1, 2, 2, 1]))
 
 def test_kendall_var():
     """ Test the kendall_var function.
@@ -116,25 +237,52 @@ def test_nanautocorr():
 
     assert np.all(np.round(out[0], TEST_TOLERANCE) == np.round(test_out, TEST_TOLERANCE))
 
-def test_levinson():
-    """ Test the levinson function.
+def test_nanautocorr_pearson():
+    """ Test the nanautocorr function against a lag-by-lag Pearson r computation.
 
     This method specifically tests:
-        - method returns are similar to the matlab implementation.
+        - all the lags, with NaNs in the data
     """
 
-    # TODO: fix this test
-    assert True
+    rng = np.random.default_rng(42)
+    obs = np.cumsum(rng.normal(size=500)) + 100
+    obs[rng.random(500) < 0.3] = np.nan
 
-    # Compute the autocorrelation
-    #(x, _) = mkt.nanautocorr(TEST_DATA[:, 6], 6, r=5)
+    out = mkt.nanautocorr(obs, 20)[0]
+    assert out[0] == 1
 
-    # Compute the confidence limits for the autocorrelation
-    #x_1 = x / np.count_nonzero(~np.isnan(TEST_DATA[:, 6]))
-    #n = 5
+    for lag in range(1, 21):
+        msk = ~np.isnan(obs[lag:]) & ~np.isnan(obs[:-lag])
+        ref = spstats.pearsonr(obs[lag:][msk], obs[:-lag][msk])[0]
+        assert np.round(out[lag], TEST_TOLERANCE) == np.round(ref, TEST_TOLERANCE)
 
-    #out = mkt.levinson(x_1, n)
+def test_levinson():
+    """ Test the levinson function.
+
+    This method specifically tests:
+        - the coefficients solve the Yule-Walker equations.
+        - the prediction error and the reflection coefficients.
+        - identical results for a batch of autocorrelations.
+    """
 
-    #assert np.all(np.round(out[0], 4) == np.array([1, -0.7633, -0.9680, 1.0503, 0.7590, -1.0868]))
-    #assert np.round(out[1], 4) == -0.0026
-    #assert np.all(np.round(out[2], 4) == np.array([-0.8257, -0.6392, 0.1673, 0.3899, -1.0868]))
+    rng = np.random.default_rng(42)
+    obs = np.array([lfilter([1], [1, -0.6, 0.2], rng.normal(size=500)) for _ in range(4)])
+    r = np.array([mkt.nanautocorr(item, 10, 5)[0] for item in obs]) / 500
+
+    for n in [1, 5]:
+        (a, e, k) = mkt.levinson(r, n)
+        for (ind, item) in enumerate(r):
+            toeplitz = item[np.abs(np.subtract.outer(np.arange(n), np.arange(n)))]
+            assert np.allclose(toeplitz @ a[ind, 1:], -item[1:n+1], rtol=0, atol=1e-12)
+            assert np.round(e[ind], TEST_TOLERANCE) == np.round(item[:n+1] @ a[ind],
+                                                                TEST_TOLERANCE)
+            # The last reflection coefficient is the last coefficient of the model
+            assert k[ind, -1] == a[ind, -1]
+
+            out = mkt.levinson(item, n)
+            assert np.array_equal(out[0], a[ind]) and out[1] == e[ind]
+            assert np.array_equal(out[2], k[ind])
+
+    # The reflection coefficients are the coefficients of the models of lower orders
+    assert np.array_equal(mkt.levinson(r, 1)[2][:, 0], k[:, 0])
+    assert np.allclose(mkt.levinson(r, 3)[0][:, -1], k[:, 2], rtol=0, atol=1e-15)
@@ -12,6 +12,7 @@ This file contains test functions for the mk_white module.
 # Import from python packages
 from datetime import datetime
 import numpy as np
+import pytest
 
 # Import from current package
 from mannkendall import mk_white as mkw
@@ -86,3 +87,118 @@ def test_prewhite():
                 else:
                     assert np.round(out[item][jnd], TEST_TOLERANCE) == np.round(jtem,
                                                                                 TEST_TOLERANCE)
+
+def test_prewhite_cache(tmp_path):
+    """ test the PrewhiteCache class.
+
+    This method specifcally tests:
+        - identical outputs with and without the cache
+        - the cache returns copies, and respects its maximum size
+        - the store on disk
+    """
+
+    test_in = load_test_data('prewhite_test1_in.csv')
+    test_in_dts = np.array([datetime(int(item[0]), int(item[1]), int(item[2]),
+                                     int(item[3]), int(item[4]), int(item[5]))
+                            for item in test_in])
+
+    ref = mkw.prewhite(test_in[:, 6], test_in_dts, 2)
+
+    cache = mkw.PrewhiteCache(maxsize=1, path=tmp_path)
+    for _ in range(2):
+        out = mkw.prewhite(test_in[:, 6], test_in_dts, 2, cache=cache)
+        for item in mkw.PW_KEYS:
+            assert np.array_equal(out[item], ref[item], equal_nan=True)
+        out['pw'][:] = 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A different alpha_ak is a different entry, that pushes the first one out of memory.
+    mkw.prewhite(test_in[:, 6], test_in_dts, 2, alpha_ak=90, cache=cache)
+    assert len(cache) == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # ... but it is still on disk, for this cache and any other one.
+    other_cache = mkw.PrewhiteCache(path=tmp_path)
+    for item in [cache, other_cache]:
+        out = mkw.prewhite(test_in[:, 6], test_in_dts, 2, cache=item)
+        assert np.array_equal(out['vctfpw'], ref['vctfpw'], equal_nan=True)
+    assert (cache.hits, other_cache.hits, other_cache.misses) == (2, 1, 0)
+
+def test_prewhite_diagnostics(tmp_path):
+    """ test the diagnostics of the prewhite() function.
+
+    This method specifcally tests:
+        - the Wang & Swail diagnostics, on both test datasets
+        - the diagnostics survive the cache, in memory and on disk
+        - the identical prewhitened series are found
+    """
+
+    test_params = {'1': (2, 1, 'not_significant'), '2': (0.01, 0, 'converged')}
+
+    for (test_id, (resolution, nb_loop, stop)) in test_params.items():
+        test_in = load_test_data('prewhite_test%s_in.csv' % (test_id))
+        test_in_dts = np.array([datetime(int(item[0]), int(item[1]), int(item[2]),
+                                         int(item[3]), int(item[4]), int(item[5]))
+                                for item in test_in])
+
+        ref = mkw.prewhite(test_in[:, 6], test_in_dts, resolution)
+        assert isinstance(ref, mkw.PrewhiteResult)
+        assert ref.diagnostics['ws_iterations'] == nb_loop
+        assert ref.diagnostics['ws_stop'] == stop
+        assert ref.diagnostics['ak_pw'] >= 0.05
+
+        # The first cache computes the output, the second one reads it from disk.
+        for _ in range(2):
+            cache = mkw.PrewhiteCache(path=tmp_path)
+            out = mkw.prewhite(test_in[:, 6], test_in_dts, resolution, cache=cache)
+            assert out.diagnostics == ref.diagnostics
+
+    # No autocorrelation: Wang & Swail does not run.
+    obs = np.arange(50, dtype=float) % 7
+    out = mkw.prewhite(obs, test_in_dts[:50], 0.01)
+    assert out.diagnostics['ws_stop'] == 'not_run'
+    assert out.diagnostics['ws_iterations'] == 0
+    assert out.aliases() == {item: 'pw' for item in mkw.PW_KEYS}
+    assert len(set(ref.aliases().values())) == 5
+
+def test_prewhite_copy():
+    """ test the copy argument of the prewhite() function.
+
+    This method specifcally tests:
+        - obs is never modified, even with infinites
+        - identical outputs with copy=True and copy=False, with and without the cache
+        - copy=False returns read-only arrays, shared by the identical series
+        - copy=True returns independent arrays
+    """
+
+    test_in = load_test_data('prewhite_test2_in.csv')
+    test_in_dts = np.array([datetime(int(item[0]), int(item[1]), int(item[2]),
+                                     int(item[3]), int(item[4]), int(item[5]))
+                            for item in test_in])
+    obs = test_in[:, 6].copy()
+    obs[5] = np.inf
+
+    ref = mkw.prewhite(obs, test_in_dts, 0.01)
+    assert np.isinf(obs[5])
+    assert np.isnan(ref['pw'][5])
+
+    cache = mkw.PrewhiteCache()
+    for item in [None, cache, cache]:
+        out = mkw.prewhite(obs, test_in_dts, 0.01, cache=item, copy=False)
+        for key in mkw.PW_KEYS:
+            assert np.array_equal(out[key], ref[key], equal_nan=True)
+            assert not out[key].flags.writeable
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Without significant autocorrelation, all the series are the same.
+    obs = np.arange(50, dtype=float) % 7
+    out = mkw.prewhite(obs, test_in_dts[:50], 0.01, copy=False)
+    assert len({id(out[key]) for key in mkw.PW_KEYS}) == 1
+    pytest.raises(ValueError, out['pw'].fill, 0)
+
+    for item in [None, cache]:
+        out = mkw.prewhite(obs, test_in_dts[:50], 0.01, cache=item)
+        out['pw'][:] = -1
+        for key in mkw.PW_KEYS[1:]:
+            assert np.array_equal(out[key], obs)
+    assert np.array_equal(obs, np.arange(50) % 7)